@@ -0,0 +1,255 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+import numpy as np
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import AppSession
+from app.events import emit_alert, emit_stats
+from app.models import Alert, AlertSeverity, AlertType, Device, SystemConfig
+from app.response_cache import touch
+from app.shared_counters import counters
+
+logger = logging.getLogger(__name__)
+
+# Keys in Session.info holding rule states and raised alerts until the transaction commits
+PENDING_STATES = "pending_alert_states"
+PENDING_RAISED = "pending_alerts_raised"
+
+
+class AlertRule(NamedTuple):
+    key: str  # SystemConfig key of the threshold
+    metric: str
+    above: bool  # Alert when the value goes above the threshold, else below
+    alert_type: AlertType
+    severity: AlertSeverity
+    message: str
+
+
+RULES = (
+    AlertRule("max_voltage", "voltage", True, AlertType.OVERVOLTAGE, AlertSeverity.HIGH,
+              "Điện áp vượt quá mức cho phép: {value:.2f}V"),
+    AlertRule("min_voltage", "voltage", False, AlertType.UNDERVOLTAGE, AlertSeverity.MEDIUM,
+              "Điện áp thấp hơn mức cho phép: {value:.2f}V"),
+    AlertRule("max_current", "current", True, AlertType.OVERCURRENT, AlertSeverity.HIGH,
+              "Dòng điện vượt quá mức cho phép: {value:.2f}A"),
+    AlertRule("max_power", "power", True, AlertType.OVERPOWER, AlertSeverity.HIGH,
+              "Công suất vượt quá mức cho phép: {value:.0f}W"),
+)
+
+# Used when system_config has no row for a key; max_power has no global default
+DEFAULTS = {
+    "max_voltage": 250.0,
+    "min_voltage": 200.0,
+    "max_current": 16.0,
+    "alert_hysteresis_percent": 2.0,
+    "alert_cooldown_seconds": 300.0,
+}
+
+
+def config_number(config: Dict[str, str], key: str) -> float:
+    """A numeric config value; an empty value disables the rule (NaN)"""
+    value = config.get(key)
+    if value is None:
+        return DEFAULTS.get(key, np.nan)
+    if not value.strip():
+        return np.nan
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning("Ignoring non-numeric system_config %s=%r", key, value)
+        return DEFAULTS.get(key, np.nan)
+
+
+class CompiledRules(NamedTuple):
+    # (rule, device id) -> threshold; the last column is for devices created since
+    thresholds: np.ndarray
+    hysteresis: float  # Fraction of the threshold a value must recover by to clear
+    cooldown: timedelta
+    devices_version: int
+    loaded_at: float
+
+
+class AlertEngine:
+    """Threshold alerts evaluated over whole batches of readings.
+    
+    Thresholds come from ``system_config``: ``max_voltage`` applies to
+    every device, ``max_voltage.heater`` to one device type and
+    ``max_voltage.device.12`` to one device, the most specific winning.
+    They are compiled into a rule x device array, reloaded every
+    ``ALERT_RULES_REFRESH_SECONDS`` or when a device changes.
+    
+    Each (rule, device) pair is a small state machine: it becomes active
+    when a reading crosses the threshold and clears only once a reading
+    recovers past it by ``alert_hysteresis_percent``, so only the start of
+    an excursion raises an alert. Active states live in process memory
+    and only change once the readings' transaction commits, so a batch
+    that is rolled back and retried raises its alerts again;
+    ``alert_cooldown_seconds`` additionally suppresses an alert when the
+    same device and type already alerted recently, which also covers
+    other workers and restarts.
+    """
+    
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self.raised = 0
+        self.suppressed = 0
+        self._rules: Optional[CompiledRules] = None
+        self._active = np.zeros((len(RULES), 0), dtype=bool)
+        self._lock = threading.Lock()
+    
+    def rules(self, db: Session) -> CompiledRules:
+        rules = self._rules
+        version = counters.get("devices")
+        if rules is None or rules.devices_version != version or time.monotonic() - rules.loaded_at > self.refresh_seconds:
+            rules = self._rules = self.compile(db, version)
+        return rules
+    
+    def compile(self, db: Session, devices_version: int) -> CompiledRules:
+        config = dict(db.query(SystemConfig.config_key, SystemConfig.config_value).all())
+        devices = db.query(Device.id, Device.device_type).all()
+        
+        size = max((device_id for device_id, _ in devices), default=0) + 2
+        thresholds = np.empty((len(RULES), size))
+        for index, rule in enumerate(RULES):
+            thresholds[index] = config_number(config, rule.key)
+            for device_id, device_type in devices:
+                for key in (f"{rule.key}.device.{device_id}", f"{rule.key}.{getattr(device_type, 'value', device_type)}"):
+                    if key in config:
+                        thresholds[index, device_id] = config_number(config, key)
+                        break
+        
+        return CompiledRules(
+            thresholds,
+            config_number(config, "alert_hysteresis_percent") / 100,
+            timedelta(seconds=config_number(config, "alert_cooldown_seconds")),
+            devices_version,
+            time.monotonic()
+        )
+    
+    def evaluate(self, db: Session, readings: List[dict]) -> List[Alert]:
+        """Add alerts for excursions that start in ``readings`` to the session"""
+        rules = self.rules(db)
+        count = len(readings)
+        
+        # Time order within each device. Batches usually arrive sorted, and
+        # comparing datetimes is much cheaper than converting them to NumPy
+        recorded_at = [reading["recorded_at"] for reading in readings]
+        if any(later < earlier for earlier, later in zip(recorded_at, recorded_at[1:])):
+            by_time = np.array(sorted(range(count), key=recorded_at.__getitem__), dtype=np.int64)
+        else:
+            by_time = np.arange(count)
+        device = np.fromiter((reading["device_id"] for reading in readings), dtype=np.int64, count=count)[by_time]
+        by_device = np.argsort(device, kind="stable")
+        order = by_time[by_device]
+        device = device[by_device]
+        column = np.minimum(device, rules.thresholds.shape[1] - 1)
+        
+        position = np.arange(count)
+        first = np.r_[True, device[1:] != device[:-1]]
+        group_start = np.maximum.accumulate(np.where(first, position, 0))
+        last = np.r_[first[1:], True]
+        
+        values: Dict[str, np.ndarray] = {}
+        candidates = []
+        with self._lock:
+            if device.max() >= self._active.shape[1]:
+                grown = np.zeros((len(RULES), int(device.max()) + 1), dtype=bool)
+                grown[:, :self._active.shape[1]] = self._active
+                self._active = grown
+            
+            for index, rule in enumerate(RULES):
+                limit = rules.thresholds[index, column]
+                if np.isnan(limit).all():
+                    continue
+                if rule.metric not in values:
+                    # None becomes NaN, which never crosses a threshold
+                    values[rule.metric] = np.array([reading.get(rule.metric) for reading in readings], dtype=np.float64)[order]
+                value = values[rule.metric]
+                
+                band = np.abs(limit) * rules.hysteresis
+                if rule.above:
+                    breach = value > limit
+                    clear = value <= limit - band
+                else:
+                    breach = value < limit
+                    clear = value >= limit + band
+                
+                # State after each reading: that of the last breach/clear in its
+                # device's run, or the state carried over from earlier batches
+                initial = self._active[index, device]
+                latest_event = np.maximum.accumulate(np.where(breach | clear, position, -1))
+                seen = latest_event >= group_start
+                state = np.where(seen, breach[np.maximum(latest_event, 0)], initial)
+                before = np.where(first, initial, np.r_[False, state[:-1]])
+                
+                for i in np.flatnonzero(breach & ~before):
+                    candidates.append((int(device[i]), rule, float(value[i]), recorded_at[order[i]]))
+                
+                db.info.setdefault(PENDING_STATES, []).append((index, device[last], state[last]))
+        
+        if not candidates:
+            return []
+        return self._raise(db, candidates, rules.cooldown)
+    
+    def _raise(self, db: Session, candidates: list, cooldown: timedelta) -> List[Alert]:
+        device_ids = {candidate[0] for candidate in candidates}
+        recent = set(tuple(row) for row in db.query(Alert.device_id, Alert.alert_type).filter(
+            Alert.device_id.in_(device_ids),
+            Alert.alert_type.in_({candidate[1].alert_type for candidate in candidates}),
+            Alert.created_at >= datetime.now() - cooldown
+        ).distinct())
+        
+        alerts = []
+        # Within the batch, excursions closer than the cooldown (by reading time) alert once
+        last_raised = {}
+        for device_id, rule, value, moment in candidates:
+            pair = (device_id, rule.alert_type)
+            if pair in recent or (pair in last_raised and moment - last_raised[pair] < cooldown):
+                self.suppressed += 1
+                continue
+            last_raised[pair] = moment
+            alerts.append(Alert(
+                device_id=device_id,
+                alert_type=rule.alert_type,
+                message=rule.message.format(value=value),
+                severity=rule.severity
+            ))
+        if not alerts:
+            return []
+        
+        db.add_all(alerts)
+        db.flush()
+        db.info[PENDING_RAISED] = db.info.get(PENDING_RAISED, 0) + len(alerts)
+        
+        touch(db, "alerts")
+        devices = {device.id: device for device in db.query(Device).filter(Device.id.in_(device_ids))}
+        for alert in alerts:
+            emit_alert(db, alert, devices.get(alert.device_id))
+        unread = db.query(func.count(Alert.id)).filter(Alert.is_read == False).scalar()
+        emit_stats(db, {"unread_alerts": unread})
+        return alerts
+    
+    def _after_commit(self, session: Session):
+        states = session.info.pop(PENDING_STATES, ())
+        self.raised += session.info.pop(PENDING_RAISED, 0)
+        with self._lock:
+            for index, devices, active in states:
+                self._active[index, devices] = active
+    
+    def _after_transaction_end(self, session: Session, transaction):
+        if transaction.parent is None:
+            # Rolled back: the readings were never stored
+            session.info.pop(PENDING_STATES, None)
+            session.info.pop(PENDING_RAISED, None)
+    
+    def stats(self) -> dict:
+        return {"raised": self.raised, "suppressed": self.suppressed}
+
+
+alert_engine = AlertEngine(settings.ALERT_RULES_REFRESH_SECONDS)
+event.listen(AppSession, "after_commit", alert_engine._after_commit)
+event.listen(AppSession, "after_transaction_end", alert_engine._after_transaction_end)
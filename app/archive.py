@@ -0,0 +1,243 @@
+import logging
+import os
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import EnergyDaily, PowerData, PowerRollup
+from app.rollups import ROLLUP_RESOLUTIONS, day_range, to_epoch
+from app.timebucket import bucket_aggregates
+
+logger = logging.getLogger(__name__)
+
+# Column name -> dtype of an archived day, in export column order
+ARCHIVE_COLUMNS = {
+    "id": np.int64,
+    "device_id": np.int64,
+    "recorded_at": "datetime64[us]",
+    "voltage": np.float64,
+    "current": np.float64,
+    "power": np.float64,
+    "energy": np.float64,
+    "power_factor": np.float64,
+    "frequency": np.float64,
+}
+
+DAY_FILE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.npz$")
+
+# Archived ids deleted per statement, below SQLite's bound parameter limit
+DELETE_BATCH_ROWS = 10000
+
+# Bucketed whole days kept per (day file version, width, device)
+CACHED_DAY_BUCKETS = 256
+
+Day = Dict[str, np.ndarray]
+
+
+def day_path(day: date) -> str:
+    return os.path.join(settings.ARCHIVE_DIR, f"{day.isoformat()}.npz")
+
+
+def archived_days(start: Optional[date] = None, end: Optional[date] = None) -> List[date]:
+    """Archived days in [start, end], oldest first"""
+    if not os.path.isdir(settings.ARCHIVE_DIR):
+        return []
+    days = []
+    for name in os.listdir(settings.ARCHIVE_DIR):
+        match = DAY_FILE.match(name)
+        if not match:
+            continue
+        day = date.fromisoformat(match.group(1))
+        if (start is None or day >= start) and (end is None or day <= end):
+            days.append(day)
+    return sorted(days)
+
+
+def load_day(day: date) -> Day:
+    """Columns of one archived day, sorted by recorded_at"""
+    with np.load(day_path(day)) as archive:
+        return {column: archive[column] for column in ARCHIVE_COLUMNS}
+
+
+def save_day(day: date, columns: Day):
+    """Write a day file atomically, so readers never see a partial file"""
+    os.makedirs(settings.ARCHIVE_DIR, exist_ok=True)
+    path = day_path(day)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, **columns)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def select_rows(columns: Day, start: Optional[datetime], end: Optional[datetime], device_id: Optional[int]) -> Day:
+    """Rows of an archived day in [start, end), optionally for one device"""
+    mask = np.ones(len(columns["id"]), dtype=bool)
+    if start is not None:
+        mask &= columns["recorded_at"] >= np.datetime64(start, "us")
+    if end is not None:
+        mask &= columns["recorded_at"] < np.datetime64(end, "us")
+    if device_id is not None:
+        mask &= columns["device_id"] == device_id
+    if mask.all():
+        return columns
+    return {column: values[mask] for column, values in columns.items()}
+
+
+def iter_archived_rows(
+    start: Optional[datetime],
+    end: Optional[datetime],
+    device_id: Optional[int],
+    chunk_rows: int
+) -> Iterator[List[tuple]]:
+    """Archived readings as row tuples in time order, one day file in memory at a time"""
+    days = archived_days(start.date() if start else None, end.date() if end else None)
+    for day in days:
+        columns = select_rows(load_day(day), start, end, device_id)
+        values = [
+            columns[column].astype(object) if column == "recorded_at" else columns[column]
+            for column in ARCHIVE_COLUMNS
+        ]
+        for offset in range(0, len(columns["id"]), chunk_rows):
+            yield list(zip(*(column[offset:offset + chunk_rows].tolist() for column in values)))
+
+
+def aggregate_rows(columns: Day, seconds: int) -> Optional[Day]:
+    if not len(columns["id"]):
+        return None
+    epoch = columns["recorded_at"].astype("datetime64[s]").astype(np.int64)
+    return bucket_aggregates(epoch, {metric: columns[metric] for metric in ("voltage", "current", "power", "energy")}, seconds)
+
+
+@lru_cache(maxsize=CACHED_DAY_BUCKETS)
+def day_buckets(day: date, mtime_ns: int, seconds: int, device_id: Optional[int]) -> Optional[Day]:
+    """Buckets of a whole archived day; ``mtime_ns`` keys out versions rewritten since"""
+    buckets = aggregate_rows(select_rows(load_day(day), None, None, device_id), seconds)
+    if buckets is not None:
+        for values in buckets.values():
+            values.flags.writeable = False
+    return buckets
+
+
+def archived_buckets(seconds: int, start: datetime, device_id: Optional[int]) -> Optional[Day]:
+    """Aggregate archived readings since ``start`` into ``seconds``-wide buckets.
+    
+    Returns the same columns as the raw series query (bucket,
+    reading_count and the sum/min/max of each metric), or None when no
+    archived day overlaps the range. Days are bucketed one at a time, so a
+    bucket spanning midnight appears once per day and the caller merges
+    them. Whole days are cached until their file changes; only the day
+    ``start`` falls in is read on every request.
+    """
+    parts = []
+    for day in archived_days(start.date()):
+        day_start, _ = day_range(day)
+        if start > day_start:
+            part = aggregate_rows(select_rows(load_day(day), start, None, device_id), seconds)
+        else:
+            part = day_buckets(day, os.stat(day_path(day)).st_mtime_ns, seconds, device_id)
+        if part is not None:
+            parts.append(part)
+    if not parts:
+        return None
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+def rollups_cover_day(db: Session, day: date, raw_count: int) -> bool:
+    """Whether the daily and power_rollup tiers already count every reading of a day"""
+    start, _ = day_range(day)
+    daily = db.query(EnergyDaily.reading_count).filter(EnergyDaily.day == day).scalar() or 0
+    rollup = db.query(func.coalesce(func.sum(PowerRollup.reading_count), 0)).filter(
+        PowerRollup.resolution == ROLLUP_RESOLUTIONS[-1],
+        PowerRollup.bucket == to_epoch(start)
+    ).scalar()
+    return daily == raw_count and rollup == raw_count
+
+
+def archive_day(db: Session, day: date, chunk_size: int = 50000) -> int:
+    """Move one day of raw readings into its archive file.
+    
+    Rows already archived (a re-run after a crash, or readings that
+    arrived late for an archived day) are merged by id. The day is read
+    ``chunk_size`` rows at a time straight into typed columns, and only
+    the ids read here are deleted, so readings inserted meanwhile wait
+    for the next run.
+    Returns the number of rows moved, or -1 if the rollups don't cover
+    the day yet.
+    """
+    start, end = day_range(day)
+    query = select(*(getattr(PowerData, column) for column in ARCHIVE_COLUMNS)).where(
+        PowerData.recorded_at >= start,
+        PowerData.recorded_at < end
+    ).execution_options(yield_per=chunk_size)
+    
+    chunks = {column: [] for column in ARCHIVE_COLUMNS}
+    for part in db.execute(query).partitions():
+        for (column, dtype), values in zip(ARCHIVE_COLUMNS.items(), zip(*part)):
+            chunks[column].append(np.array(values, dtype=dtype))
+    if not chunks["id"]:
+        return 0
+    columns = {column: np.concatenate(values) for column, values in chunks.items()}
+    ids = columns["id"].tolist()
+    
+    existing = load_day(day) if os.path.exists(day_path(day)) else None
+    if existing is not None:
+        columns = {column: np.concatenate([existing[column], columns[column]]) for column in ARCHIVE_COLUMNS}
+        _, unique = np.unique(columns["id"], return_index=True)
+        columns = {column: values[unique] for column, values in columns.items()}
+    
+    if not rollups_cover_day(db, day, len(columns["id"])):
+        logger.warning("Rollups for %s don't match its raw readings; run python -m app.rollups first", day)
+        return -1
+    
+    order = np.lexsort((columns["id"], columns["recorded_at"]))
+    save_day(day, {column: values[order] for column, values in columns.items()})
+    
+    for offset in range(0, len(ids), DELETE_BATCH_ROWS):
+        db.execute(delete(PowerData).where(PowerData.id.in_(ids[offset:offset + DELETE_BATCH_ROWS])))
+    db.commit()
+    return len(ids)
+
+
+def archive_older_than(db: Session, days: int) -> Dict[date, int]:
+    """Archive every day of raw readings older than ``days`` days.
+    
+    Stops at the first day whose rollups don't match, so the archive
+    always ends before the oldest reading left in the database.
+    """
+    cutoff, _ = day_range(date.today() - timedelta(days=days))
+    oldest = db.query(func.min(PowerData.recorded_at)).filter(PowerData.recorded_at < cutoff).scalar()
+    if oldest is None:
+        return {}
+    
+    moved = {}
+    day = oldest.date() if isinstance(oldest, datetime) else datetime.fromisoformat(str(oldest)).date()
+    while day < cutoff.date():
+        moved[day] = archive_day(db, day)
+        if moved[day] < 0:
+            break
+        day += timedelta(days=1)
+    return moved
+
+
+if __name__ == "__main__":
+    import argparse
+    from app.database import SessionLocal
+    
+    parser = argparse.ArgumentParser(description="Move old raw power readings into the archive")
+    parser.add_argument("--days", type=int, default=settings.ARCHIVE_AFTER_DAYS, help="Keep this many days in the database")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        for day, count in archive_older_than(db, args.days).items():
+            if count > 0:
+                logger.info("Archived %d readings of %s", count, day)
+    finally:
+        db.close()
@@ -1,14 +1,22 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
+import asyncio
+import math
+import threading
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, WebSocket, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
 from app.config import settings
-from app.database import get_db
-from app.models import User
-from app.schemas import TokenData
+from app.database import AppSession, SessionLocal, get_session, run_db
+from app.models import User, UserRole
+from app.schemas import TokenData, CurrentUser
+from app.shared_counters import counters
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -16,6 +24,9 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # OAuth2 scheme
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
+# Key in Session.info set when the open transaction changed or deleted a user
+USERS_CHANGED = "users_changed"
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash"""
@@ -27,6 +38,105 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+class PasswordHasher:
+    """Runs bcrypt in a dedicated, size-limited thread pool.
+    
+    Hashing is kept off FastAPI's shared threadpool so a burst of logins
+    can't starve the sync DB endpoints. At most ``workers + max_queued``
+    jobs are admitted; beyond that callers are rejected immediately with
+    503 instead of queueing.
+    """
+    
+    def __init__(self, workers: int, max_queued: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + max_queued)
+    
+    async def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many login attempts in progress, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+        future = self._executor.submit(fn, *args)
+        # Free the slot when the job itself finishes (or is cancelled before
+        # it starts), not when an awaiting request is cancelled mid-hash
+        future.add_done_callback(lambda _: self._slots.release())
+        return await asyncio.wrap_future(future)
+    
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+    
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password)
+
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE)
+
+
+class FailedLoginTracker:
+    """Recent failed logins per (username, client address), to slow brute force cheaply.
+    
+    After ``max_failures`` failures a key must wait before its next
+    attempt, 1 second at first and twice as long after every further
+    failure, up to ``window`` seconds; attempts before then are rejected
+    without running bcrypt. A key is forgotten ``window`` seconds after
+    its last failure. Keying on the client address too means someone
+    guessing at a username from elsewhere slows only their own attempts,
+    never locks its owner out. Tracks at most ``max_entries`` keys (LRU)
+    and is per process, so each worker enforces the limit on its own.
+    """
+    
+    def __init__(self, max_failures: int, window: int, max_entries: int = 100000):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_entries = max_entries
+        self._failures: "OrderedDict[Tuple[str, str], list]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def delay(self, failures: int) -> int:
+        """Seconds a key must wait after its ``failures``-th failure"""
+        if failures < self.max_failures:
+            return 0
+        return min(2 ** (failures - self.max_failures), self.window)
+    
+    def retry_after(self, username: str, client: str) -> int:
+        """Seconds until the key may try again, or 0 if it may now"""
+        key = (username, client)
+        with self._lock:
+            entry = self._failures.get(key)
+            if entry is None:
+                return 0
+            count, last_at = entry
+            now = time.monotonic()
+            if last_at + self.window <= now:
+                del self._failures[key]
+                return 0
+            remaining = last_at + self.delay(count) - now
+            return math.ceil(remaining) if remaining > 0 else 0
+    
+    def record_failure(self, username: str, client: str):
+        key = (username, client)
+        with self._lock:
+            now = time.monotonic()
+            entry = self._failures.get(key)
+            if entry is None or entry[1] + self.window <= now:
+                self._failures[key] = [1, now]
+            else:
+                entry[0] += 1
+                entry[1] = now
+            self._failures.move_to_end(key)
+            while len(self._failures) > self.max_entries:
+                self._failures.popitem(last=False)
+    
+    def reset(self, username: str, client: str):
+        with self._lock:
+            self._failures.pop((username, client), None)
+
+
+failed_logins = FailedLoginTracker(settings.LOGIN_MAX_FAILURES, settings.LOGIN_FAILURE_WINDOW_SECONDS)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -35,15 +145,125 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
 
+class TokenCache:
+    """Bounded LRU cache of access token -> CurrentUser.
+    
+    Entries expire after ``AUTH_CACHE_TTL_SECONDS`` or at the token's own
+    expiry, whichever is first. The whole cache is dropped when the shared
+    ``users`` counter moves, i.e. when any worker committed a change to or
+    the deletion of a user. A principal resolved before such a change is
+    not cached.
+    """
+    
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._version = counters.get("users")
+        self._lock = threading.Lock()
+    
+    def get(self, token: str) -> Optional[CurrentUser]:
+        with self._lock:
+            version = counters.get("users")
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+                return None
+            
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            principal, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return principal
+    
+    def put(self, token: str, principal: CurrentUser, token_expires_in: float, version: int):
+        """Cache a principal resolved while the ``users`` counter was at ``version``"""
+        with self._lock:
+            if counters.get("users") != version:
+                # A user changed while it was being resolved; it may be stale
+                return
+            self._entries[token] = (principal, time.monotonic() + min(self.ttl, token_expires_in))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL_SECONDS)
+
+
+def invalidate_users():
+    """Forget cached principals and signed claims issued before now, in every worker"""
+    counters.raise_to("users_changed_at", int(time.time()) + 1)
+    counters.bump("users")
+    token_cache.clear()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def user_changed(mapper, connection, target):
+    # Until the commit, other requests still read the old row and would
+    # cache it again, so only invalidate once the change is visible
+    session = object_session(target)
+    if session is None:
+        invalidate_users()
+    else:
+        session.info[USERS_CHANGED] = True
+
+
+def _after_commit(session: Session):
+    if session.info.pop(USERS_CHANGED, False):
+        invalidate_users()
+
+
+def _after_transaction_end(session: Session, transaction):
+    if transaction.parent is None:
+        # Rolled back or closed without committing: nothing changed
+        session.info.pop(USERS_CHANGED, None)
+
+
+event.listen(AppSession, "after_commit", _after_commit)
+event.listen(AppSession, "after_transaction_end", _after_transaction_end)
+
+
+def principal_from_claims(payload: dict) -> Optional[CurrentUser]:
+    """Build the principal from signed id/role claims, if they can be trusted.
+    
+    Claims are only trusted for tokens issued after the last user change;
+    older tokens fall back to a database lookup.
+    """
+    if payload.get("uid") is None or payload.get("role") is None or "iat" not in payload:
+        return None
+    if payload["iat"] < counters.get("users_changed_at"):
+        return None
+    try:
+        return CurrentUser(id=payload["uid"], username=payload["sub"], role=UserRole(payload["role"]))
+    except ValueError:
+        return None
+
+
+def load_principal(db: Session, username: str) -> Optional[CurrentUser]:
+    """Look up the principal for a username in the database"""
+    user = db.query(User).filter(User.username == username).first()
+    return CurrentUser.model_validate(user) if user is not None else None
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
+    db: Session = Depends(get_session)
+) -> CurrentUser:
     """Get current authenticated user"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -51,6 +271,11 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    principal = token_cache.get(token)
+    if principal is not None:
+        return principal
+    version = counters.get("users")
+    
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         username: str = payload.get("sub")
@@ -60,18 +285,46 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.username == token_data.username).first()
-    if user is None:
-        raise credentials_exception
+    principal = principal_from_claims(payload)
+    if principal is None:
+        principal = await run_db(db, load_principal, token_data.username)
+        if principal is None:
+            raise credentials_exception
+    
+    expires_in = payload.get("exp", time.time() + settings.AUTH_CACHE_TTL_SECONDS) - time.time()
+    token_cache.put(token, principal, expires_in, version)
+    
+    return principal
+
+
+async def get_websocket_user(websocket: WebSocket) -> Optional[CurrentUser]:
+    """Authenticate a WebSocket handshake, or None if it carries no valid token.
+    
+    Browsers can't set headers on a WebSocket, so the access token comes
+    in the ``token`` query parameter; other clients may send the usual
+    ``Authorization: Bearer`` header instead.
+    """
+    token = websocket.query_params.get("token")
+    if token is None:
+        scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer":
+            return None
+    if not token:
+        return None
     
-    return user
+    # Only tokens without trusted claims touch the database
+    with SessionLocal() as db:
+        try:
+            return await get_current_user(token, db)
+        except HTTPException:
+            return None
 
 
-async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_active_user(current_user: CurrentUser = Depends(get_current_user)) -> CurrentUser:
     """Get current active user"""
     return current_user
 
 
-def is_admin(current_user: User = Depends(get_current_active_user)) -> bool:
+def is_admin(current_user: CurrentUser = Depends(get_current_active_user)) -> bool:
     """Check if current user is admin"""
     return current_user.role == "admin"
@@ -0,0 +1,214 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import struct
+import time
+from typing import Callable, Iterable, List, Optional, Set
+from app.config import settings
+from app.shared_counters import counters
+
+logger = logging.getLogger(__name__)
+
+# Frame header: payload length, topics length, sequence number, publish time
+# (seconds since epoch). The newline-separated topics follow, then the JSON payload.
+FRAME_HEADER = struct.Struct("<IHQd")
+
+Deliver = Callable[[str, List[str], int], None]
+
+
+class BroadcastBackend:
+    """Delivers encoded events to the WebSocket clients of every worker.
+    
+    ``deliver`` is called with the JSON text, topics and sequence number of
+    each event in every worker process, including the one that published
+    it, so each worker routes the event to its own subscribers.
+    """
+    
+    async def start(self, deliver: Deliver):
+        self.deliver = deliver
+    
+    async def publish(self, text: str, topics: List[str], seq: int):
+        raise NotImplementedError
+    
+    async def stop(self):
+        pass
+    
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryBackend(BroadcastBackend):
+    """Single-process backend: events go straight to this worker's clients"""
+    
+    async def publish(self, text: str, topics: List[str], seq: int):
+        self.deliver(text, topics, seq)
+
+
+class UnixSocketHubBackend(BroadcastBackend):
+    """Relays events between gunicorn workers over a local Unix socket.
+    
+    The first worker to take an exclusive ``flock`` on ``<dir>/broadcast.lock``
+    becomes the hub and listens on ``<dir>/broadcast.sock``; every worker
+    (the hub included) connects to it as a client. Published events are sent
+    to the hub once, already encoded, and the hub forwards the same bytes to
+    every connected worker. If the hub worker exits its lock is released,
+    the other workers see EOF, and one of them takes over.
+    
+    Every frame carries its publish time, so receivers track the delivery
+    latency and log a warning when it exceeds ``WS_HUB_LATENCY_WARN_MS``.
+    While a worker is not connected to a hub, events it publishes are only
+    delivered locally.
+    """
+    
+    def __init__(self, directory: str, latency_warn_ms: float = 50.0, max_buffer: int = 8 * 1024 * 1024):
+        self.socket_path = os.path.join(directory, "broadcast.sock")
+        self.lock_path = os.path.join(directory, "broadcast.lock")
+        self.latency_warn_ms = latency_warn_ms
+        self.max_buffer = max_buffer
+        self.is_hub = False
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._hub_clients: Set[asyncio.StreamWriter] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._received = 0
+        self._latency_max_ms = 0.0
+        self._latency_total_ms = 0.0
+        os.makedirs(directory, exist_ok=True)
+    
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._hub_clients):
+                writer.close()
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+    
+    async def publish(self, text: str, topics: List[str], seq: int):
+        writer = self._writer
+        if writer is None or writer.is_closing():
+            self.deliver(text, topics, seq)
+            return
+        payload = text.encode()
+        topic_bytes = "\n".join(topics).encode()
+        writer.write(FRAME_HEADER.pack(len(payload), len(topic_bytes), seq, time.time()) + topic_bytes + payload)
+    
+    def stats(self) -> dict:
+        return {
+            "is_hub": self.is_hub,
+            "connected": self._writer is not None and not self._writer.is_closing(),
+            "received": self._received,
+            "latency_max_ms": round(self._latency_max_ms, 3),
+            "latency_avg_ms": round(self._latency_total_ms / self._received, 3) if self._received else 0.0,
+        }
+    
+    def _try_become_hub(self) -> bool:
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+    
+    async def _run(self):
+        """Keep this worker connected to a hub, electing one when needed"""
+        delay = 0.05
+        while True:
+            if not self.is_hub and self._try_become_hub():
+                if os.path.exists(self.socket_path):
+                    os.unlink(self.socket_path)
+                self._server = await asyncio.start_unix_server(self._serve_worker, path=self.socket_path)
+                self.is_hub = True
+                logger.info("Broadcast hub listening on %s (pid %d)", self.socket_path, os.getpid())
+            
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError:
+                # Hub not up yet, or it just died
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 2.0)
+                continue
+            
+            delay = 0.05
+            try:
+                await self._receive(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                self._writer.close()
+                self._writer = None
+    
+    async def _receive(self, reader: asyncio.StreamReader):
+        """Deliver frames from the hub to this worker's clients"""
+        while True:
+            length, topics_length, seq, sent_at = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+            body = await reader.readexactly(topics_length + length)
+            topics = body[:topics_length].decode().split("\n") if topics_length else []
+            
+            latency_ms = (time.time() - sent_at) * 1000
+            self._received += 1
+            self._latency_total_ms += latency_ms
+            self._latency_max_ms = max(self._latency_max_ms, latency_ms)
+            if latency_ms > self.latency_warn_ms:
+                logger.warning("Broadcast event delivered after %.1f ms", latency_ms)
+            
+            self.deliver(body[topics_length:].decode(), topics, seq)
+    
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Hub side: forward every frame from one worker to all workers"""
+        self._hub_clients.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                length, topics_length, _, _ = FRAME_HEADER.unpack(header)
+                frame = header + await reader.readexactly(topics_length + length)
+                for client in list(self._hub_clients):
+                    if client.transport.get_write_buffer_size() > self.max_buffer:
+                        # A stuck worker must not grow the hub's memory; it will reconnect
+                        logger.warning("Disconnecting stalled worker from broadcast hub")
+                        self._hub_clients.discard(client)
+                        client.close()
+                        continue
+                    client.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Cancelled on shutdown; swallow it so asyncio doesn't log the handler task
+            pass
+        finally:
+            self._hub_clients.discard(writer)
+            writer.close()
+
+
+def create_backend() -> BroadcastBackend:
+    """Build the backend selected by WS_BROADCAST_BACKEND"""
+    if settings.WS_BROADCAST_BACKEND == "unix":
+        return UnixSocketHubBackend(settings.SHARED_STATE_DIR, settings.WS_HUB_LATENCY_WARN_MS)
+    if settings.WS_BROADCAST_BACKEND == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown WS_BROADCAST_BACKEND {settings.WS_BROADCAST_BACKEND!r}")
+
+
+broadcaster = create_backend()
+
+
+async def publish(message: dict, topics: Iterable[str] = ()):
+    """Encode an event once and send it to subscribers of ``topics`` on every worker.
+    
+    Each event is stamped with a host-wide sequence number so reconnecting
+    clients can ask for what they missed.
+    """
+    seq = counters.bump("ws_seq")
+    text = json.dumps({**message, "seq": seq}, default=str)
+    await broadcaster.publish(text, list(topics), seq)
@@ -1,21 +1,88 @@
 from pydantic_settings import BaseSettings
 from typing import List
+import os
+import tempfile
 
 
 class Settings(BaseSettings):
     # Database
     DATABASE_URL: str = "mysql+pymysql://root:@localhost/energy_monitoring"
+    DB_ASYNC: bool = False  # Serve requests through the async engine instead of the threadpool
+    ASYNC_DATABASE_URL: str = ""  # Defaults to DATABASE_URL with its async driver
+    # Connection pool, per worker process: with gunicorn -w 4 the server may
+    # open up to 4 * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 3600  # Reconnect connections older than this (MySQL wait_timeout)
+    DB_ECHO: bool = False  # Log every SQL statement
+    DB_SESSION_WARN_SECONDS: float = 10.0  # Warn about sessions and connections held longer
+    
+    # SQL profiling (off by default): slow-query log with EXPLAIN, N+1 warnings,
+    # top statements by total time on /metrics/sql
+    SQL_PROFILE: bool = False
+    SQL_SLOW_MS: float = 200.0
+    SQL_N_PLUS_ONE_THRESHOLD: int = 10  # Same statement this many times in one request
+    SQL_PROFILE_TOP_N: int = 20
+    SQL_PROFILE_WINDOW_MINUTES: int = 15
     
     # Security
     SECRET_KEY: str = "your-secret-key-change-in-production-09876543210"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 1440  # 24 hours
+    AUTH_CACHE_SIZE: int = 10000  # Decoded tokens kept in memory
+    AUTH_CACHE_TTL_SECONDS: int = 300
+    PASSWORD_HASH_WORKERS: int = 2  # Threads dedicated to bcrypt
+    PASSWORD_HASH_QUEUE: int = 16  # Hash jobs allowed to wait before rejecting
+    LOGIN_MAX_FAILURES: int = 5  # Per username and client address, before attempts are slowed down
+    LOGIN_FAILURE_WINDOW_SECONDS: int = 300  # Longest delay; failures are forgotten after this long
     
     # Server
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     DEBUG: bool = True
     
+    # Ingestion
+    INGEST_MAX_ROWS: int = 100000  # Max readings accepted per request
+    EXPORT_CHUNK_ROWS: int = 5000  # Rows fetched and sent per chunk by /api/power/export
+    # Write-behind ingest (off by default): /api/power/ingest answers once readings
+    # are fsynced to a local spool file, a background task writes them in batches
+    INGEST_BUFFER: bool = False
+    INGEST_BUFFER_MAX_ROWS: int = 200000  # Buffered readings per worker before answering 429
+    INGEST_FLUSH_ROWS: int = 5000  # Flush as soon as this many readings are buffered
+    INGEST_FLUSH_SECONDS: float = 1.0  # ...or at least this often
+    INGEST_SPOOL_DIR: str = "data/spool"
+    
+    # Alert thresholds live in system_config; how often workers reload them
+    ALERT_RULES_REFRESH_SECONDS: int = 60
+    
+    # Read endpoint response cache (ETag/304)
+    RESPONSE_CACHE_SIZE: int = 1000  # Encoded responses kept per worker
+    RESPONSE_CACHE_HISTORY_SECONDS: int = 30  # How long a sliding history window may be reused
+    
+    # Raw reading storage: "sql" (power_data table) or "columnar" (compressed
+    # per-device chunk files, see app/tsdb.py); rollups stay in the database
+    POWER_STORAGE: str = "sql"
+    TSDB_DIR: str = "data/tsdb"
+    TSDB_CHUNK_ROWS: int = 65536  # Readings per device buffered before a chunk is compressed
+    
+    # Cold storage: raw readings older than this move to per-day files (python -m app.archive)
+    ARCHIVE_AFTER_DAYS: int = 90
+    ARCHIVE_DIR: str = "archive/power_data"
+    
+    # Chart downsampling: max buckets loaded before LTTB/min-max reduction
+    DOWNSAMPLE_SOURCE_POINTS: int = 200000
+    
+    # WebSocket fan-out
+    WS_SEND_QUEUE_SIZE: int = 100  # Pending messages per client
+    WS_SLOW_CONSUMER_POLICY: str = "resync"  # "resync" (discard the backlog, client reloads) or "drop" (disconnect)
+    WS_BROADCAST_BACKEND: str = "memory"  # "memory" (single process) or "unix" (all local workers)
+    WS_HUB_LATENCY_WARN_MS: float = 50.0
+    WS_REPLAY_BUFFER: int = 1000  # Recent events kept per worker for clients resuming after a reconnect
+    
+    # Cross-worker state (mmap'd counters shared by gunicorn workers)
+    SHARED_STATE_DIR: str = os.path.join(tempfile.gettempdir(), "energy_monitoring")
+    
     # CORS
     ALLOWED_ORIGINS: List[str] = [
         "http://localhost:3000",
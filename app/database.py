@@ -1,27 +1,152 @@
+import time
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
 from app.config import settings
+from app.pool import PoolStats, TimedAsyncQueuePool, TimedQueuePool
 
-# Create database engine
-engine = create_engine(
-    settings.DATABASE_URL,
+# Async drivers for each sync driver the app can be configured with
+ASYNC_DRIVERS = {
+    "mysql": "aiomysql",
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+}
+
+
+# Driver error codes of a transaction the database aborted to break a deadlock
+# (MySQL ER_LOCK_DEADLOCK, PostgreSQL deadlock_detected)
+DEADLOCK_ERRORS = (1213, "40P01")
+
+
+class AppSession(Session):
+    """Session class shared by the sync and async paths so both get the same ORM event hooks"""
+
+
+def async_database_url(url: str) -> str:
+    """Swap the driver of a sync database URL for its async counterpart"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for {backend!r} databases")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+# Pool options shared by the sync and async engines
+POOL_OPTIONS = dict(
     pool_pre_ping=True,
-    pool_recycle=3600,
-    echo=settings.DEBUG
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    echo=settings.DB_ECHO
 )
 
+# Create database engine
+engine = create_engine(settings.DATABASE_URL, poolclass=TimedQueuePool, **POOL_OPTIONS)
+pool_stats = PoolStats(settings.DB_SESSION_WARN_SECONDS)
+pool_stats.attach(engine)
+
 # Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AppSession)
+
+# Async engine, only built when DB_ASYNC is on so its driver is optional otherwise
+async_engine = None
+AsyncSessionLocal = None
+async_pool_stats = None
+if settings.DB_ASYNC:
+    async_engine = create_async_engine(
+        settings.ASYNC_DATABASE_URL or async_database_url(settings.DATABASE_URL),
+        poolclass=TimedAsyncQueuePool,
+        **POOL_OPTIONS
+    )
+    async_pool_stats = PoolStats(settings.DB_SESSION_WARN_SECONDS)
+    async_pool_stats.attach(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine,
+        autoflush=False,
+        expire_on_commit=False,
+        sync_session_class=AppSession
+    )
 
 # Base class for models
 Base = declarative_base()
 
 
 # Dependency to get database session
-def get_db():
+def get_db(request: Request):
     db = SessionLocal()
+    opened = time.monotonic()
     try:
         yield db
     finally:
         db.close()
+        pool_stats.session_closed(time.monotonic() - opened, f"{request.method} {request.url.path}")
+
+
+# Dependency to get an async database session
+async def get_async_db(request: Request):
+    opened = time.monotonic()
+    try:
+        async with AsyncSessionLocal() as db:
+            yield db
+    finally:
+        async_pool_stats.session_closed(time.monotonic() - opened, f"{request.method} {request.url.path}")
+
+
+# Session dependency used by the routers: async sessions when DB_ASYNC is on
+get_session = get_async_db if settings.DB_ASYNC else get_db
+
+
+def is_deadlock(error: DBAPIError) -> bool:
+    """Whether a failed statement was chosen as a deadlock victim"""
+    orig = error.orig
+    code = getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)
+    if code is None and getattr(orig, "args", None):
+        code = orig.args[0]
+    return code in DEADLOCK_ERRORS
+
+
+def active_pool_stats() -> PoolStats:
+    """Pool stats of the engine serving requests"""
+    return async_pool_stats if settings.DB_ASYNC else pool_stats
+
+
+def database_stats() -> dict:
+    """Pool metrics of the engine serving requests"""
+    return active_pool_stats().snapshot()
+
+
+async def run_db(db, fn, *args, **kwargs):
+    """Run ``fn(session, *args, **kwargs)`` without blocking the event loop.
+    
+    With an ``AsyncSession`` the function runs through ``run_sync`` on the
+    event loop, its queries awaiting the async driver. With a sync
+    ``Session`` it runs in the threadpool, as sync endpoints did before.
+    Either way ``fn`` is plain sync SQLAlchemy code. Use
+    ``run_db_blocking`` for helpers that do more than run queries.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
+async def run_db_blocking(db, fn, *args, **kwargs):
+    """Run ``fn(session, *args, **kwargs)`` in the threadpool on either path.
+    
+    For helpers that also do file I/O, ``flock`` or NumPy work (the write
+    path, history series): ``run_sync`` would run all of that on the
+    event loop. With an ``AsyncSession`` the helper gets a sync session
+    of its own from the sync engine instead.
+    """
+    if not isinstance(db, AsyncSession):
+        return await run_in_threadpool(fn, db, *args, **kwargs)
+    
+    def call():
+        with SessionLocal() as session:
+            return fn(session, *args, **kwargs)
+    return await run_in_threadpool(call)
@@ -0,0 +1,74 @@
+import numpy as np
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices picked by Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last points and, for each of the ``n_out - 2``
+    buckets in between, the point forming the largest triangle with the
+    previously picked point and the average of the next bucket. The area
+    of every candidate in a bucket is computed as one vector operation.
+    """
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1][:max(n_out, 0)], dtype=np.int64)
+
+    # Bucket edges over the interior points [1, n - 1)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    picked = np.empty(n_out, dtype=np.int64)
+    picked[0] = 0
+    picked[-1] = n - 1
+
+    # Averages of every bucket, used as the third triangle vertex
+    counts = np.diff(edges)
+    next_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    next_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 1 < n_out - 2:
+            cx, cy = next_x[i + 1], next_y[i + 1]
+        else:
+            cx, cy = x[n - 1], y[n - 1]
+        ax, ay = x[prev], y[prev]
+        area = np.abs(
+            (ax - cx) * (y[start:end] - ay) - (ax - x[start:end]) * (cy - ay)
+        )
+        prev = start + int(np.argmax(area))
+        picked[i + 1] = prev
+
+    return picked
+
+
+def minmax(y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the min and max point of each of ``n_out // 2`` buckets.
+
+    Preserves spikes, which averaging hides. Indices are returned in
+    time order.
+    """
+    n = len(y)
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(min(n, n_out))
+
+    bucket = np.arange(n) * n_buckets // n
+    # Sort by bucket, then value: the first and last of each bucket are min and max
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket[order], np.arange(n_buckets))
+    ends = np.append(starts[1:], n) - 1
+
+    return np.unique(np.concatenate((order[starts], order[ends])))
+
+
+def downsample(x: np.ndarray, y: np.ndarray, n_out: int, method: str = "lttb") -> np.ndarray:
+    """Indices of at most ``n_out`` points that keep the shape of y(x)"""
+    if method == "lttb":
+        return lttb(x, y, n_out)
+    if method == "minmax":
+        return minmax(y, n_out)
+    raise ValueError(f"Unknown downsampling method {method!r}")
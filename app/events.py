@@ -0,0 +1,160 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Iterable, List, Optional
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from app.broadcast import publish
+from app.database import AppSession
+from app.models import Alert, Device
+from app.websocket import device_topics
+
+logger = logging.getLogger(__name__)
+
+# Key in Session.info holding events waiting for the transaction to commit
+PENDING_EVENTS = "pending_events"
+
+
+class EventBus:
+    """Publishes real-time events only once the work behind them is committed.
+    
+    Routers call ``emit`` with the session they are writing through; the
+    event waits in ``session.info`` and is dropped if the transaction rolls
+    back or the session closes without committing. After commit the events
+    are handed to the event loop with ``call_soon_threadsafe`` and a
+    dispatcher task publishes them, so delivery never adds latency to the
+    HTTP response that produced them.
+    """
+    
+    def __init__(self, queue_size: int = 10000):
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._task = asyncio.create_task(self._dispatch())
+    
+    async def stop(self):
+        self._loop = None
+        if self._task is not None:
+            self._task.cancel()
+    
+    def emit(self, db: Session, message: dict, topics: Iterable[str] = ()):
+        """Queue an event to be published when ``db`` commits"""
+        db.info.setdefault(PENDING_EVENTS, []).append((message, list(topics)))
+    
+    def _after_commit(self, session: Session):
+        pending = session.info.pop(PENDING_EVENTS, None)
+        loop = self._loop
+        if not pending or loop is None:
+            # No event loop outside the web app (CLI jobs); nobody to notify
+            return
+        try:
+            loop.call_soon_threadsafe(self._enqueue, pending)
+        except RuntimeError:
+            # Loop closed during shutdown
+            pass
+    
+    def _after_transaction_end(self, session: Session, transaction):
+        if transaction.parent is None:
+            # Anything still pending was never committed
+            session.info.pop(PENDING_EVENTS, None)
+    
+    def _enqueue(self, events: List[tuple]):
+        for item in events:
+            try:
+                self._queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                logger.warning("Event queue full, dropped %s event", item[0].get("type"))
+    
+    async def _dispatch(self):
+        while True:
+            message, topics = await self._queue.get()
+            try:
+                await publish(message, topics)
+            except Exception:
+                logger.exception("Failed to publish %s event", message.get("type"))
+    
+    def stats(self) -> dict:
+        return {
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "dropped": self.dropped
+        }
+
+
+bus = EventBus()
+event.listen(AppSession, "after_commit", bus._after_commit)
+event.listen(AppSession, "after_transaction_end", bus._after_transaction_end)
+
+
+def emit(db: Session, message_type: str, payload: dict, topics: Iterable[str] = ()):
+    """Build an event message and queue it on the session"""
+    bus.emit(db, {
+        "type": message_type,
+        **payload,
+        "timestamp": datetime.now().isoformat()
+    }, topics)
+
+
+def emit_device_update(db: Session, device: Device, changes: dict):
+    """Changed fields of a device"""
+    emit(db, "device_update", {
+        "device_id": device.id,
+        "changes": changes
+    }, device_topics(device.id, device.location))
+
+
+def emit_readings(db: Session, readings: List[dict]):
+    """Newest reading of each device in a batch of readings"""
+    newest = {}
+    for reading in readings:
+        current = newest.get(reading["device_id"])
+        if current is None or reading["recorded_at"] >= current["recorded_at"]:
+            newest[reading["device_id"]] = reading
+    
+    # Locations for the location:{name} topics
+    locations = dict(db.execute(
+        select(Device.id, Device.location).where(Device.id.in_(list(newest)))
+    ).all())
+    
+    for device_id, reading in newest.items():
+        emit(db, "power_data", {
+            "device_id": device_id,
+            "data": {
+                "voltage": reading["voltage"],
+                "current": reading["current"],
+                "power": reading["power"],
+                "energy": reading["energy"],
+                "recorded_at": reading["recorded_at"].isoformat(),
+                "timestamp": int(reading["recorded_at"].timestamp())
+            }
+        }, device_topics(device_id, locations.get(device_id)))
+
+
+def emit_alert(db: Session, alert: Alert, device: Optional[Device] = None):
+    """A newly created alert; the session must be flushed so it has an id"""
+    topics = ["alerts"]
+    if alert.device_id:
+        topics += device_topics(alert.device_id, device.location if device else None)
+    emit(db, "alert", {
+        "alert": {
+            "id": alert.id,
+            "device_id": alert.device_id,
+            "alert_type": alert.alert_type,
+            "message": alert.message,
+            "severity": alert.severity,
+            "is_read": False,
+            "created_at": (alert.created_at or datetime.now()).isoformat(),
+            "device_name": device.device_name if device else None
+        }
+    }, topics)
+
+
+def emit_stats(db: Session, stats: dict):
+    """New values of dashboard counters"""
+    emit(db, "stats", {"changes": stats}, ["stats"])
@@ -0,0 +1,151 @@
+import csv
+import io
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+from sqlalchemy import select
+from app.archive import iter_archived_rows
+from app.database import SessionLocal
+from app.models import PowerData
+from app.serialization import dumps
+from app.tsdb import reading_store
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+    pq = None
+
+EXPORT_COLUMNS = (
+    "id", "device_id", "recorded_at", "voltage", "current",
+    "power", "energy", "power_factor", "frequency"
+)
+
+Chunk = Sequence[tuple]
+
+
+def iter_reading_chunks(
+    start: Optional[datetime],
+    end: Optional[datetime],
+    device_id: Optional[int],
+    chunk_rows: int
+) -> Iterator[Chunk]:
+    """Raw readings in time order, ``chunk_rows`` at a time.
+    
+    Archived days in the range come first, one day file at a time, then
+    the hot table. That runs on its own session because the response
+    body is produced after the request's dependencies have been closed;
+    ``yield_per`` makes the driver stream rows from a server-side cursor,
+    so only one chunk is in memory however long the range is. With the
+    columnar store, rows come from there a day at a time and have no id.
+    """
+    yield from iter_archived_rows(start, end, device_id, chunk_rows)
+    if reading_store is not None:
+        yield from reading_store.iter_rows(start, end, device_id, chunk_rows)
+        return
+    
+    query = select(*(getattr(PowerData, column) for column in EXPORT_COLUMNS))
+    if start is not None:
+        query = query.where(PowerData.recorded_at >= start)
+    if end is not None:
+        query = query.where(PowerData.recorded_at < end)
+    if device_id is not None:
+        query = query.where(PowerData.device_id == device_id)
+    query = query.order_by(PowerData.recorded_at, PowerData.id).execution_options(yield_per=chunk_rows)
+    
+    db = SessionLocal()
+    try:
+        for partition in db.execute(query).partitions():
+            yield partition
+    finally:
+        db.close()
+
+
+def csv_stream(chunks: Iterator[Chunk]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def ndjson_stream(chunks: Iterator[Chunk]) -> Iterator[bytes]:
+    for chunk in chunks:
+        yield b"".join(dumps(dict(zip(EXPORT_COLUMNS, row))) + b"\n" for row in chunk)
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last drain"""
+    
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._position = 0
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def parquet_schema():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("device_id", pa.int64()),
+        ("recorded_at", pa.timestamp("us")),
+        ("voltage", pa.float64()),
+        ("current", pa.float64()),
+        ("power", pa.float64()),
+        ("energy", pa.float64()),
+        ("power_factor", pa.float64()),
+        ("frequency", pa.float64()),
+    ])
+
+
+def parquet_stream(chunks: Iterator[Chunk]) -> Iterator[bytes]:
+    """One row group per chunk, sent as soon as it is written"""
+    schema = parquet_schema()
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for chunk in chunks:
+            columns = list(zip(*chunk))
+            writer.write_batch(pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            yield sink.drain()
+    # Footer
+    yield sink.drain()
+
+
+class ExportFormat(NamedTuple):
+    media_type: str
+    extension: str
+    stream: Callable[[Iterator[Chunk]], Iterator[bytes]]
+
+
+EXPORT_FORMATS: Dict[str, ExportFormat] = {
+    "csv": ExportFormat("text/csv", "csv", csv_stream),
+    "ndjson": ExportFormat("application/x-ndjson", "ndjson", ndjson_stream),
+    "parquet": ExportFormat("application/vnd.apache.parquet", "parquet", parquet_stream),
+}
+
+
+def parquet_available() -> bool:
+    return pq is not None
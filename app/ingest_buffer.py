@@ -0,0 +1,344 @@
+import asyncio
+import fcntl
+import logging
+import os
+import re
+import threading
+import uuid
+from datetime import datetime
+from typing import IO, List, Optional
+import orjson
+from fastapi import HTTPException, status
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import text
+from app.config import settings
+from app.database import SessionLocal
+from app.readings import write_readings
+from app.serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+# <owner>-<sequence>.ndjson, one reading per line. The owner is
+# <pid>.<random hex>: pids are reused (from 1 again in every container),
+# so a new worker must never take a crashed one's files for its own.
+# Bare <pid> owners are from spools written before the suffix was added.
+SEGMENT_FILE = re.compile(r"^(\d+(?:\.[0-9a-f]+)?)-(\d+)\.ndjson$")
+
+# Readings the database rejected, kept for inspection instead of retried
+DEAD_LETTER_FILE = "dead-letter.ndjson"
+
+
+class IngestBuffer:
+    """Write-behind queue for ingested readings.
+    
+    ``submit`` appends readings to this worker's spool file, fsyncs it and
+    returns, so the caller is acknowledged without a database commit. A
+    background task writes everything buffered through ``write_readings``
+    once ``flush_rows`` readings are waiting or every ``flush_seconds``,
+    and only then deletes the spool segments those readings came from.
+    
+    Each worker holds an ``flock`` on ``<owner>.lock`` while it runs, where
+    the owner id is unique to the process, and only ever creates new
+    segment files. On startup a worker replays the segments of any owner
+    whose lock is free, i.e. of a worker that crashed. Delivery is at least once: a crash
+    between a flush committing and its segments being deleted replays
+    those readings again. At most ``max_rows`` readings are held; beyond
+    that ``submit`` rejects with 429.
+    
+    A batch that fails while the database is reachable is split in halves
+    until the readings it rejects on their own are found; those go to
+    ``dead-letter.ndjson`` and the rest are written. When the database is
+    down the batch stays buffered and is retried.
+    """
+    
+    def __init__(self, directory: str, max_rows: int, flush_rows: int, flush_seconds: float):
+        self.directory = directory
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.flushed = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dead_lettered = 0
+        self.rejected = 0
+        self.replayed = 0
+        self._rows: List[dict] = []
+        # Closed spool segments whose readings are all still buffered
+        self._segments: List[str] = []
+        self._spool: Optional[IO[bytes]] = None
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._lock_fd: Optional[int] = None
+        # Set by recover, in the worker process itself rather than at import
+        self._owner: Optional[str] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        await run_in_threadpool(self.recover)
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Stop the flusher and write whatever is still buffered"""
+        self._loop = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await run_in_threadpool(self.flush)
+        except Exception:
+            logger.exception("Final ingest flush failed; readings stay spooled for the next start")
+            return
+        
+        # Nothing left to replay
+        if self._lock_fd is not None:
+            os.remove(os.path.join(self.directory, f"{self._owner}.lock"))
+            os.close(self._lock_fd)
+            self._lock_fd = None
+    
+    def submit(self, readings: List[dict]) -> int:
+        """Buffer readings durably; they are written to the database later"""
+        if not readings:
+            return 0
+        
+        # Stamp arrival time now, not when the flush happens
+        now = datetime.now()
+        for reading in readings:
+            if reading.get("recorded_at") is None:
+                reading["recorded_at"] = now
+        data = b"".join(dumps(reading) + b"\n" for reading in readings)
+        
+        with self._lock:
+            if len(self._rows) + len(readings) > self.max_rows:
+                self.rejected += len(readings)
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Ingest buffer is full, try again shortly",
+                    headers={"Retry-After": str(max(1, round(self.flush_seconds)))},
+                )
+            spool = self._current_spool()
+            spool.write(data)
+            spool.flush()
+            os.fsync(spool.fileno())
+            self._rows.extend(readings)
+            full = len(self._rows) >= self.flush_rows
+        
+        if full:
+            self._wake_flusher()
+        return len(readings)
+    
+    def flush(self) -> int:
+        """Write all buffered readings in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._rows:
+                    return 0
+                rows, self._rows = self._rows, []
+                self._close_spool()
+                segments, self._segments = self._segments, []
+            
+            try:
+                dead = self._write_batch(rows)
+            except Exception:
+                # Put them back in front of anything buffered meanwhile
+                with self._lock:
+                    self._rows[:0] = rows
+                    self._segments[:0] = segments
+                    self.failed_flushes += 1
+                raise
+            
+            self._dead_letter(dead)
+            for path in segments:
+                os.remove(path)
+            self.flushed += len(rows) - len(dead)
+            self.flushes += 1
+            return len(rows) - len(dead)
+    
+    def recover(self):
+        """Replay spool segments left by crashed workers, then lock our own.
+        
+        A spool that can't be replayed now (the database is down) is left
+        for the next worker that starts.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".lock"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except FileNotFoundError:
+                # Another worker replayed it meanwhile
+                continue
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Its worker is alive
+                    continue
+                if not self._is_current(path, fd):
+                    continue
+                try:
+                    self._replay(name[:-len(".lock")])
+                except Exception:
+                    logger.exception("Could not replay the spool of %s; leaving it for the next start", name)
+                    continue
+                os.remove(path)
+            finally:
+                os.close(fd)
+        
+        # Locked before it appears under its real name, so no other worker
+        # can ever see it unlocked and take it for a crashed one
+        self._owner = f"{os.getpid()}.{uuid.uuid4().hex[:12]}"
+        path = os.path.join(self.directory, f"{self._owner}.lock")
+        self._lock_fd = os.open(f"{path}.new", os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+        os.rename(f"{path}.new", path)
+    
+    @staticmethod
+    def _is_current(path: str, fd: int) -> bool:
+        """Whether ``fd`` is still the file at ``path``, not one replayed and removed"""
+        try:
+            return os.stat(path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            return False
+    
+    def _replay(self, owner: str):
+        segments = sorted(
+            (int(match.group(2)), name)
+            for name in os.listdir(self.directory)
+            if (match := SEGMENT_FILE.match(name)) and match.group(1) == owner
+        )
+        for _, name in segments:
+            path = os.path.join(self.directory, name)
+            rows = []
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        reading = orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        # Torn last line of a write that was never acknowledged
+                        continue
+                    reading["recorded_at"] = datetime.fromisoformat(reading["recorded_at"])
+                    rows.append(reading)
+            dead = []
+            for offset in range(0, len(rows), self.flush_rows):
+                dead += self._write_batch(rows[offset:offset + self.flush_rows])
+            self._dead_letter(dead)
+            os.remove(path)
+            self.replayed += len(rows) - len(dead)
+            logger.info("Replayed %d spooled readings from %s", len(rows) - len(dead), name)
+    
+    def _write(self, rows: List[dict]):
+        db = SessionLocal()
+        try:
+            write_readings(db, rows)
+        finally:
+            db.close()
+    
+    def _write_batch(self, rows: List[dict]) -> List[dict]:
+        """Write ``rows``, returning the ones the database rejects on their own.
+        
+        Raises when the database can't be reached, so nothing is given up
+        because of an outage.
+        """
+        try:
+            self._write(rows)
+            return []
+        except Exception:
+            if not self._database_reachable():
+                raise
+            if len(rows) == 1:
+                logger.exception("Database rejected a buffered reading; dead-lettering it")
+                return rows
+        
+        middle = len(rows) // 2
+        return self._write_batch(rows[:middle]) + self._write_batch(rows[middle:])
+    
+    @staticmethod
+    def _database_reachable() -> bool:
+        db = SessionLocal()
+        try:
+            db.execute(text("SELECT 1"))
+            return True
+        except Exception:
+            return False
+        finally:
+            db.close()
+    
+    def _dead_letter(self, rows: List[dict]):
+        if not rows:
+            return
+        with open(os.path.join(self.directory, DEAD_LETTER_FILE), "ab") as f:
+            f.write(b"".join(dumps(reading) + b"\n" for reading in rows))
+            f.flush()
+            os.fsync(f.fileno())
+        self.dead_lettered += len(rows)
+        logger.warning("Dead-lettered %d readings to %s", len(rows), DEAD_LETTER_FILE)
+    
+    def _current_spool(self) -> IO[bytes]:
+        if self._spool is None:
+            self._sequence += 1
+            path = os.path.join(self.directory, f"{self._owner}-{self._sequence}.ndjson")
+            # Never append to a file left by someone else
+            self._spool = open(path, "xb")
+        return self._spool
+    
+    def _close_spool(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._segments.append(self._spool.name)
+            self._spool = None
+    
+    def _wake_flusher(self):
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            # Loop closed during shutdown
+            pass
+    
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await run_in_threadpool(self.flush)
+            except Exception:
+                logger.exception("Ingest flush failed, %d readings stay buffered", len(self._rows))
+                # Back off instead of retrying on every submit
+                await asyncio.sleep(self.flush_seconds)
+    
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._rows),
+            "segments": len(self._segments) + (self._spool is not None),
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "dead_lettered": self.dead_lettered,
+            "rejected": self.rejected,
+            "replayed": self.replayed
+        }
+
+
+ingest_buffer: Optional[IngestBuffer] = None
+if settings.INGEST_BUFFER:
+    ingest_buffer = IngestBuffer(
+        settings.INGEST_SPOOL_DIR,
+        max_rows=settings.INGEST_BUFFER_MAX_ROWS,
+        flush_rows=settings.INGEST_FLUSH_ROWS,
+        flush_seconds=settings.INGEST_FLUSH_SECONDS
+    )
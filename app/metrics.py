@@ -0,0 +1,226 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.broadcast import broadcaster
+from app.database import active_pool_stats, async_engine, engine
+from app.events import bus
+from app.websocket import manager
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Route label for requests no route matched, so 404 scans can't add series
+UNMATCHED_ROUTE = "unmatched"
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class Histogram:
+    """Cumulative-on-render histogram; ``observe`` only bumps one slot"""
+    
+    __slots__ = ("bounds", "counts", "total", "count")
+    
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # Last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+    
+    def render(self, name: str, labels: str, lines: List[str]):
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+
+
+class RouteMetrics:
+    """Everything recorded for one method + route template"""
+    
+    __slots__ = ("labels", "statuses", "duration", "statements", "db_time")
+    
+    def __init__(self, method: str, route: str):
+        self.labels = f'method="{escape(method)}",route="{escape(route)}"'
+        self.statuses: Dict[int, int] = {}
+        self.duration = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.db_time = Histogram(LATENCY_BUCKETS)
+
+
+class RequestStats:
+    """Database work done while serving the current request"""
+    
+    __slots__ = ("statements", "db_time", "started")
+    
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self.started = 0.0
+
+
+# Set by the middleware; copied into threadpool workers and run_sync greenlets
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Per-worker request metrics; each gunicorn worker reports its own"""
+    
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self.in_flight = 0
+        self._templates: Dict[object, str] = {}
+    
+    def route_template(self, scope) -> str:
+        """Path template of the route that handled a request"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        template = self._templates.get(endpoint)
+        if template is None:
+            # Routers and mounts record the matched endpoint (or mounted app)
+            for route in scope["app"].routes:
+                self._templates[getattr(route, "endpoint", None) or getattr(route, "app", None)] = route.path
+            template = self._templates.setdefault(endpoint, UNMATCHED_ROUTE)
+        return template
+    
+    def observe(self, scope, status: int, duration: float, request: RequestStats):
+        key = (scope["method"], self.route_template(scope))
+        route = self.routes.get(key)
+        if route is None:
+            route = self.routes[key] = RouteMetrics(*key)
+        route.statuses[status] = route.statuses.get(status, 0) + 1
+        route.duration.observe(duration)
+        route.statements.observe(request.statements)
+        route.db_time.observe(request.db_time)
+    
+    def render(self) -> str:
+        """Prometheus text exposition of this worker's metrics"""
+        lines: List[str] = []
+        routes = sorted(self.routes.values(), key=lambda route: route.labels)
+        
+        lines.append("# HELP http_requests_total HTTP requests by route template and status")
+        lines.append("# TYPE http_requests_total counter")
+        for route in routes:
+            for status, count in sorted(route.statuses.items()):
+                lines.append(f'http_requests_total{{{route.labels},status="{status}"}} {count}')
+        
+        for name, attr, help_text in (
+            ("http_request_duration_seconds", "duration", "Time to serve a request, including the response body"),
+            ("http_request_db_statements", "statements", "SQL statements executed per request"),
+            ("http_request_db_seconds", "db_time", "Time spent executing SQL per request"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for route in routes:
+                getattr(route, attr).render(name, route.labels, lines)
+        
+        depths = manager.queue_depths()
+        events = bus.stats()
+        pool = active_pool_stats()
+        held = pool.sweep()
+        pool_snapshot = pool.snapshot()
+        for name, kind, value, help_text in (
+            ("http_requests_in_flight", "gauge", self.in_flight, "Requests being served"),
+            ("websocket_connections", "gauge", len(manager.active_connections), "Open WebSocket clients"),
+            ("websocket_topics", "gauge", len(manager.subscriptions), "Topics with at least one subscriber"),
+            ("websocket_queue_depth_total", "gauge", depths["total"], "Messages waiting in client send queues"),
+            ("websocket_queue_depth_max", "gauge", depths["max"], "Longest client send queue"),
+            ("event_bus_pending", "gauge", events["pending"], "Committed events waiting to be published"),
+            ("event_bus_dropped_total", "counter", events["dropped"], "Events dropped because the queue was full"),
+            ("db_pool_size", "gauge", pool_snapshot["size"], "Configured pool size"),
+            ("db_pool_in_use", "gauge", pool_snapshot["in_use"], "Connections checked out"),
+            ("db_pool_overflow", "gauge", pool_snapshot["overflow"], "Overflow connections open"),
+            ("db_pool_checkouts_total", "counter", pool.checkouts, "Connection checkouts"),
+            ("db_pool_checkout_wait_seconds_total", "counter", pool.wait_total, "Time spent checking out connections"),
+            ("db_pool_timeouts_total", "counter", pool.timeouts, "Checkouts that timed out"),
+            ("db_pool_overflow_events_total", "counter", pool.overflow_events, "Checkouts that opened an overflow connection"),
+            ("db_pool_oldest_checkout_seconds", "gauge", pool_snapshot["oldest_checkout_seconds"], "Age of the longest held connection"),
+            ("db_long_held_sessions_total", "counter", pool.long_held_sessions, "Requests that held a session past the warning threshold"),
+            ("db_pool_long_held", "gauge", held, "Connections checked out past the warning threshold"),
+            ("db_long_held_connections_total", "counter", pool.long_held_connections, "Connections found still checked out past the warning threshold"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {value}")
+        
+        for name, value in broadcaster.stats().items():
+            if isinstance(value, (bool, int, float)):
+                lines.append(f"# TYPE broadcast_{name} gauge")
+                lines.append(f"broadcast_{name} {float(value)}")
+        
+        lines.append("")
+        return "\n".join(lines)
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and database work"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        request = RequestStats()
+        token = current_request.set(request)
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            metrics.in_flight -= 1
+            current_request.reset(token)
+            metrics.observe(scope, status, duration, request)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request = current_request.get()
+    if request is not None:
+        request.started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request = current_request.get()
+    if request is not None:
+        request.statements += 1
+        request.db_time += time.perf_counter() - request.started
+
+
+def instrument_engine(engine: Engine):
+    """Count statements and SQL time of the current request on ``engine``"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+instrument_engine(engine)
+if async_engine is not None:
+    instrument_engine(async_engine.sync_engine)
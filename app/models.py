@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Enum, Text
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Date, DateTime, Boolean, ForeignKey, Enum, Text, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -96,6 +96,52 @@ class PowerData(Base):
     device = relationship("Device", back_populates="power_data")
 
 
+class EnergyDaily(Base):
+    """Total energy per day, maintained incrementally on write"""
+    __tablename__ = "energy_daily"
+    
+    day = Column(Date, primary_key=True)
+    energy = Column(Float, default=0.0)  # kWh
+    reading_count = Column(Integer, default=0)
+
+
+class DeviceEnergyDaily(Base):
+    """Energy per device per day, maintained incrementally on write"""
+    __tablename__ = "device_energy_daily"
+    
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    energy = Column(Float, default=0.0)  # kWh
+    reading_count = Column(Integer, default=0)
+
+
+class PowerRollup(Base):
+    """Per-device aggregates of power data at a fixed bucket resolution.
+
+    ``bucket`` is the bucket start as wall-clock epoch seconds (the local
+    ``recorded_at`` time read as if it were UTC).
+    """
+    __tablename__ = "power_rollup"
+    __table_args__ = (Index("idx_rollup_bucket", "resolution", "bucket"),)
+    
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    resolution = Column(Integer, primary_key=True)  # Seconds per bucket
+    bucket = Column(BigInteger, primary_key=True)
+    reading_count = Column(Integer, default=0)
+    voltage_sum = Column(Float, default=0.0)
+    voltage_min = Column(Float)
+    voltage_max = Column(Float)
+    current_sum = Column(Float, default=0.0)
+    current_min = Column(Float)
+    current_max = Column(Float)
+    power_sum = Column(Float, default=0.0)
+    power_min = Column(Float)
+    power_max = Column(Float)
+    energy_sum = Column(Float, default=0.0)
+    energy_min = Column(Float)
+    energy_max = Column(Float)
+
+
 class Alert(Base):
     __tablename__ = "alerts"
     
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, Optional, Set
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """Connection pool counters for one engine.
+    
+    Tracks how long checkouts wait for a connection, how often the pool
+    has to open overflow connections or times out, which connections are
+    currently checked out and for how long, and sessions held past the
+    warning threshold. A session is only reported when it closes, so
+    ``sweep`` (run periodically once ``start`` is called, and on every
+    metrics render) also warns about connections that are still checked
+    out past the threshold, e.g. by a stuck request.
+    """
+    
+    def __init__(self, session_warn_seconds: float):
+        self.session_warn_seconds = session_warn_seconds
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.overflow_events = 0
+        self.long_held_sessions = 0
+        self.long_held_connections = 0
+        self.pool = None
+        self._checked_out: Dict[int, float] = {}
+        # Checkouts the sweep already warned about
+        self._warned: Set[int] = set()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+    
+    def attach(self, engine: Engine):
+        """Collect stats for ``engine``, whose pool must be a timed pool"""
+        self.pool = engine.pool
+        engine.pool.stats = self
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+    
+    def record_checkout(self, wait: float, overflowed: bool):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if overflowed:
+                self.overflow_events += 1
+    
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+    
+    def session_closed(self, held: float, label: Optional[str] = None):
+        """Warn about a request that kept its session longer than the threshold"""
+        if held <= self.session_warn_seconds:
+            return
+        with self._lock:
+            self.long_held_sessions += 1
+        logger.warning("Database session for %s held for %.1fs", label or "unknown request", held)
+    
+    def sweep(self) -> int:
+        """Warn once about every connection checked out past the threshold; returns how many are"""
+        now = time.monotonic()
+        held = 0
+        newly_held = []
+        with self._lock:
+            for key, since in list(self._checked_out.items()):
+                if now - since <= self.session_warn_seconds:
+                    continue
+                held += 1
+                if key not in self._warned:
+                    self._warned.add(key)
+                    self.long_held_connections += 1
+                    newly_held.append(now - since)
+        for seconds in newly_held:
+            logger.warning("Database connection checked out for %.1fs and still held", seconds)
+        return held
+    
+    async def start(self):
+        """Sweep for long-held connections in the background"""
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+    
+    async def _run(self):
+        interval = max(self.session_warn_seconds / 2, 1.0)
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+    
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self._checked_out[id(connection_record)] = time.monotonic()
+    
+    def _on_checkin(self, dbapi_connection, connection_record):
+        key = id(connection_record)
+        self._checked_out.pop(key, None)
+        if key in self._warned:
+            with self._lock:
+                self._warned.discard(key)
+    
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        oldest = min(self._checked_out.values(), default=None)
+        return {
+            "size": self.pool.size() if self.pool is not None else 0,
+            "in_use": self.pool.checkedout() if self.pool is not None else 0,
+            "overflow": max(self.pool.overflow(), 0) if self.pool is not None else 0,
+            "checkouts": self.checkouts,
+            "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+            "timeouts": self.timeouts,
+            "overflow_events": self.overflow_events,
+            "oldest_checkout_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            "long_held_sessions": self.long_held_sessions,
+            "long_held_connections": self.long_held_connections
+        }
+
+
+class TimedPoolMixin:
+    """Times every checkout, including waits for a free connection"""
+    
+    stats: Optional[PoolStats] = None
+    
+    def connect(self):
+        overflow = self.overflow()
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            if self.stats is not None:
+                self.stats.record_timeout()
+            raise
+        if self.stats is not None:
+            self.stats.record_checkout(time.perf_counter() - start, self.overflow() > max(overflow, 0))
+        return connection
+    
+    def recreate(self):
+        # Keep counting across pool resets (e.g. after a disconnect)
+        pool = super().recreate()
+        pool.stats = self.stats
+        if self.stats is not None:
+            self.stats.pool = pool
+        return pool
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
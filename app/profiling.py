@@ -0,0 +1,270 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Deque, Dict, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.config import settings
+from app.database import async_engine, engine
+
+logger = logging.getLogger(__name__)
+
+# Statement prefix that shows the plan of a query, per dialect
+EXPLAIN_PREFIXES = {
+    "mysql": "EXPLAIN ",
+    "mariadb": "EXPLAIN ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+}
+
+# Each fingerprint is explained at most once per this many seconds
+EXPLAIN_INTERVAL_SECONDS = 300
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\?|:\w+|\$\d+")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> Tuple[str, str]:
+    """Normalized statement and its short id.
+    
+    Literals and bind placeholders become ``?`` and expanded IN lists or
+    multi-row VALUES collapse to ``(?+)``, so the same query with
+    different values (or list lengths) shares one fingerprint.
+    """
+    normalized = _SPACE.sub(" ", statement).strip()
+    normalized = _STRING.sub("?", normalized)
+    normalized = _PLACEHOLDER.sub("?", normalized)
+    normalized = _NUMBER.sub("?", normalized)
+    normalized = _VALUE_LIST.sub("(?+)", normalized)
+    return normalized, hashlib.md5(normalized.encode()).hexdigest()[:12]
+
+
+class StatementTotals:
+    """Aggregate of one fingerprint in one minute"""
+    
+    __slots__ = ("calls", "total", "max", "n_plus_one")
+    
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.n_plus_one = 0
+
+
+class RequestProfile:
+    """Statements executed while serving one request"""
+    
+    __slots__ = ("label", "counts", "statements")
+    
+    def __init__(self, label: str):
+        self.label = label
+        self.counts: Dict[str, int] = {}
+        self.statements: Dict[str, str] = {}
+
+
+# Set by ProfileMiddleware; copied into threadpool workers and run_sync greenlets
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar("current_profile", default=None)
+
+
+class SQLProfiler:
+    """Opt-in statement profiler: slow-query log, N+1 detection, top-N report.
+    
+    Statement timings are aggregated per fingerprint into one bucket per
+    minute and the report merges the buckets of the last ``window_minutes``.
+    Slow statements are logged with their plan; EXPLAIN runs later on its
+    own connection from a single background thread so it never touches
+    the cursor of the statement being profiled or delays the request.
+    """
+    
+    def __init__(self, slow_ms: float, n_plus_one_threshold: int, top_n: int, window_minutes: int):
+        self.slow_seconds = slow_ms / 1000
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.top_n = top_n
+        self.window_minutes = window_minutes
+        self.slow_statements = 0
+        self.n_plus_one_requests = 0
+        self._buckets: Deque[Tuple[int, Dict[str, StatementTotals]]] = deque()
+        self._normalized: Dict[str, str] = {}
+        self._explained: Dict[str, float] = {}
+        self._explain_engine: Optional[Engine] = None
+        self._explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sql-explain")
+        self._lock = threading.Lock()
+    
+    def attach(self, engine: Engine, explain_engine: Engine):
+        """Profile statements run on ``engine``; EXPLAIN through ``explain_engine``"""
+        self._explain_engine = explain_engine
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+    
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not context.execution_options.get("sql_profile", True):
+            return
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+    
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not context.execution_options.get("sql_profile", True):
+            return
+        duration = time.perf_counter() - conn.info["profile_started"].pop()
+        normalized, fp = fingerprint(statement)
+        
+        with self._lock:
+            totals = self._totals(fp, normalized)
+            totals.calls += 1
+            totals.total += duration
+            totals.max = max(totals.max, duration)
+        
+        profile = current_profile.get()
+        if profile is not None:
+            profile.counts[fp] = profile.counts.get(fp, 0) + 1
+            profile.statements.setdefault(fp, normalized)
+        
+        if duration >= self.slow_seconds:
+            self.slow_statements += 1
+            label = profile.label if profile is not None else "background"
+            logger.warning("Slow SQL (%.1f ms, %s) [%s]: %s", duration * 1000, label, fp, statement)
+            if not executemany:
+                self._explain_later(fp, statement, parameters)
+    
+    def _handle_error(self, context):
+        # A failed statement never reaches after_cursor_execute
+        execution = context.execution_context
+        if execution is None or not execution.execution_options.get("sql_profile", True):
+            return
+        started = context.connection.info.get("profile_started")
+        if started:
+            started.pop()
+    
+    def _totals(self, fp: str, normalized: str) -> StatementTotals:
+        minute = int(time.time() // 60)
+        if not self._buckets or self._buckets[-1][0] != minute:
+            self._buckets.append((minute, {}))
+            while self._buckets[0][0] <= minute - self.window_minutes:
+                self._buckets.popleft()
+        bucket = self._buckets[-1][1]
+        totals = bucket.get(fp)
+        if totals is None:
+            totals = bucket[fp] = StatementTotals()
+            self._normalized[fp] = normalized
+        return totals
+    
+    def finish_request(self, profile: RequestProfile):
+        """Flag fingerprints repeated often enough in one request to look like N+1"""
+        repeated = [(fp, count) for fp, count in profile.counts.items() if count >= self.n_plus_one_threshold]
+        if not repeated:
+            return
+        self.n_plus_one_requests += 1
+        with self._lock:
+            for fp, count in repeated:
+                self._totals(fp, profile.statements[fp]).n_plus_one += 1
+        for fp, count in repeated:
+            logger.warning(
+                "Possible N+1 in %s: [%s] ran %d times: %s",
+                profile.label, fp, count, profile.statements[fp]
+            )
+    
+    def _explain_later(self, fp: str, statement: str, parameters):
+        engine = self._explain_engine
+        prefix = EXPLAIN_PREFIXES.get(engine.dialect.name) if engine is not None else None
+        if prefix is None or not statement.lstrip()[:6].upper() == "SELECT":
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._explained.get(fp, -EXPLAIN_INTERVAL_SECONDS) < EXPLAIN_INTERVAL_SECONDS:
+                return
+            self._explained[fp] = now
+        self._explainer.submit(self._explain, engine, fp, prefix + statement, parameters)
+    
+    def _explain(self, engine: Engine, fp: str, statement: str, parameters):
+        try:
+            with engine.connect().execution_options(sql_profile=False) as conn:
+                rows = conn.exec_driver_sql(statement, parameters).all()
+        except Exception as e:
+            logger.warning("EXPLAIN failed for [%s]: %s", fp, e)
+            return
+        plan = "\n".join("  " + " | ".join(str(value) for value in row) for row in rows)
+        logger.warning("Plan for [%s]:\n%s", fp, plan)
+    
+    def report(self) -> dict:
+        """Top statements by total time over the rolling window"""
+        merged: Dict[str, StatementTotals] = {}
+        with self._lock:
+            oldest = int(time.time() // 60) - self.window_minutes
+            for minute, bucket in self._buckets:
+                if minute <= oldest:
+                    continue
+                for fp, totals in bucket.items():
+                    into = merged.setdefault(fp, StatementTotals())
+                    into.calls += totals.calls
+                    into.total += totals.total
+                    into.max = max(into.max, totals.max)
+                    into.n_plus_one += totals.n_plus_one
+            statements = dict(self._normalized)
+        
+        top = sorted(merged.items(), key=lambda item: item[1].total, reverse=True)[:self.top_n]
+        return {
+            "window_minutes": self.window_minutes,
+            "slow_statements": self.slow_statements,
+            "n_plus_one_requests": self.n_plus_one_requests,
+            "top": [
+                {
+                    "fingerprint": fp,
+                    "statement": statements[fp],
+                    "calls": totals.calls,
+                    "total_ms": round(totals.total * 1000, 3),
+                    "avg_ms": round(totals.total / totals.calls * 1000, 3) if totals.calls else 0.0,
+                    "max_ms": round(totals.max * 1000, 3),
+                    "n_plus_one_requests": totals.n_plus_one
+                }
+                for fp, totals in top
+            ]
+        }
+    
+    def shutdown(self):
+        self._explainer.shutdown(wait=False)
+
+
+class ProfileMiddleware:
+    """ASGI middleware collecting the statements of each request"""
+    
+    def __init__(self, app, profiler: SQLProfiler):
+        self.app = app
+        self.profiler = profiler
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        profile = RequestProfile(f"{scope['method']} {scope['path']}")
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_profile.reset(token)
+            self.profiler.finish_request(profile)
+
+
+# Only built when SQL_PROFILE is on; otherwise no listeners are installed
+profiler: Optional[SQLProfiler] = None
+if settings.SQL_PROFILE:
+    profiler = SQLProfiler(
+        settings.SQL_SLOW_MS,
+        settings.SQL_N_PLUS_ONE_THRESHOLD,
+        settings.SQL_PROFILE_TOP_N,
+        settings.SQL_PROFILE_WINDOW_MINUTES
+    )
+    profiler.attach(engine, engine)
+    if async_engine is not None:
+        # Async statements use the same paramstyle as the sync driver
+        profiler.attach(async_engine.sync_engine, engine)
@@ -0,0 +1,216 @@
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+import logging
+import threading
+from sqlalchemy import func, insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, aliased
+from app.database import is_deadlock
+from app.models import PowerData
+from app.events import emit_readings, emit_stats
+from app.rollups import record_daily_energy, record_power_rollups, energy_for_day
+from app.shared_counters import counters
+from app.tsdb import reading_store
+from app.alert_rules import alert_engine
+
+logger = logging.getLogger(__name__)
+
+# Extra attempts for a write the database aborted to break a deadlock
+DEADLOCK_RETRIES = 3
+
+READING_FIELDS = (
+    "id", "device_id", "voltage", "current", "power",
+    "energy", "power_factor", "frequency", "recorded_at"
+)
+
+
+def local_time(moment: datetime) -> datetime:
+    """``moment`` as naive local time, the way readings are stored"""
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone().replace(tzinfo=None)
+
+
+def write_readings(db: Session, readings: List[dict]) -> int:
+    """Bulk insert power readings in a single transaction.
+
+    Every reading is a dict with the ``PowerData`` columns. Rows are sent
+    as one executemany INSERT instead of one ORM object per reading, and
+    the daily energy and power_rollup tiers are updated in the same
+    transaction, as are alerts raised by the threshold rules. Real-time
+    events for the readings, alerts and today's energy are published once
+    the transaction commits. With the columnar store the
+    readings are appended there instead of to ``power_data``, only once
+    the transaction has committed, so a failed commit and the client's
+    retry never leave them stored twice. They are encoded beforehand, so
+    bad values still fail the transaction. A transaction the database
+    aborts to break a deadlock is retried up to ``DEADLOCK_RETRIES`` times.
+    The latest-reading cache is updated with the rows as stored, ids
+    included (see ``insert_readings``).
+    """
+    if not readings:
+        return 0
+
+    now = datetime.now()
+    for reading in readings:
+        recorded_at = reading.get("recorded_at")
+        reading["recorded_at"] = now if recorded_at is None else local_time(recorded_at)
+
+    for attempt in range(DEADLOCK_RETRIES + 1):
+        try:
+            encoded, latest = stage_readings(db, readings)
+            db.commit()
+            break
+        except DBAPIError as e:
+            db.rollback()
+            if attempt == DEADLOCK_RETRIES or not is_deadlock(e):
+                raise
+            logger.warning("Deadlock writing %d readings, retrying (attempt %d)", len(readings), attempt + 1)
+
+    if reading_store is not None:
+        reading_store.append(encoded)
+
+    latest_cache.record(latest)
+
+    return len(readings)
+
+
+def stage_readings(db: Session, readings: List[dict]):
+    """Add readings, their rollups, events and alerts to the open transaction.
+
+    Returns the readings encoded for the columnar store (None without
+    it) and the readings for the latest-reading cache.
+    """
+    encoded = None
+    if reading_store is None:
+        latest = insert_readings(db, readings)
+    else:
+        encoded = reading_store.encode(readings)
+        latest = readings
+    record_daily_energy(db, readings)
+    record_power_rollups(db, readings)
+    emit_readings(db, readings)
+    emit_stats(db, {"today_energy": energy_for_day(db, date.today())})
+    alert_engine.evaluate(db, readings)
+    return encoded, latest
+
+
+def insert_readings(db: Session, readings: List[dict]) -> List[dict]:
+    """Bulk insert readings into power_data; returns each touched device's newest row.
+
+    The executemany INSERT doesn't return generated keys, so the rows the
+    latest-reading cache keeps, ids included, come from one follow-up
+    query. It only ranks rows at least as new as the oldest of the
+    batch's per-device newest readings, not each device's whole history.
+    """
+    # Core insert on the table: the ORM bulk path would build a command per row
+    db.execute(insert(PowerData.__table__), readings)
+    newest = newest_by_device(readings)
+    # MySQL DATETIME may round the stored time down to the second
+    since = min(reading["recorded_at"] for reading in newest.values()) - timedelta(seconds=1)
+    rows = get_latest_by_device(db, newest, since)
+    return [{field: getattr(row, field) for field in READING_FIELDS} for row in rows.values()]
+
+
+def newest_by_device(readings: List[dict]) -> Dict[int, dict]:
+    """Newest reading of each device in a batch; the later one wins a tie"""
+    newest: Dict[int, dict] = {}
+    for reading in readings:
+        current = newest.get(reading["device_id"])
+        if current is None or reading["recorded_at"] >= current["recorded_at"]:
+            newest[reading["device_id"]] = reading
+    return newest
+
+
+def get_latest_by_device(
+    db: Session,
+    device_ids: Optional[Iterable[int]] = None,
+    since: Optional[datetime] = None
+) -> Dict[int, PowerData]:
+    """Get the newest PowerData row per device in one query.
+
+    Uses ROW_NUMBER() over each device's readings instead of one
+    ``ORDER BY recorded_at DESC LIMIT 1`` query per device. With ``since``
+    only readings recorded from then on are ranked.
+    """
+    ranked = db.query(
+        PowerData.id,
+        func.row_number().over(
+            partition_by=PowerData.device_id,
+            order_by=(PowerData.recorded_at.desc(), PowerData.id.desc())
+        ).label('rn')
+    )
+    if device_ids is not None:
+        device_ids = list(device_ids)
+        if not device_ids:
+            return {}
+        ranked = ranked.filter(PowerData.device_id.in_(device_ids))
+    if since is not None:
+        ranked = ranked.filter(PowerData.recorded_at >= since)
+    ranked = ranked.subquery()
+
+    latest = aliased(PowerData)
+    rows = db.query(latest).join(
+        ranked, latest.id == ranked.c.id
+    ).filter(ranked.c.rn == 1).all()
+
+    return {row.device_id: row for row in rows}
+
+
+class LatestReadingCache:
+    """Newest reading per device, kept in process memory.
+
+    The cache is filled from the database with one query on first use and
+    then updated by ``write_readings``. Every write bumps the shared
+    ``latest_readings`` counter; when another worker has bumped it since
+    this process last looked, the next read re-hydrates from the database.
+
+    Readings from the columnar store carry ``id=None``, as it has no ids.
+    """
+
+    def __init__(self):
+        self._readings: Dict[int, dict] = {}
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def get_all(self, db: Session) -> Dict[int, dict]:
+        """Get the latest reading of every device, keyed by device_id"""
+        version = counters.get("latest_readings")
+        if version != self._version:
+            self.hydrate(db, version)
+        return self._readings
+
+    def hydrate(self, db: Session, version: int):
+        """Reload every device's latest reading from the database or the columnar store"""
+        if reading_store is not None:
+            readings = reading_store.latest()
+        else:
+            rows = get_latest_by_device(db)
+            readings = {
+                device_id: {field: getattr(row, field) for field in READING_FIELDS}
+                for device_id, row in rows.items()
+            }
+        with self._lock:
+            self._readings = readings
+            self._version = version
+
+    def record(self, readings: List[dict]):
+        """Apply newly committed readings and notify other workers"""
+        newest = newest_by_device(readings)
+
+        with self._lock:
+            # Copy on write so readers iterating the old dict are unaffected
+            updated = dict(self._readings)
+            for device_id, reading in newest.items():
+                current = updated.get(device_id)
+                if current is None or reading["recorded_at"] >= current["recorded_at"]:
+                    updated[device_id] = {field: reading.get(field) for field in READING_FIELDS}
+            self._readings = updated
+
+            version = counters.bump("latest_readings")
+            # Stay current only if no other worker wrote since our last sync
+            if self._version is not None and version == self._version + 1:
+                self._version = version
+
+
+latest_cache = LatestReadingCache()
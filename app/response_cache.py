@@ -0,0 +1,134 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import AppSession
+from app.serialization import dumps
+from app.shared_counters import counters
+
+# Key in Session.info holding data domains written by the open transaction
+TOUCHED_DOMAINS = "touched_domains"
+
+CACHE_CONTROL = "private, no-cache"
+
+
+class CachedResponse(NamedTuple):
+    etag: str
+    body: bytes
+
+
+def touch(db: Session, *domains: str):
+    """Mark domains as changed; their versions are bumped when ``db`` commits"""
+    db.info.setdefault(TOUCHED_DOMAINS, set()).update(domains)
+
+
+def _after_commit(session: Session):
+    for domain in session.info.pop(TOUCHED_DOMAINS, ()):
+        counters.bump(domain)
+
+
+def _after_transaction_end(session: Session, transaction):
+    if transaction.parent is None:
+        # Rolled back or closed without committing: nothing changed
+        session.info.pop(TOUCHED_DOMAINS, None)
+
+
+event.listen(AppSession, "after_commit", _after_commit)
+event.listen(AppSession, "after_transaction_end", _after_transaction_end)
+
+
+def if_none_match(request: Request) -> Iterable[str]:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return ()
+    return [tag.strip() for tag in header.split(",")]
+
+
+class ResponseCache:
+    """Encoded JSON responses of read endpoints, validated by version counters.
+    
+    An entry is keyed by path, query parameters and role, and is current
+    while the shared counters of the domains it was built from (plus any
+    extra parts such as the date) are unchanged. The ETag is derived from
+    that key, those versions and the counters' epoch, so every worker
+    computes the same tag for the same data: a poll whose ``If-None-Match``
+    still matches gets a 304 before any query runs or any JSON is encoded,
+    even from a worker that never built the response itself.
+    """
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+        self._entries: "OrderedDict[tuple, CachedResponse]" = OrderedDict()
+        self._adapters: Dict[Any, TypeAdapter] = {}
+        self._lock = threading.Lock()
+    
+    async def respond(
+        self,
+        request: Request,
+        role: str,
+        domains: Sequence[str],
+        build: Callable[[], Awaitable[Any]],
+        model: Optional[Any] = None,
+        extra: Tuple = ()
+    ) -> Response:
+        """Serve ``build()`` as JSON, from cache when still current.
+        
+        With ``model`` the result is validated and encoded through that
+        schema; without it the result is trusted to already match the
+        endpoint's response schema and is encoded directly with orjson.
+        """
+        key = (request.url.path, tuple(sorted(request.query_params.multi_items())), getattr(role, "value", role))
+        # The epoch keeps tags from before the counters were reset from matching
+        versions = (counters.epoch,) + tuple(counters.get(domain) for domain in domains) + tuple(extra)
+        etag = '"' + hashlib.sha1(repr((key, versions)).encode()).hexdigest()[:20] + '"'
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        
+        if etag in if_none_match(request):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.etag == etag:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return Response(entry.body, media_type="application/json", headers=headers)
+        
+        self.misses += 1
+        data = await build()
+        if model is None:
+            body = dumps(data)
+        else:
+            adapter = self._adapter(model)
+            body = adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+        with self._lock:
+            self._entries[key] = CachedResponse(etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return Response(body, media_type="application/json", headers=headers)
+    
+    def _adapter(self, model: Any) -> TypeAdapter:
+        adapter = self._adapters.get(model)
+        if adapter is None:
+            adapter = self._adapters[model] = TypeAdapter(model)
+        return adapter
+    
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+            "misses": self.misses
+        }
+
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_SIZE)
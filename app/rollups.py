@@ -0,0 +1,329 @@
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from operator import itemgetter
+from typing import Dict, List, Sequence
+import calendar
+from sqlalchemy import Float, Table, func, insert
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import GenericFunction
+from app.models import PowerData, EnergyDaily, DeviceEnergyDaily, PowerRollup
+
+# Bucket widths (seconds) of the power_rollup tiers, finest first
+ROLLUP_RESOLUTIONS = (60, 900, 3600, 86400)
+
+ROLLUP_METRICS = ("voltage", "current", "power", "energy")
+
+
+class least(GenericFunction):
+    """Smaller of two values (LEAST, or scalar MIN on SQLite)"""
+    type = Float()
+    inherit_cache = True
+
+
+class greatest(GenericFunction):
+    """Larger of two values (GREATEST, or scalar MAX on SQLite)"""
+    type = Float()
+    inherit_cache = True
+
+
+@compiles(least, "sqlite")
+def compile_least_sqlite(element, compiler, **kw):
+    return "MIN(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(greatest, "sqlite")
+def compile_greatest_sqlite(element, compiler, **kw):
+    return "MAX(%s)" % compiler.process(element.clauses, **kw)
+
+
+def dialect_insert(db: Session, table: Table):
+    """Get an INSERT for the session's dialect that supports upserts"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upserts are not supported on {dialect}")
+    return insert(table)
+
+
+def upsert(db: Session, table: Table, keys: Sequence[str], rows: List[dict], merge: Dict):
+    """Insert rows, merging into existing rows with the same key.
+    
+    ``merge`` maps each non-key column to ``fn(existing, incoming)``, which
+    builds the SQL expression that combines the stored value with the new
+    one (for example ``lambda old, new: old + new``). Rows are sent in key
+    order, so concurrent writers lock overlapping keys in the same order
+    instead of deadlocking each other.
+    """
+    if not rows:
+        return
+    rows = sorted(rows, key=itemgetter(*keys))
+    
+    stmt = dialect_insert(db, table)
+    if db.get_bind().dialect.name == "mysql":
+        incoming = stmt.inserted
+        stmt = stmt.on_duplicate_key_update({
+            column: fn(table.c[column], incoming[column]) for column, fn in merge.items()
+        })
+    else:
+        incoming = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: fn(table.c[column], incoming[column]) for column, fn in merge.items()}
+        )
+    db.execute(stmt, rows)
+
+
+def add(existing, incoming):
+    """Merge rule: accumulate the incoming value"""
+    return existing + incoming
+
+
+def keep_min(existing, incoming):
+    """Merge rule: keep the smaller value"""
+    return least(existing, incoming)
+
+
+def keep_max(existing, incoming):
+    """Merge rule: keep the larger value"""
+    return greatest(existing, incoming)
+
+
+def to_epoch(moment: datetime) -> int:
+    """Wall-clock epoch seconds of a naive local datetime"""
+    return calendar.timegm(moment.timetuple())
+
+
+def from_epoch(seconds: int) -> datetime:
+    """Naive local datetime of wall-clock epoch seconds"""
+    return datetime(1970, 1, 1) + timedelta(seconds=seconds)
+
+
+ROLLUP_MERGE = {"reading_count": add}
+for metric in ROLLUP_METRICS:
+    ROLLUP_MERGE[f"{metric}_sum"] = add
+    ROLLUP_MERGE[f"{metric}_min"] = keep_min
+    ROLLUP_MERGE[f"{metric}_max"] = keep_max
+
+
+def merge_bucket(totals: list, other: list):
+    """Fold one bucket's [count, (sum, min, max) * metrics] into another"""
+    totals[0] += other[0]
+    for i in range(1, len(totals), 3):
+        totals[i] += other[i]
+        totals[i + 1] = min(totals[i + 1], other[i + 1])
+        totals[i + 2] = max(totals[i + 2], other[i + 2])
+
+
+def record_power_rollups(db: Session, readings: List[dict]):
+    """Add a batch of readings to every power_rollup tier.
+    
+    Readings are folded into the finest tier first and the coarser tiers
+    are built from those buckets, so each reading is visited once. Runs
+    inside the caller's transaction.
+    """
+    finest = ROLLUP_RESOLUTIONS[0]
+    buckets: Dict[tuple, list] = {}
+    for reading in readings:
+        epoch = to_epoch(reading["recorded_at"])
+        key = (reading["device_id"], epoch - epoch % finest)
+        values = [1]
+        for metric in ROLLUP_METRICS:
+            value = reading.get(metric) or 0.0
+            values += (value, value, value)
+        totals = buckets.get(key)
+        if totals is None:
+            buckets[key] = values
+        else:
+            merge_bucket(totals, values)
+    
+    rows = []
+    for resolution in ROLLUP_RESOLUTIONS:
+        if resolution != finest:
+            coarser: Dict[tuple, list] = {}
+            for (device_id, bucket), totals in buckets.items():
+                key = (device_id, bucket - bucket % resolution)
+                if key in coarser:
+                    merge_bucket(coarser[key], totals)
+                else:
+                    coarser[key] = list(totals)
+            buckets = coarser
+        
+        for (device_id, bucket), totals in buckets.items():
+            row = {
+                "device_id": device_id,
+                "resolution": resolution,
+                "bucket": bucket,
+                "reading_count": totals[0]
+            }
+            for i, metric in enumerate(ROLLUP_METRICS):
+                row[f"{metric}_sum"], row[f"{metric}_min"], row[f"{metric}_max"] = totals[1 + i * 3:4 + i * 3]
+            rows.append(row)
+    
+    upsert(db, PowerRollup.__table__, ["device_id", "resolution", "bucket"], rows, ROLLUP_MERGE)
+
+
+def pick_resolution(seconds: int, points: int) -> int:
+    """Finest rollup tier that covers ``seconds`` in at most ``points`` buckets"""
+    for resolution in ROLLUP_RESOLUTIONS:
+        if -(-seconds // resolution) <= points:
+            return resolution
+    return ROLLUP_RESOLUTIONS[-1]
+
+
+def record_daily_energy(db: Session, readings: List[dict]):
+    """Add a batch of readings to the daily energy rollups.
+    
+    Runs inside the caller's transaction so the rollups commit (or roll
+    back) together with the raw readings.
+    """
+    per_day = defaultdict(lambda: [0.0, 0])
+    per_device_day = defaultdict(lambda: [0.0, 0])
+    for reading in readings:
+        day = reading["recorded_at"].date()
+        energy = reading.get("energy") or 0.0
+        totals = per_day[day]
+        totals[0] += energy
+        totals[1] += 1
+        totals = per_device_day[(reading["device_id"], day)]
+        totals[0] += energy
+        totals[1] += 1
+    
+    merge = {"energy": add, "reading_count": add}
+    upsert(db, EnergyDaily.__table__, ["day"], [
+        {"day": day, "energy": energy, "reading_count": count}
+        for day, (energy, count) in per_day.items()
+    ], merge)
+    upsert(db, DeviceEnergyDaily.__table__, ["device_id", "day"], [
+        {"device_id": device_id, "day": day, "energy": energy, "reading_count": count}
+        for (device_id, day), (energy, count) in per_device_day.items()
+    ], merge)
+
+
+def energy_for_day(db: Session, day: date) -> float:
+    """Total energy recorded on a day, from the daily rollup"""
+    return db.query(EnergyDaily.energy).filter(EnergyDaily.day == day).scalar() or 0.0
+
+
+def day_range(day: date):
+    """Get the [start, end) datetimes covering a day"""
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+
+def rebuild_daily_energy(db: Session, start_day: date, end_day: date):
+    """Recompute the daily energy rollups for [start_day, end_day] from raw data.
+    
+    Used to backfill history written before the rollups existed. The raw
+    rows are selected with a plain range on ``recorded_at`` so the
+    ``idx_device_time`` / ``recorded_at`` indexes apply. Run it while
+    ingestion is paused, since readings written during the rebuild could
+    be counted twice or not at all.
+    """
+    start, _ = day_range(start_day)
+    _, end = day_range(end_day)
+    
+    rows = db.query(
+        PowerData.device_id,
+        func.date(PowerData.recorded_at).label('day'),
+        func.sum(PowerData.energy).label('energy'),
+        func.count(PowerData.id).label('reading_count')
+    ).filter(
+        PowerData.recorded_at >= start,
+        PowerData.recorded_at < end
+    ).group_by(PowerData.device_id, 'day').all()
+    
+    db.query(EnergyDaily).filter(
+        EnergyDaily.day >= start_day, EnergyDaily.day <= end_day
+    ).delete(synchronize_session=False)
+    db.query(DeviceEnergyDaily).filter(
+        DeviceEnergyDaily.day >= start_day, DeviceEnergyDaily.day <= end_day
+    ).delete(synchronize_session=False)
+    
+    per_day = defaultdict(lambda: [0.0, 0])
+    device_rows = []
+    for row in rows:
+        day = row.day if isinstance(row.day, date) else date.fromisoformat(row.day)
+        device_rows.append({
+            "device_id": row.device_id,
+            "day": day,
+            "energy": row.energy or 0.0,
+            "reading_count": row.reading_count
+        })
+        per_day[day][0] += row.energy or 0.0
+        per_day[day][1] += row.reading_count
+    
+    if device_rows:
+        db.execute(insert(DeviceEnergyDaily), device_rows)
+        db.execute(insert(EnergyDaily), [
+            {"day": day, "energy": energy, "reading_count": count}
+            for day, (energy, count) in per_day.items()
+        ])
+    db.commit()
+
+
+def rebuild_power_rollups(db: Session, start_day: date, end_day: date, chunk_size: int = 10000):
+    """Recompute every power_rollup tier for [start_day, end_day] from raw data.
+    
+    Raw rows are read in id order, one chunk per query, and folded in through
+    ``record_power_rollups``. The same caveat as ``rebuild_daily_energy``
+    applies: pause ingestion first.
+    """
+    start, _ = day_range(start_day)
+    _, end = day_range(end_day)
+    
+    db.query(PowerRollup).filter(
+        PowerRollup.bucket >= to_epoch(start),
+        PowerRollup.bucket < to_epoch(end)
+    ).delete(synchronize_session=False)
+    
+    columns = [PowerData.id, PowerData.device_id, PowerData.recorded_at] + [
+        getattr(PowerData, metric) for metric in ROLLUP_METRICS
+    ]
+    last_id = 0
+    while True:
+        chunk = db.query(*columns).filter(
+            PowerData.recorded_at >= start,
+            PowerData.recorded_at < end,
+            PowerData.id > last_id
+        ).order_by(PowerData.id).limit(chunk_size).all()
+        if not chunk:
+            break
+        record_power_rollups(db, [row._asdict() for row in chunk])
+        last_id = chunk[-1].id
+    db.commit()
+
+
+if __name__ == "__main__":
+    import argparse
+    from app.database import SessionLocal
+    
+    parser = argparse.ArgumentParser(description="Rebuild power data rollups")
+    parser.add_argument("--days", type=int, default=90, help="How many days back to rebuild")
+    args = parser.parse_args()
+    
+    from app.archive import archived_days
+    from app.config import settings
+    
+    if settings.POWER_STORAGE == "columnar":
+        parser.error("raw readings are in the columnar store, there is no power_data to rebuild from")
+    
+    today = date.today()
+    start_day = today - timedelta(days=args.days)
+    
+    # Archived days have no raw rows left to rebuild from
+    archived = archived_days(start_day, today)
+    if archived:
+        start_day = archived[-1] + timedelta(days=1)
+    
+    db = SessionLocal()
+    try:
+        rebuild_daily_energy(db, start_day, today)
+        rebuild_power_rollups(db, start_day, today)
+    finally:
+        db.close()
@@ -1,32 +1,30 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from sqlalchemy.orm import Session
 from typing import List
-from app.database import get_db
+from app.database import get_session, run_db
 from app.models import Alert, Device
 from app.schemas import Alert as AlertSchema
 from app.auth import get_current_user
+from app.events import emit_stats
+from app.routers.devices import dashboard_stats
+from app.response_cache import response_cache, touch
 
 router = APIRouter(prefix="/api/alerts", tags=["Alerts"])
 
 
-@router.get("/", response_model=List[AlertSchema])
-def get_alerts(
-    limit: int = 50,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
-):
-    """Get all alerts"""
+def list_alerts(db: Session, limit: int) -> List[dict]:
+    """Get the newest alerts with their device names"""
     alerts = db.query(Alert, Device).join(Device).order_by(
         Alert.created_at.desc()
     ).limit(limit).all()
     
     return [
         {
-            "id": alert.id,
-            "device_id": alert.device_id,
             "alert_type": alert.alert_type,
             "message": alert.message,
             "severity": alert.severity,
+            "id": alert.id,
+            "device_id": alert.device_id,
             "is_read": alert.is_read,
             "created_at": alert.created_at,
             "device_name": device.device_name
@@ -35,16 +33,13 @@ def get_alerts(
     ]
 
 
-@router.post("/{alert_id}/mark-read")
-def mark_alert_read(
-    alert_id: int,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
-):
-    """Mark an alert as read"""
+def mark_read(db: Session, alert_id: int) -> dict:
+    """Mark one alert, or all of them for id 0, as read"""
     if alert_id == 0:
         # Mark all as read
         db.query(Alert).update({"is_read": True})
+        touch(db, "alerts")
+        emit_stats(db, {"unread_alerts": 0})
         db.commit()
         return {"success": True, "message": "All alerts marked as read"}
     else:
@@ -52,6 +47,33 @@ def mark_alert_read(
         alert = db.query(Alert).filter(Alert.id == alert_id).first()
         if alert:
             alert.is_read = True
+            db.flush()
+            touch(db, "alerts")
+            emit_stats(db, dashboard_stats(db, "unread_alerts"))
             db.commit()
             return {"success": True, "message": "Alert marked as read"}
         return {"success": False, "message": "Alert not found"}
+
+
+@router.get("/", response_model=List[AlertSchema])
+async def get_alerts(
+    request: Request,
+    limit: int = 50,
+    db: Session = Depends(get_session),
+    current_user = Depends(get_current_user)
+):
+    """Get all alerts"""
+    return await response_cache.respond(
+        request, current_user.role, ("alerts", "devices"),
+        lambda: run_db(db, list_alerts, limit)
+    )
+
+
+@router.post("/{alert_id}/mark-read")
+async def mark_alert_read(
+    alert_id: int,
+    db: Session = Depends(get_session),
+    current_user = Depends(get_current_user)
+):
+    """Mark an alert as read"""
+    return await run_db(db, mark_read, alert_id)
@@ -1,29 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta
-from app.database import get_db
+from app.database import get_session, run_db
 from app.models import User
 from app.schemas import UserCreate, User as UserSchema, Token
-from app.auth import verify_password, get_password_hash, create_access_token
+from app.auth import create_access_token, password_hasher, failed_logins
 from app.config import settings
 
 router = APIRouter(prefix="/api/auth", tags=["Authentication"])
 
 
-@router.post("/register", response_model=UserSchema)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    """Register a new user"""
-    # Check if username exists
-    db_user = db.query(User).filter(User.username == user.username).first()
-    if db_user:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already registered"
-        )
-    
-    # Create new user
-    hashed_password = get_password_hash(user.password)
+def get_user_by_username(db: Session, username: str):
+    """Look up a user by username"""
+    return db.query(User).filter(User.username == username).first()
+
+
+def create_user(db: Session, user: UserCreate, hashed_password: str) -> User:
+    """Insert a new user with an already hashed password"""
     db_user = User(
         username=user.username,
         password=hashed_password,
@@ -38,25 +32,58 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
     return db_user
 
 
+@router.post("/register", response_model=UserSchema)
+async def register(user: UserCreate, db: Session = Depends(get_session)):
+    """Register a new user"""
+    # Check if username exists
+    db_user = await run_db(db, get_user_by_username, user.username)
+    if db_user:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already registered"
+        )
+    
+    # Create new user (bcrypt runs in the dedicated hashing pool)
+    hashed_password = await password_hasher.hash(user.password)
+    return await run_db(db, create_user, user, hashed_password)
+
+
 @router.post("/login", response_model=Token)
-def login(
+async def login(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session)
 ):
     """Login and get access token"""
+    # Throttle repeated failures from this client before spending any bcrypt time
+    client = request.client.host if request.client else ""
+    retry_after = failed_logins.retry_after(form_data.username, client)
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed login attempts, try again later",
+            headers={"Retry-After": str(retry_after)},
+        )
+    
     # Authenticate user
-    user = db.query(User).filter(User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.password):
+    user = await run_db(db, get_user_by_username, form_data.username)
+    if not user or not await password_hasher.verify(form_data.password, user.password):
+        failed_logins.record_failure(form_data.username, client)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    failed_logins.reset(form_data.username, client)
     
     # Create access token
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username},
+        data={
+            "sub": user.username,
+            "uid": user.id,
+            "role": user.role.value if user.role else None
+        },
         expires_delta=access_token_expires
     )
     
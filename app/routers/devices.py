@@ -1,105 +1,88 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy import func, case, select
 from typing import List
-from datetime import datetime, timedelta
+from datetime import date
 import random
-from app.database import get_db
-from app.models import Device, PowerData, Alert, ControlHistory, DeviceStatus, ControlAction
+from app.database import get_session, run_db, run_db_blocking
+from app.models import Device, Alert, ControlHistory, DeviceStatus, ControlAction, EnergyDaily
 from app.schemas import (
     Device as DeviceSchema,
     DeviceCreate,
     DeviceUpdate,
-    DashboardStats,
-    PowerData as PowerDataSchema,
-    PowerDataCreate,
-    ChartData
+    DashboardStats
 )
 from app.auth import get_current_user
+from app.readings import write_readings, latest_cache
+from app.events import emit_device_update, emit_stats
+from app.response_cache import response_cache, touch
 
 router = APIRouter(prefix="/api/devices", tags=["Devices"])
 
 
-@router.get("/stats", response_model=DashboardStats)
-def get_dashboard_stats(
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
-):
-    """Get dashboard statistics"""
-    # Total devices
-    total_devices = db.query(func.count(Device.id)).filter(Device.is_active == True).scalar()
-    
-    # Devices ON
-    devices_on = db.query(func.count(Device.id)).filter(
-        and_(Device.status == DeviceStatus.ON, Device.is_active == True)
-    ).scalar()
-    
-    # Current total power
-    current_power = db.query(func.sum(Device.power_rating)).filter(
-        and_(Device.status == DeviceStatus.ON, Device.is_active == True)
-    ).scalar() or 0.0
+def device_with_power(device: Device, latest_power) -> dict:
+    """Build a device response with its latest power reading, in schema field order"""
+    return {
+        "device_name": device.device_name,
+        "device_type": device.device_type,
+        "location": device.location,
+        "power_rating": device.power_rating,
+        "id": device.id,
+        "status": device.status,
+        "is_active": device.is_active,
+        "created_at": device.created_at,
+        "updated_at": device.updated_at,
+        "current_power": latest_power["power"] if latest_power else 0.0,
+        "current_voltage": latest_power["voltage"] if latest_power else 0.0,
+        "current_current": latest_power["current"] if latest_power else 0.0
+    }
+
+
+def dashboard_stats(db: Session, *fields: str) -> dict:
+    """Dashboard counters, optionally only the named ones"""
+    is_on = Device.status == DeviceStatus.ON
     
-    # Today's energy
-    today = datetime.now().date()
-    today_energy = db.query(func.sum(PowerData.energy)).filter(
-        func.date(PowerData.recorded_at) == today
-    ).scalar() or 0.0
+    # Unread alerts and today's energy (from the daily rollup) as scalar subqueries
+    unread_alerts = select(func.count(Alert.id)).where(
+        Alert.is_read == False
+    ).scalar_subquery()
+    today_energy = select(EnergyDaily.energy).where(
+        EnergyDaily.day == date.today()
+    ).scalar_subquery()
     
-    # Unread alerts
-    unread_alerts = db.query(func.count(Alert.id)).filter(Alert.is_read == False).scalar()
+    # All counters in a single round trip
+    stats = db.query(
+        func.count(Device.id).label('total_devices'),
+        func.coalesce(func.sum(case((is_on, 1), else_=0)), 0).label('devices_on'),
+        func.coalesce(func.sum(case((is_on, Device.power_rating), else_=0.0)), 0.0).label('current_power'),
+        func.coalesce(today_energy, 0.0).label('today_energy'),
+        unread_alerts.label('unread_alerts')
+    ).filter(Device.is_active == True).one()
     
-    return {
-        "total_devices": total_devices,
-        "devices_on": devices_on,
-        "current_power": current_power,
-        "today_energy": today_energy,
-        "unread_alerts": unread_alerts
-    }
+    stats = dict(stats._mapping)
+    if fields:
+        return {field: stats[field] for field in fields}
+    return stats
 
 
-@router.get("/", response_model=List[DeviceSchema])
-def get_devices(
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
-):
+def list_devices(db: Session) -> List[dict]:
     """Get all devices with latest power data"""
     devices = db.query(Device).filter(Device.is_active == True).all()
     
-    result = []
-    for device in devices:
-        # Get latest power data
-        latest_power = db.query(PowerData).filter(
-            PowerData.device_id == device.id
-        ).order_by(PowerData.recorded_at.desc()).first()
-        
-        device_dict = {
-            "id": device.id,
-            "device_name": device.device_name,
-            "device_type": device.device_type,
-            "location": device.location,
-            "status": device.status,
-            "power_rating": device.power_rating,
-            "is_active": device.is_active,
-            "created_at": device.created_at,
-            "updated_at": device.updated_at,
-            "current_power": latest_power.power if latest_power else 0.0,
-            "current_voltage": latest_power.voltage if latest_power else 0.0,
-            "current_current": latest_power.current if latest_power else 0.0
-        }
-        result.append(device_dict)
+    # Latest power data for every device, served from the cache
+    latest = latest_cache.get_all(db)
     
-    return result
+    return [device_with_power(device, latest.get(device.id)) for device in devices]
 
 
-@router.post("/", response_model=DeviceSchema)
-def create_device(
-    device: DeviceCreate,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
-):
-    """Create a new device"""
+def add_device(db: Session, device: DeviceCreate) -> Device:
+    """Insert a new device"""
     db_device = Device(**device.dict())
     db.add(db_device)
+    db.flush()
+    touch(db, "devices")
+    emit_device_update(db, db_device, {})
+    emit_stats(db, dashboard_stats(db, "total_devices", "devices_on", "current_power"))
     db.commit()
     db.refresh(db_device)
     
@@ -111,71 +94,50 @@ def create_device(
     return db_device
 
 
-@router.get("/{device_id}", response_model=DeviceSchema)
-def get_device(
-    device_id: int,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
-):
-    """Get a specific device"""
+def find_device(db: Session, device_id: int) -> Device:
+    """Get a device or raise 404"""
     device = db.query(Device).filter(Device.id == device_id).first()
     if not device:
         raise HTTPException(status_code=404, detail="Device not found")
+    return device
+
+
+def load_device(db: Session, device_id: int) -> dict:
+    """Get a specific device with its latest power data"""
+    device = find_device(db, device_id)
     
     # Get latest power data
-    latest_power = db.query(PowerData).filter(
-        PowerData.device_id == device.id
-    ).order_by(PowerData.recorded_at.desc()).first()
+    latest = latest_cache.get_all(db)
     
-    device.current_power = latest_power.power if latest_power else 0.0
-    device.current_voltage = latest_power.voltage if latest_power else 0.0
-    device.current_current = latest_power.current if latest_power else 0.0
-    
-    return device
+    return device_with_power(device, latest.get(device.id))
 
 
-@router.put("/{device_id}", response_model=DeviceSchema)
-def update_device(
-    device_id: int,
-    device_update: DeviceUpdate,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
-):
-    """Update a device"""
-    device = db.query(Device).filter(Device.id == device_id).first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+def change_device(db: Session, device_id: int, device_update: DeviceUpdate) -> dict:
+    """Update the given fields of a device"""
+    device = find_device(db, device_id)
     
     # Update fields
     update_data = device_update.dict(exclude_unset=True)
     for field, value in update_data.items():
         setattr(device, field, value)
     
+    db.flush()
+    touch(db, "devices")
+    emit_device_update(db, device, update_data)
+    if update_data.keys() & {"status", "power_rating", "is_active"}:
+        emit_stats(db, dashboard_stats(db, "total_devices", "devices_on", "current_power"))
     db.commit()
     db.refresh(device)
     
     # Get latest power data
-    latest_power = db.query(PowerData).filter(
-        PowerData.device_id == device.id
-    ).order_by(PowerData.recorded_at.desc()).first()
-    
-    device.current_power = latest_power.power if latest_power else 0.0
-    device.current_voltage = latest_power.voltage if latest_power else 0.0
-    device.current_current = latest_power.current if latest_power else 0.0
+    latest = latest_cache.get_all(db)
     
-    return device
+    return device_with_power(device, latest.get(device.id))
 
 
-@router.post("/{device_id}/toggle")
-def toggle_device(
-    device_id: int,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
-):
-    """Toggle device ON/OFF"""
-    device = db.query(Device).filter(Device.id == device_id).first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+def switch_device(db: Session, device_id: int, user_id: int) -> dict:
+    """Toggle device ON/OFF and log it"""
+    device = find_device(db, device_id)
     
     # Get current status
     previous_status = device.status
@@ -183,17 +145,22 @@ def toggle_device(
     
     # Update device status
     device.status = new_status
-    db.commit()
     
     # Log control history
     history = ControlHistory(
         device_id=device_id,
-        user_id=current_user.id,
+        user_id=user_id,
         action=ControlAction.TURN_ON if new_status == DeviceStatus.ON else ControlAction.TURN_OFF,
         previous_status=previous_status.value,
         new_status=new_status.value
     )
     db.add(history)
+    db.flush()
+    touch(db, "devices")
+    
+    # Published once the status change and its history row commit together
+    emit_device_update(db, device, {"status": new_status})
+    emit_stats(db, dashboard_stats(db, "devices_on", "current_power"))
     db.commit()
     
     message = f"Đã {'bật' if new_status == DeviceStatus.ON else 'tắt'} thiết bị"
@@ -205,33 +172,23 @@ def toggle_device(
     }
 
 
-@router.delete("/{device_id}")
-def delete_device(
-    device_id: int,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
-):
+def deactivate_device(db: Session, device_id: int) -> dict:
     """Delete (deactivate) a device"""
-    device = db.query(Device).filter(Device.id == device_id).first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+    device = find_device(db, device_id)
     
     device.is_active = False
+    db.flush()
+    touch(db, "devices")
+    emit_device_update(db, device, {"is_active": False})
+    emit_stats(db, dashboard_stats(db, "total_devices", "devices_on", "current_power"))
     db.commit()
     
     return {"success": True, "message": "Device deactivated"}
 
 
-@router.post("/{device_id}/simulate")
-def simulate_data(
-    device_id: int,
-    db: Session = Depends(get_db),
-    current_user = Depends(get_current_user)
-):
+def add_simulated_reading(db: Session, device_id: int) -> dict:
     """Add simulated power data for testing"""
-    device = db.query(Device).filter(Device.id == device_id).first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+    device = find_device(db, device_id)
     
     if device.status != DeviceStatus.ON:
         raise HTTPException(
@@ -247,37 +204,18 @@ def simulate_data(
     power_factor = 0.95
     frequency = 50.0
     
-    # Save power data
-    power_data = PowerData(
-        device_id=device_id,
-        voltage=voltage,
-        current=current,
-        power=power,
-        energy=energy,
-        power_factor=power_factor,
-        frequency=frequency
-    )
-    db.add(power_data)
-    
-    # Check for alerts
-    if voltage > 250:
-        alert = Alert(
-            device_id=device_id,
-            alert_type="overvoltage",
-            message=f"Điện áp vượt quá mức cho phép: {voltage:.2f}V",
-            severity="high"
-        )
-        db.add(alert)
-    elif voltage < 200:
-        alert = Alert(
-            device_id=device_id,
-            alert_type="undervoltage",
-            message=f"Điện áp thấp hơn mức cho phép: {voltage:.2f}V",
-            severity="medium"
-        )
-        db.add(alert)
+    reading = {
+        "device_id": device_id,
+        "voltage": voltage,
+        "current": current,
+        "power": power,
+        "energy": energy,
+        "power_factor": power_factor,
+        "frequency": frequency
+    }
     
-    db.commit()
+    # Save power data; alert rules run on it in the same transaction
+    write_readings(db, [reading])
     
     return {
         "success": True,
@@ -289,3 +227,92 @@ def simulate_data(
             "energy": round(energy, 3)
         }
     }
+
+
+@router.get("/stats", response_model=DashboardStats)
+async def get_dashboard_stats(
+    request: Request,
+    db: Session = Depends(get_session),
+    current_user = Depends(get_current_user)
+):
+    """Get dashboard statistics"""
+    return await response_cache.respond(
+        request, current_user.role, ("devices", "alerts", "latest_readings"),
+        lambda: run_db(db, dashboard_stats), DashboardStats,
+        # today_energy changes with the date even without writes
+        extra=(date.today().toordinal(),)
+    )
+
+
+@router.get("/", response_model=List[DeviceSchema])
+async def get_devices(
+    request: Request,
+    db: Session = Depends(get_session),
+    current_user = Depends(get_current_user)
+):
+    """Get all devices with latest power data"""
+    return await response_cache.respond(
+        request, current_user.role, ("devices", "latest_readings"),
+        lambda: run_db(db, list_devices)
+    )
+
+
+@router.post("/", response_model=DeviceSchema)
+async def create_device(
+    device: DeviceCreate,
+    db: Session = Depends(get_session),
+    current_user = Depends(get_current_user)
+):
+    """Create a new device"""
+    return await run_db(db, add_device, device)
+
+
+@router.get("/{device_id}", response_model=DeviceSchema)
+async def get_device(
+    device_id: int,
+    db: Session = Depends(get_session),
+    current_user = Depends(get_current_user)
+):
+    """Get a specific device"""
+    return await run_db(db, load_device, device_id)
+
+
+@router.put("/{device_id}", response_model=DeviceSchema)
+async def update_device(
+    device_id: int,
+    device_update: DeviceUpdate,
+    db: Session = Depends(get_session),
+    current_user = Depends(get_current_user)
+):
+    """Update a device"""
+    return await run_db(db, change_device, device_id, device_update)
+
+
+@router.post("/{device_id}/toggle")
+async def toggle_device(
+    device_id: int,
+    db: Session = Depends(get_session),
+    current_user = Depends(get_current_user)
+):
+    """Toggle device ON/OFF"""
+    return await run_db(db, switch_device, device_id, current_user.id)
+
+
+@router.delete("/{device_id}")
+async def delete_device(
+    device_id: int,
+    db: Session = Depends(get_session),
+    current_user = Depends(get_current_user)
+):
+    """Delete (deactivate) a device"""
+    return await run_db(db, deactivate_device, device_id)
+
+
+@router.post("/{device_id}/simulate")
+async def simulate_data(
+    device_id: int,
+    db: Session = Depends(get_session),
+    current_user = Depends(get_current_user)
+):
+    """Add simulated power data for testing"""
+    return await run_db_blocking(db, add_simulated_reading, device_id)
@@ -1,95 +1,474 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import TypeAdapter, ValidationError
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-from typing import List
-from datetime import datetime, timedelta
-from app.database import get_db
-from app.models import PowerData, Device
-from app.schemas import ChartData
+from sqlalchemy import func
+from typing import List, Union
+from datetime import date, datetime, timedelta
+import json
+import time
+import numpy as np
+from app.config import settings
+from app.database import get_session, run_db, run_db_blocking
+from app.models import PowerData, PowerRollup, Device
+from app.schemas import ChartData, PowerDataCreate, IngestResult
 from app.auth import get_current_user
+from app.readings import latest_cache, local_time, write_readings
+from app.response_cache import response_cache
+from app.rollups import ROLLUP_RESOLUTIONS, pick_resolution, to_epoch, from_epoch
+from app.timebucket import bucket_floor, parse_interval, time_bucket
+from app.downsample import downsample as downsample_series
+from app.export import EXPORT_FORMATS, iter_reading_chunks, parquet_available
+from app.archive import archived_buckets
+from app.tsdb import reading_store
+from app.ingest_buffer import ingest_buffer
 
 router = APIRouter(prefix="/api/power", tags=["Power Data"])
 
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
 
-@router.get("/history", response_model=List[ChartData])
-def get_power_history(
-    hours: int = 24,
-    device_id: int = None,
-    db: Session = Depends(get_db),
+reading_list_adapter = TypeAdapter(List[PowerDataCreate])
+
+
+def parse_ingest_body(body: bytes, content_type: str) -> list:
+    """Decode a JSON array or NDJSON payload into a list of raw items"""
+    if content_type.split(";")[0].strip() in NDJSON_CONTENT_TYPES:
+        items = []
+        for line in body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                # Keep the slot so reject indexes match input lines
+                items.append(None)
+        return items
+    
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    
+    return payload if isinstance(payload, list) else [payload]
+
+
+def validate_readings(items: list):
+    """Validate raw items, returning ([(index, reading)], errors)"""
+    try:
+        return list(enumerate(reading_list_adapter.validate_python(items))), []
+    except ValidationError as e:
+        bad = {}
+        for error in e.errors():
+            index = error["loc"][0]
+            if index not in bad:
+                field = ".".join(str(part) for part in error["loc"][1:]) or "body"
+                bad[index] = f"{field}: {error['msg']}"
+    
+    # Only the remaining items are valid, so this pass cannot fail
+    good_indexes = [i for i in range(len(items)) if i not in bad]
+    readings = reading_list_adapter.validate_python([items[i] for i in good_indexes])
+    
+    errors = [{"index": i, "detail": detail} for i, detail in sorted(bad.items())]
+    return list(zip(good_indexes, readings)), errors
+
+
+def check_readings(db: Session, items: list):
+    """Validate items, returning (rows for known devices, errors)"""
+    validated, errors = validate_readings(items)
+    
+    # Reject readings for unknown devices with one lookup
+    device_ids = {reading.device_id for _, reading in validated}
+    known_ids = set()
+    if device_ids:
+        known_ids = {
+            row.id for row in db.query(Device.id).filter(Device.id.in_(device_ids))
+        }
+    
+    rows = []
+    for index, reading in validated:
+        if reading.device_id not in known_ids:
+            errors.append({"index": index, "detail": f"Unknown device {reading.device_id}"})
+            continue
+        rows.append(reading.model_dump())
+    
+    return rows, errors
+
+
+def ingest_result(accepted: int, errors: list) -> dict:
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "accepted": accepted,
+        "rejected": len(errors),
+        "errors": errors
+    }
+
+
+def store_readings(db: Session, items: list) -> dict:
+    """Validate items and bulk insert the accepted readings"""
+    rows, errors = check_readings(db, items)
+    return ingest_result(write_readings(db, rows), errors)
+
+
+@router.post("/ingest", response_model=IngestResult)
+async def ingest_readings(
+    request: Request,
+    db: Session = Depends(get_session),
     current_user = Depends(get_current_user)
 ):
-    """Get power data history"""
-    # Calculate time range
-    end_time = datetime.now()
-    start_time = end_time - timedelta(hours=hours)
+    """Bulk ingest power readings (JSON array or NDJSON).
+    
+    With `INGEST_BUFFER` on, accepted readings are acknowledged once
+    spooled and reach the database within `INGEST_FLUSH_SECONDS`; a full
+    buffer answers 429.
+    """
+    body = await request.body()
+    items = parse_ingest_body(body, request.headers.get("content-type", ""))
+    
+    if len(items) > settings.INGEST_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.INGEST_MAX_ROWS} readings per request"
+        )
+    
+    # Validation and the bulk insert are blocking work
+    if ingest_buffer is None:
+        return await run_db_blocking(db, store_readings, items)
+    
+    rows, errors = await run_db(db, check_readings, items)
+    # The spool fsync stays off the event loop
+    return ingest_result(await run_in_threadpool(ingest_buffer.submit, rows), errors)
+
+
+MAX_HISTORY_POINTS = 5000
+
+# Labels selected by the series queries, in order
+SERIES_COLUMNS = (
+    'bucket', 'reading_count',
+    'voltage_sum', 'voltage_min', 'voltage_max',
+    'current_sum',
+    'power_sum', 'power_min', 'power_max',
+    'energy_sum'
+)
+
+
+def rollup_series_query(db: Session, resolution: int, seconds: int, start_time: datetime, device_id: int = None):
+    """Buckets of `seconds` width re-aggregated from one rollup tier"""
+    bucket = PowerRollup.bucket
+    if seconds != resolution:
+        bucket = bucket_floor(PowerRollup.bucket, seconds)
+    bucket = bucket.label('bucket')
+    
+    query = db.query(
+        bucket,
+        func.sum(PowerRollup.reading_count).label('reading_count'),
+        func.sum(PowerRollup.voltage_sum).label('voltage_sum'),
+        func.min(PowerRollup.voltage_min).label('voltage_min'),
+        func.max(PowerRollup.voltage_max).label('voltage_max'),
+        func.sum(PowerRollup.current_sum).label('current_sum'),
+        func.sum(PowerRollup.power_sum).label('power_sum'),
+        func.min(PowerRollup.power_min).label('power_min'),
+        func.max(PowerRollup.power_max).label('power_max'),
+        func.sum(PowerRollup.energy_sum).label('energy_sum')
+    ).filter(
+        PowerRollup.resolution == resolution,
+        PowerRollup.bucket >= to_epoch(start_time) // seconds * seconds
+    )
+    
+    if device_id:
+        query = query.filter(PowerRollup.device_id == device_id)
+    
+    return query.group_by(bucket).order_by(bucket)
+
+
+def raw_series_query(db: Session, seconds: int, start_time: datetime, device_id: int = None):
+    """Buckets of `seconds` width aggregated from raw power_data"""
+    bucket = time_bucket(PowerData.recorded_at, seconds).label('bucket')
     
-    # Build query
     query = db.query(
-        func.date_format(PowerData.recorded_at, '%Y-%m-%d %H:%i').label('time'),
-        func.avg(PowerData.voltage).label('avg_voltage'),
-        func.avg(PowerData.current).label('avg_current'),
-        func.avg(PowerData.power).label('avg_power'),
-        func.sum(PowerData.energy).label('total_energy')
+        bucket,
+        func.count(PowerData.id).label('reading_count'),
+        func.sum(PowerData.voltage).label('voltage_sum'),
+        func.min(PowerData.voltage).label('voltage_min'),
+        func.max(PowerData.voltage).label('voltage_max'),
+        func.sum(PowerData.current).label('current_sum'),
+        func.sum(PowerData.power).label('power_sum'),
+        func.min(PowerData.power).label('power_min'),
+        func.max(PowerData.power).label('power_max'),
+        func.sum(PowerData.energy).label('energy_sum')
     ).filter(
-        PowerData.recorded_at >= start_time
+        PowerData.recorded_at >= from_epoch(to_epoch(start_time) // seconds * seconds)
     )
     
-    # Filter by device if specified
     if device_id:
         query = query.filter(PowerData.device_id == device_id)
     
-    # Group and order
-    query = query.group_by('time').order_by('time').limit(100)
+    return query.group_by(bucket).order_by(bucket)
+
+
+def history_series(
+    db: Session,
+    hours: int,
+    device_id: int = None,
+    points: int = 100,
+    interval: str = None,
+    max_buckets: int = MAX_HISTORY_POINTS
+) -> np.ndarray:
+    """Pick the cheapest source for a history request and load its series"""
+    start_time = datetime.now() - timedelta(hours=hours)
+    span = hours * 3600
     
-    results = query.all()
+    if interval is None:
+        resolution = pick_resolution(span, points)
+        return load_series(db, rollup_series_query(db, resolution, resolution, start_time, device_id))
     
-    return [
-        {
-            "time": result.time,
-            "avg_voltage": round(result.avg_voltage or 0, 2),
-            "avg_current": round(result.avg_current or 0, 3),
-            "avg_power": round(result.avg_power or 0, 2),
-            "total_energy": round(result.total_energy or 0, 3)
-        }
-        for result in results
-    ]
+    try:
+        seconds = parse_interval(interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if -(-span // seconds) > max_buckets:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Interval {interval} gives more than {max_buckets} points for {hours}h"
+        )
+    
+    # Re-aggregate the coarsest rollup tier that divides the interval
+    for resolution in reversed(ROLLUP_RESOLUTIONS):
+        if seconds % resolution == 0:
+            return load_series(db, rollup_series_query(db, resolution, seconds, start_time, device_id))
+    
+    return raw_series(db, seconds, start_time, device_id)
 
 
-@router.get("/latest")
-def get_latest_readings(
-    db: Session = Depends(get_db),
+def load_series(db: Session, query, chunk_size: int = 10000) -> np.ndarray:
+    """Stream a series query into a float64 array, one column per label.
+    
+    Rows are fetched in chunks and converted chunk by chunk, so no list of
+    per-row dicts is ever built. NULL aggregates become NaN.
+    """
+    result = db.execute(query.statement.execution_options(yield_per=chunk_size))
+    chunks = []
+    for part in result.partitions():
+        chunk = np.array(part, dtype=object)
+        chunks.append(np.where(chunk == None, np.nan, chunk).astype(np.float64))
+    
+    if not chunks:
+        return np.empty((0, len(SERIES_COLUMNS)))
+    
+    data = np.concatenate(chunks)
+    # Drop empty buckets
+    return data[data[:, SERIES_COLUMNS.index('reading_count')] > 0]
+
+
+def merge_series(data: np.ndarray) -> np.ndarray:
+    """Combine rows that share a bucket (sums add, minimums and maximums fold)"""
+    data = data[np.argsort(data[:, 0], kind="stable")]
+    starts = np.flatnonzero(np.r_[True, data[1:, 0] != data[:-1, 0]])
+    if len(starts) == len(data):
+        return data
+    
+    merged = np.empty((len(starts), len(SERIES_COLUMNS)))
+    for i, name in enumerate(SERIES_COLUMNS):
+        if name == 'bucket':
+            merged[:, i] = data[starts, i]
+        elif name.endswith('_min'):
+            merged[:, i] = np.fmin.reduceat(data[:, i], starts)
+        elif name.endswith('_max'):
+            merged[:, i] = np.fmax.reduceat(data[:, i], starts)
+        else:
+            merged[:, i] = np.add.reduceat(data[:, i], starts)
+    return merged
+
+
+def raw_series(db: Session, seconds: int, start_time: datetime, device_id: int = None) -> np.ndarray:
+    """Raw-reading buckets from power_data (or the columnar store) plus any archived days in range"""
+    bucket_start = from_epoch(to_epoch(start_time) // seconds * seconds)
+    if reading_store is not None:
+        data = series_array(reading_store.buckets(seconds, bucket_start, device_id))
+    else:
+        data = load_series(db, raw_series_query(db, seconds, start_time, device_id))
+    
+    archived = archived_buckets(seconds, bucket_start, device_id)
+    if archived is None:
+        return data
+    
+    # A bucket can span archived days and the hot table
+    return merge_series(np.concatenate([series_array(archived), data]))
+
+
+def series_array(columns) -> np.ndarray:
+    """Stack NumPy-aggregated series columns like load_series rows"""
+    if columns is None:
+        return np.empty((0, len(SERIES_COLUMNS)))
+    return np.column_stack([columns[name] for name in SERIES_COLUMNS])
+
+
+def chart_points(data: np.ndarray) -> List[dict]:
+    """Format series rows as ChartData dicts with vectorized math"""
+    column = {name: data[:, i] for i, name in enumerate(SERIES_COLUMNS)}
+    count = column['reading_count']
+    buckets = column['bucket'].astype(np.int64).tolist()
+    
+    series = zip(
+        buckets,
+        count.astype(np.int64).tolist(),
+        np.round(column['voltage_sum'] / count, 2).tolist(),
+        np.round(column['current_sum'] / count, 3).tolist(),
+        np.round(column['power_sum'] / count, 2).tolist(),
+        np.round(column['energy_sum'], 3).tolist(),
+        column['voltage_min'].tolist(),
+        column['voltage_max'].tolist(),
+        column['power_min'].tolist(),
+        column['power_max'].tolist()
+    )
+    
+    points = []
+    for bucket, readings, avg_voltage, avg_current, avg_power, total_energy, min_v, max_v, min_p, max_p in series:
+        moment = from_epoch(bucket)
+        points.append({
+            "time": moment.strftime('%Y-%m-%d %H:%M'),
+            "timestamp": int(moment.timestamp()),
+            "reading_count": readings,
+            "avg_voltage": avg_voltage,
+            "avg_current": avg_current,
+            "avg_power": avg_power,
+            "total_energy": total_energy,
+            "min_voltage": min_v,
+            "max_voltage": max_v,
+            "min_power": min_p,
+            "max_power": max_p
+        })
+    return points
+
+
+def load_history(
+    db: Session,
+    hours: int,
+    device_id: int = None,
+    points: int = 100,
+    interval: str = None,
+    max_points: int = None,
+    downsample: str = "lttb"
+) -> List[dict]:
+    """Load a history series as ChartData dicts"""
+    if max_points is None:
+        return chart_points(history_series(db, hours, device_id, points, interval))
+    
+    data = history_series(
+        db, hours, device_id,
+        points=settings.DOWNSAMPLE_SOURCE_POINTS,
+        interval=interval,
+        max_buckets=settings.DOWNSAMPLE_SOURCE_POINTS
+    )
+    
+    bucket = data[:, SERIES_COLUMNS.index('bucket')]
+    avg_power = data[:, SERIES_COLUMNS.index('power_sum')] / data[:, SERIES_COLUMNS.index('reading_count')]
+    picked = downsample_series(bucket, avg_power, max_points, downsample)
+    
+    return chart_points(data[picked])
+
+
+@router.get("/history", response_model=List[ChartData])
+async def get_power_history(
+    request: Request,
+    hours: int = 24,
+    device_id: int = None,
+    points: int = Query(100, ge=1, le=MAX_HISTORY_POINTS),
+    interval: str = Query(None, description="Bucket width, e.g. 30s, 5m, 1h"),
+    max_points: int = Query(None, ge=3, le=MAX_HISTORY_POINTS, description="Downsample to at most this many points"),
+    downsample: str = Query("lttb", pattern="^(lttb|minmax)$"),
+    db: Session = Depends(get_session),
     current_user = Depends(get_current_user)
 ):
-    """Get latest power readings for all devices"""
-    # Subquery to get max recorded_at for each device
-    subquery = db.query(
-        PowerData.device_id,
-        func.max(PowerData.recorded_at).label('max_time')
-    ).group_by(PowerData.device_id).subquery()
-    
-    # Join to get full power data
-    results = db.query(PowerData, Device).join(
-        subquery,
-        and_(
-            PowerData.device_id == subquery.c.device_id,
-            PowerData.recorded_at == subquery.c.max_time
-        )
-    ).join(Device).all()
+    """Get power data history.
+    
+    Without `interval`, serves the finest rollup tier that fits the range
+    in `points` buckets. With `interval`, buckets are that wide. With
+    `max_points`, a finer series is loaded and reduced with LTTB or
+    min/max decimation on average power.
+    """
+    return await response_cache.respond(
+        request, current_user.role, ("latest_readings",),
+        lambda: run_db_blocking(db, load_history, hours, device_id, points, interval, max_points, downsample),
+        # The window slides with the clock; reuse it for a short while only
+        extra=(int(time.time() // settings.RESPONSE_CACHE_HISTORY_SECONDS),)
+    )
+
+
+def latest_readings(db: Session) -> List[dict]:
+    """Latest reading of every device with its device details"""
+    latest = latest_cache.get_all(db)
+    if not latest:
+        return []
+    
+    # Attach device details to the cached readings
+    devices = db.query(Device).filter(Device.id.in_(list(latest))).all()
+    results = [(latest[device.id], device) for device in devices]
     
     return [
         {
-            "id": pd.id,
-            "device_id": pd.device_id,
+            "id": pd["id"],
+            "device_id": pd["device_id"],
             "device_name": device.device_name,
             "device_type": device.device_type.value,
             "location": device.location,
-            "voltage": pd.voltage,
-            "current": pd.current,
-            "power": pd.power,
-            "energy": pd.energy,
-            "power_factor": pd.power_factor,
-            "frequency": pd.frequency,
-            "recorded_at": pd.recorded_at.isoformat()
+            "voltage": pd["voltage"],
+            "current": pd["current"],
+            "power": pd["power"],
+            "energy": pd["energy"],
+            "power_factor": pd["power_factor"],
+            "frequency": pd["frequency"],
+            "recorded_at": pd["recorded_at"].isoformat()
         }
         for pd, device in results
     ]
+
+
+@router.get("/latest", response_class=ORJSONResponse)
+async def get_latest_readings(
+    db: Session = Depends(get_session),
+    current_user = Depends(get_current_user)
+):
+    """Get latest power readings for all devices"""
+    return ORJSONResponse(await run_db_blocking(db, latest_readings))
+
+
+def export_bound(moment: Union[datetime, date, None]):
+    """An export range bound as naive local time; a bare date means its midnight"""
+    if moment is None:
+        return None
+    if not isinstance(moment, datetime):
+        return datetime(moment.year, moment.month, moment.day)
+    return local_time(moment)
+
+
+@router.get("/export")
+async def export_power_data(
+    start: Union[datetime, date] = Query(None, alias="from", description="Inclusive start of the range (datetime or date)"),
+    end: Union[datetime, date] = Query(None, alias="to", description="Exclusive end of the range (datetime or date)"),
+    device_id: int = None,
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet)$"),
+    current_user = Depends(get_current_user)
+):
+    """Stream raw power readings as CSV, NDJSON or Parquet.
+    
+    Rows are read from a server-side cursor and sent in chunks of
+    `EXPORT_CHUNK_ROWS`, so memory use doesn't grow with the range.
+    Bounds with a UTC offset are converted to the server's local time,
+    which readings are stored in.
+    """
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Parquet export requires pyarrow"
+        )
+    
+    export = EXPORT_FORMATS[format]
+    chunks = iter_reading_chunks(export_bound(start), export_bound(end), device_id, settings.EXPORT_CHUNK_ROWS)
+    filename = f"power_data.{export.extension}"
+    return StreamingResponse(
+        export.stream(chunks),
+        media_type=export.media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
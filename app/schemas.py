@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from app.models import UserRole, DeviceType, DeviceStatus, AlertType, AlertSeverity, ControlAction
 
@@ -38,6 +38,17 @@ class TokenData(BaseModel):
     username: Optional[str] = None
 
 
+class CurrentUser(BaseModel):
+    """Authenticated principal resolved from an access token"""
+    id: int
+    username: str
+    role: Optional[UserRole] = None
+    
+    class Config:
+        from_attributes = True
+        frozen = True
+
+
 # Device Schemas
 class DeviceBase(BaseModel):
     device_name: str
@@ -85,6 +96,7 @@ class PowerDataBase(BaseModel):
 
 class PowerDataCreate(PowerDataBase):
     device_id: int
+    recorded_at: Optional[datetime] = None
 
 
 class PowerData(PowerDataBase):
@@ -102,6 +114,17 @@ class PowerDataWithDevice(PowerData):
     location: Optional[str]
 
 
+class IngestError(BaseModel):
+    index: int
+    detail: str
+
+
+class IngestResult(BaseModel):
+    accepted: int
+    rejected: int
+    errors: List[IngestError] = []
+
+
 # Alert Schemas
 class AlertBase(BaseModel):
     alert_type: AlertType = AlertType.GENERAL
@@ -157,7 +180,13 @@ class ControlHistory(BaseModel):
 # Chart Data Schema
 class ChartData(BaseModel):
     time: str
+    timestamp: Optional[int] = None  # Bucket start, Unix epoch seconds
+    reading_count: Optional[int] = None
     avg_voltage: Optional[float] = 0.0
     avg_current: Optional[float] = 0.0
     avg_power: Optional[float] = 0.0
     total_energy: Optional[float] = 0.0
+    min_voltage: Optional[float] = None
+    max_voltage: Optional[float] = None
+    min_power: Optional[float] = None
+    max_power: Optional[float] = None
@@ -0,0 +1,85 @@
+import fcntl
+import mmap
+import os
+import struct
+from typing import Sequence
+from app.config import settings
+
+SLOT_SIZE = 8
+MAX_SLOTS = 64
+
+# The last slot holds a random epoch, written when the file is created
+EPOCH_OFFSET = (MAX_SLOTS - 1) * SLOT_SIZE
+
+
+class SharedCounters:
+    """Named uint64 counters shared by every worker process on this host.
+
+    The counters live in a small memory-mapped file, so reading one is a
+    plain memory access. Increments take an exclusive ``flock`` on the file
+    so concurrent writers in different workers never lose a bump. Workers
+    use them as version stamps: a worker that sees a counter move knows
+    another process changed the underlying data.
+
+    The counters restart at 0 when the file is lost (a wiped /tmp, a
+    reboot). ``epoch`` is a random value stored with them and replaced
+    whenever the file is recreated, so a version stamp that includes it
+    never repeats across such restarts.
+    """
+
+    def __init__(self, path: str, names: Sequence[str]):
+        if len(names) > MAX_SLOTS - 1:
+            raise ValueError(f"At most {MAX_SLOTS - 1} shared counters are supported")
+
+        self.path = path
+        self._slots = {name: index * SLOT_SIZE for index, name in enumerate(names)}
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        # Grow the file and pick its epoch under the lock so two workers don't race on it
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < MAX_SLOTS * SLOT_SIZE:
+                os.ftruncate(self._fd, MAX_SLOTS * SLOT_SIZE)
+            epoch = struct.unpack("<Q", os.pread(self._fd, SLOT_SIZE, EPOCH_OFFSET))[0]
+            while epoch == 0:
+                epoch = struct.unpack("<Q", os.urandom(SLOT_SIZE))[0]
+                os.pwrite(self._fd, struct.pack("<Q", epoch), EPOCH_OFFSET)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        self.epoch = epoch
+        self._map = mmap.mmap(self._fd, MAX_SLOTS * SLOT_SIZE)
+
+    def get(self, name: str) -> int:
+        """Read the current value of a counter"""
+        return struct.unpack_from("<Q", self._map, self._slots[name])[0]
+
+    def bump(self, name: str) -> int:
+        """Increment a counter and return its new value"""
+        offset = self._slots[name]
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            value = struct.unpack_from("<Q", self._map, offset)[0] + 1
+            struct.pack_into("<Q", self._map, offset, value)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return value
+
+    def raise_to(self, name: str, value: int) -> int:
+        """Set a counter to ``value`` unless it is already higher"""
+        offset = self._slots[name]
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            value = max(value, struct.unpack_from("<Q", self._map, offset)[0])
+            struct.pack_into("<Q", self._map, offset, value)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return value
+
+
+counters = SharedCounters(
+    os.path.join(settings.SHARED_STATE_DIR, "counters.bin"),
+    names=["latest_readings", "users", "users_changed_at", "ws_seq", "devices", "alerts"]
+)
@@ -0,0 +1,109 @@
+import re
+from typing import Dict
+import numpy as np
+from sqlalchemy import BigInteger
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement, literal_column
+from sqlalchemy.sql.functions import FunctionElement
+
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+INTERVAL_PATTERN = re.compile(r"^\s*(\d+)\s*([smhd])\s*$")
+
+
+def parse_interval(value: str) -> int:
+    """Parse a bucket width like ``30s``, ``5m``, ``1h`` or ``1d`` into seconds"""
+    match = INTERVAL_PATTERN.match(value or "")
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid interval {value!r}, expected e.g. 30s, 5m, 1h or 1d")
+    return int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
+
+def bucket_aggregates(epoch: np.ndarray, metrics: Dict[str, np.ndarray], seconds: int) -> Dict[str, np.ndarray]:
+    """Group readings into ``seconds``-wide buckets in NumPy.
+    
+    ``epoch`` holds wall-clock epoch seconds and ``metrics`` the matching
+    values of each metric. Returns float columns with the labels of the
+    raw series query: bucket, reading_count and ``<metric>_sum``,
+    ``_min`` and ``_max``, ordered by bucket.
+    """
+    bucket = epoch - epoch % seconds
+    order = np.argsort(bucket, kind="stable")
+    bucket = bucket[order]
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    
+    result = {
+        "bucket": bucket[starts].astype(np.float64),
+        "reading_count": np.diff(np.r_[starts, len(bucket)]).astype(np.float64)
+    }
+    for metric, values in metrics.items():
+        values = values[order]
+        # Skip missing values the way SQL aggregates skip NULL
+        result[f"{metric}_sum"] = np.add.reduceat(np.nan_to_num(values, nan=0.0), starts)
+        result[f"{metric}_min"] = np.fmin.reduceat(values, starts)
+        result[f"{metric}_max"] = np.fmax.reduceat(values, starts)
+    return result
+
+
+class epoch_seconds(FunctionElement):
+    """Wall-clock epoch seconds of a DATETIME/TIMESTAMP expression.
+    
+    The stored local time is read as if it were UTC, which matches
+    ``app.rollups.to_epoch`` on the Python side.
+    """
+    type = BigInteger()
+    inherit_cache = True
+    name = "epoch_seconds"
+
+
+class bucket_floor(FunctionElement):
+    """Round an integer epoch expression down to a multiple of ``seconds``"""
+    type = BigInteger()
+    inherit_cache = True
+    name = "bucket_floor"
+    
+    def __init__(self, expr, seconds: int):
+        # Inline the width as a literal so it is part of the statement cache key
+        super().__init__(expr, literal_column(str(int(seconds))))
+
+
+def time_bucket(column, seconds: int) -> ColumnElement:
+    """Integer bucket start (epoch seconds) of a datetime column"""
+    return bucket_floor(epoch_seconds(column), seconds)
+
+
+@compiles(epoch_seconds, "mysql")
+def compile_epoch_mysql(element, compiler, **kw):
+    # TIMESTAMPDIFF is plain calendar arithmetic, unlike UNIX_TIMESTAMP
+    # which depends on the session time zone
+    return "TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', %s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(epoch_seconds, "postgresql")
+def compile_epoch_postgresql(element, compiler, **kw):
+    # EXTRACT keeps the fraction and CAST rounds it; FLOOR truncates like the
+    # other dialects, to_epoch and the rollups
+    return "CAST(FLOOR(EXTRACT(EPOCH FROM CAST(%s AS TIMESTAMP))) AS BIGINT)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(epoch_seconds, "sqlite")
+def compile_epoch_sqlite(element, compiler, **kw):
+    return "CAST(strftime('%%s', %s) AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(epoch_seconds)
+def compile_epoch_default(element, compiler, **kw):
+    raise NotImplementedError(f"epoch_seconds is not supported on {compiler.dialect.name}")
+
+
+@compiles(bucket_floor, "mysql")
+def compile_bucket_floor_mysql(element, compiler, **kw):
+    expr, seconds = (compiler.process(clause, **kw) for clause in element.clauses)
+    return "((%s) DIV %s) * %s" % (expr, seconds, seconds)
+
+
+@compiles(bucket_floor)
+def compile_bucket_floor(element, compiler, **kw):
+    # Integer division truncates on PostgreSQL and SQLite; epochs are positive
+    expr, seconds = (compiler.process(clause, **kw) for clause in element.clauses)
+    return "((%s) / %s) * %s" % (expr, seconds, seconds)
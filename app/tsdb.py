@@ -0,0 +1,358 @@
+import fcntl
+import os
+import re
+import threading
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+from app.config import settings
+from app.timebucket import bucket_aggregates
+
+METRICS = ("voltage", "current", "power", "energy", "power_factor", "frequency")
+
+# One reading in the active chunk; recorded_at is wall-clock epoch microseconds
+ROW = np.dtype([("recorded_at", "<i8")] + [(metric, "<f8") for metric in METRICS])
+
+# Active chunk header: rows in use, generation of the chunk being filled
+HEADER = np.dtype([("count", "<u8"), ("generation", "<u8")])
+HEADER_SIZE = 64
+
+CHUNK_FILE = re.compile(r"^(\d+)_(-?\d+)_(-?\d+)\.npz$")
+
+# Decoded sealed chunks kept per worker
+DECODED_CHUNKS = 32
+
+Columns = Dict[str, np.ndarray]
+
+
+def to_micros(moments) -> np.ndarray:
+    return np.array(moments, dtype="datetime64[us]").astype(np.int64)
+
+
+def shuffle_compress(words: np.ndarray) -> bytes:
+    """zlib of 64-bit words with their bytes regrouped by significance"""
+    return zlib.compress(words.view(np.uint8).reshape(-1, 8).T.tobytes())
+
+
+def unshuffle_decompress(data: bytes, rows: int) -> np.ndarray:
+    planes = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(8, rows)
+    return np.ascontiguousarray(planes.T).view(np.uint64).ravel()
+
+
+def encode_timestamps(micros: np.ndarray) -> bytes:
+    """Delta-of-delta, zigzag encoded: a steady sample rate becomes zeros"""
+    dod = np.diff(np.diff(micros, prepend=0), prepend=0)
+    zigzag = (dod << 1) ^ (dod >> 63)
+    return shuffle_compress(zigzag.view(np.uint64))
+
+
+def decode_timestamps(data: bytes, rows: int) -> np.ndarray:
+    zigzag = unshuffle_decompress(data, rows)
+    dod = (zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).view(np.int64)
+    return np.cumsum(np.cumsum(dod))
+
+
+def encode_values(values: np.ndarray) -> bytes:
+    """Gorilla-style XOR with the previous value: repeated or close values share their high bits"""
+    bits = values.view(np.uint64)
+    return shuffle_compress(bits ^ np.r_[np.uint64(0), bits[:-1]])
+
+
+def decode_values(data: bytes, rows: int) -> np.ndarray:
+    return np.bitwise_xor.accumulate(unshuffle_decompress(data, rows)).view(np.float64)
+
+
+@lru_cache(maxsize=DECODED_CHUNKS)
+def load_chunk(path: str) -> Columns:
+    """Columns of a sealed chunk; sealed chunks never change, so they are cached"""
+    with np.load(path) as chunk:
+        rows = int(chunk["rows"])
+        columns = {"recorded_at": decode_timestamps(chunk["recorded_at"].tobytes(), rows)}
+        for metric in METRICS:
+            columns[metric] = decode_values(chunk[metric].tobytes(), rows)
+    for values in columns.values():
+        values.flags.writeable = False
+    return columns
+
+
+def select(columns: Columns, start: Optional[int], end: Optional[int]) -> Columns:
+    """Rows with ``start <= recorded_at < end`` (epoch microseconds)"""
+    mask = np.ones(len(columns["recorded_at"]), dtype=bool)
+    if start is not None:
+        mask &= columns["recorded_at"] >= start
+    if end is not None:
+        mask &= columns["recorded_at"] < end
+    if mask.all():
+        return columns
+    return {name: values[mask] for name, values in columns.items()}
+
+
+class DeviceSeries:
+    """Append-only readings of one device.
+    
+    New readings go into a fixed-size active chunk, a memory-mapped file
+    shared by every worker and guarded by ``flock``. When it fills up it
+    is sorted, compressed column by column into a sealed chunk file named
+    after its generation and time range, and reset. A sealed file whose
+    generation is still current means a worker died after writing it, so
+    the active chunk is treated as already flushed. ``flock`` doesn't
+    exclude threads sharing a descriptor, so a thread lock is held too.
+    """
+    
+    def __init__(self, directory: str, chunk_rows: int):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "active.bin")
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self._fd).st_size
+            if size < HEADER_SIZE + ROW.itemsize:
+                size = HEADER_SIZE + chunk_rows * ROW.itemsize
+                os.ftruncate(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        
+        # An existing file keeps the capacity it was created with
+        self.capacity = (size - HEADER_SIZE) // ROW.itemsize
+        self._header = np.memmap(path, dtype=HEADER, mode="r+", shape=(1,))
+        self._rows = np.memmap(path, dtype=ROW, mode="r+", offset=HEADER_SIZE, shape=(self.capacity,))
+    
+    def sealed_chunks(self, start: Optional[int] = None, end: Optional[int] = None) -> List[str]:
+        """Sealed chunk files overlapping [start, end), by generation"""
+        chunks = []
+        for name in os.listdir(self.directory):
+            match = CHUNK_FILE.match(name)
+            if not match:
+                continue
+            generation, first, last = (int(part) for part in match.groups())
+            if (start is None or last >= start) and (end is None or first < end):
+                chunks.append((generation, os.path.join(self.directory, name)))
+        return [path for _, path in sorted(chunks)]
+    
+    def _recover(self):
+        header = self._header[0]
+        prefix = f"{int(header['generation']):012d}_"
+        if header["count"] and any(name.startswith(prefix) for name in os.listdir(self.directory)):
+            self._header[0] = (0, header["generation"] + 1)
+    
+    def _seal(self):
+        count = int(self._header[0]["count"])
+        generation = int(self._header[0]["generation"])
+        rows = np.sort(self._rows[:count], order="recorded_at", kind="stable")
+        
+        chunk = {
+            "rows": np.array(count),
+            "recorded_at": np.frombuffer(encode_timestamps(rows["recorded_at"]), dtype=np.uint8)
+        }
+        for metric in METRICS:
+            chunk[metric] = np.frombuffer(encode_values(np.ascontiguousarray(rows[metric])), dtype=np.uint8)
+        
+        name = f"{generation:012d}_{rows['recorded_at'][0]}_{rows['recorded_at'][-1]}.npz"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        
+        self._header[0] = (0, generation + 1)
+    
+    def append(self, rows: np.ndarray):
+        """Append ``ROW`` records, sealing the active chunk each time it fills"""
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                self._recover()
+                while len(rows):
+                    count = int(self._header[0]["count"])
+                    taken = min(self.capacity - count, len(rows))
+                    self._rows[count:count + taken] = rows[:taken]
+                    self._header[0]["count"] = count + taken
+                    rows = rows[taken:]
+                    if count + taken == self.capacity:
+                        self._seal()
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+    
+    def read(self, start: Optional[int] = None, end: Optional[int] = None) -> Columns:
+        """Readings in [start, end) (epoch microseconds), not in time order"""
+        paths, active = self._snapshot(start, end)
+        
+        parts = [select(load_chunk(path), start, end) for path in paths]
+        parts.append(select({name: active[name] for name in ROW.names}, start, end))
+        if len(parts) == 1:
+            return parts[0]
+        return {name: np.concatenate([part[name] for part in parts]) for name in ROW.names}
+    
+    def _snapshot(self, start: Optional[int], end: Optional[int]):
+        """Sealed chunk paths and a copy of the active rows, consistent with each other"""
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            try:
+                paths = self.sealed_chunks(start, end)
+                header = self._header[0]
+                active = np.array(self._rows[:int(header["count"])])
+                # A crashed seal already wrote the active rows
+                current = f"{int(header['generation']):012d}_"
+                if len(active) and any(name.startswith(current) for name in os.listdir(self.directory)):
+                    active = active[:0]
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return paths, active
+    
+    def bounds(self) -> Optional[tuple]:
+        """Oldest and newest timestamps, without decoding sealed chunks"""
+        paths, active = self._snapshot(None, None)
+        ends = [int(part) for path in paths for part in CHUNK_FILE.match(os.path.basename(path)).group(2, 3)]
+        if len(active):
+            ends.extend((int(active["recorded_at"].min()), int(active["recorded_at"].max())))
+        return (min(ends), max(ends)) if ends else None
+    
+    def latest(self) -> Optional[dict]:
+        """The reading with the newest timestamp"""
+        bounds = self.bounds()
+        if bounds is None:
+            return None
+        # Only the active chunk and sealed chunks reaching that far can hold it
+        columns = self.read(start=bounds[1])
+        index = int(np.argmax(columns["recorded_at"]))
+        return {name: columns[name][index] for name in ROW.names}
+
+
+class ColumnStore:
+    """Readings stored as compressed per-device column chunks on local disk.
+    
+    An alternative to one ``power_data`` row per reading for high-rate
+    telemetry (``POWER_STORAGE=columnar``). Range aggregates decode the
+    chunks that overlap the range and group them with NumPy. Readings
+    have no ids. The rollup tables are still kept in the database.
+    """
+    
+    def __init__(self, directory: str, chunk_rows: int):
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self._devices: Dict[int, DeviceSeries] = {}
+    
+    def device(self, device_id: int) -> DeviceSeries:
+        series = self._devices.get(device_id)
+        if series is None:
+            series = self._devices.setdefault(
+                device_id, DeviceSeries(os.path.join(self.directory, str(device_id)), self.chunk_rows)
+            )
+        return series
+    
+    def device_ids(self) -> List[int]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(int(name) for name in os.listdir(self.directory) if name.isdigit())
+    
+    def encode(self, readings: List[dict]) -> Dict[int, np.ndarray]:
+        """``ROW`` records per device for readings (dicts with the ``PowerData`` columns)"""
+        by_device = defaultdict(list)
+        for reading in readings:
+            by_device[reading["device_id"]].append(reading)
+        
+        encoded = {}
+        for device_id, device_readings in by_device.items():
+            rows = np.empty(len(device_readings), dtype=ROW)
+            rows["recorded_at"] = to_micros([reading["recorded_at"] for reading in device_readings])
+            for metric in METRICS:
+                # None becomes NaN
+                rows[metric] = np.array([reading.get(metric) for reading in device_readings], dtype=np.float64)
+            encoded[device_id] = rows
+        return encoded
+    
+    def append(self, encoded: Dict[int, np.ndarray]):
+        """Store readings encoded by ``encode``"""
+        for device_id, rows in encoded.items():
+            self.device(device_id).append(rows)
+    
+    def read(self, start: Optional[datetime], end: Optional[datetime], device_id: Optional[int] = None) -> Columns:
+        """Readings of one or every device in [start, end), with a device_id column"""
+        start_us = int(to_micros(start)) if start is not None else None
+        end_us = int(to_micros(end)) if end is not None else None
+        device_ids = [device_id] if device_id is not None else self.device_ids()
+        
+        parts = []
+        for current in device_ids:
+            columns = self.device(current).read(start_us, end_us)
+            columns["device_id"] = np.full(len(columns["recorded_at"]), current, dtype=np.int64)
+            parts.append(columns)
+        if not parts:
+            empty = {name: np.empty(0, dtype=ROW[name]) for name in ROW.names}
+            empty["device_id"] = np.empty(0, dtype=np.int64)
+            return empty
+        return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+    
+    def buckets(self, seconds: int, start: datetime, device_id: Optional[int] = None) -> Optional[Columns]:
+        """Series columns for ``seconds``-wide buckets since ``start``, like the raw series query"""
+        columns = self.read(start, None, device_id)
+        if not len(columns["recorded_at"]):
+            return None
+        epoch = columns["recorded_at"] // 1_000_000
+        metrics = {metric: columns[metric] for metric in ("voltage", "current", "power", "energy")}
+        return bucket_aggregates(epoch, metrics, seconds)
+    
+    def iter_rows(
+        self,
+        start: Optional[datetime],
+        end: Optional[datetime],
+        device_id: Optional[int],
+        chunk_rows: int
+    ) -> Iterator[List[tuple]]:
+        """Readings as export row tuples in time order, one day in memory at a time"""
+        device_ids = [device_id] if device_id is not None else self.device_ids()
+        if start is None or end is None:
+            bounds = [self.device(current).bounds() for current in device_ids]
+            bounds = [bound for bound in bounds if bound is not None]
+            if not bounds:
+                return
+            first = np.datetime64(min(bound[0] for bound in bounds), "us").astype(datetime)
+            last = np.datetime64(max(bound[1] for bound in bounds), "us").astype(datetime) + timedelta(microseconds=1)
+            start = max(start, first) if start is not None else first
+            end = min(end, last) if end is not None else last
+        
+        day = datetime.combine(start.date(), datetime.min.time())
+        while day < end:
+            columns = self.read(max(start, day), min(end, day + timedelta(days=1)), device_id)
+            order = np.argsort(columns["recorded_at"], kind="stable")
+            recorded_at = columns["recorded_at"][order].astype("datetime64[us]").astype(object)
+            values = [columns["device_id"][order], recorded_at] + [columns[metric][order] for metric in METRICS]
+            for offset in range(0, len(order), chunk_rows):
+                rows = zip(*(column[offset:offset + chunk_rows].tolist() for column in values))
+                # id, device_id, recorded_at, then the metrics in export column order
+                yield [(None, *row) for row in rows]
+            day += timedelta(days=1)
+    
+    def latest(self) -> Dict[int, dict]:
+        """Newest reading of every device, as dicts with the ``PowerData`` columns"""
+        latest = {}
+        for device_id in self.device_ids():
+            row = self.device(device_id).latest()
+            if row is None:
+                continue
+            reading = {"id": None, "device_id": device_id}
+            reading.update({metric: float(row[metric]) for metric in METRICS})
+            reading["recorded_at"] = np.datetime64(int(row["recorded_at"]), "us").astype(datetime)
+            latest[device_id] = reading
+        return latest
+    
+    def stats(self) -> dict:
+        chunks = 0
+        size = 0
+        for device_id in self.device_ids():
+            for path in self.device(device_id).sealed_chunks():
+                chunks += 1
+                size += os.path.getsize(path)
+        return {"engine": "columnar", "devices": len(self.device_ids()), "sealed_chunks": chunks, "sealed_bytes": size}
+
+
+reading_store: Optional[ColumnStore] = None
+if settings.POWER_STORAGE == "columnar":
+    reading_store = ColumnStore(settings.TSDB_DIR, settings.TSDB_CHUNK_ROWS)
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import re
+from collections import deque
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Set
+from fastapi import WebSocket
+from app.config import settings
+from app.shared_counters import counters
+
+logger = logging.getLogger(__name__)
+
+# Close code sent to clients that can't keep up (RFC 6455 "try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# Topic every new connection starts on; it receives every event
+ALL_TOPICS = "*"
+TOPIC_PATTERN = re.compile(r"^(\*|alerts|stats|device:\d+|location:.{1,100})$")
+MAX_TOPICS_PER_CONNECTION = 1000
+
+
+class SentEvent(NamedTuple):
+    """An event kept in the replay buffer"""
+    seq: int
+    text: str
+
+
+def device_topics(device_id: int, location: str = None) -> List[str]:
+    """Topics an event about one device is published on"""
+    topics = [f"device:{device_id}"]
+    if location:
+        topics.append(f"location:{location}")
+    return topics
+
+
+class Connection:
+    """One WebSocket client with a bounded outgoing queue and its writer task"""
+    
+    def __init__(self, websocket: WebSocket, queue_size: int, policy: str):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.policy = policy
+        self.writer_task: asyncio.Task = None
+        self.dropped = 0
+        self.topics: Set[str] = set()
+        # Last sequence number when the client connected; later events are queued live
+        self.connected_seq = 0
+    
+    def offer(self, text: str) -> bool:
+        """Queue an encoded message without waiting.
+        
+        Returns False when the client is too slow and should be dropped.
+        With the ``resync`` policy the pending messages are discarded instead
+        and replaced by a ``resync`` message, so the client reloads its state
+        over REST rather than applying deltas on top of a gap.
+        """
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            if self.policy != "resync":
+                return False
+        
+        while not self.queue.empty():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(json.dumps({"type": "resync", "seq": counters.get("ws_seq")}))
+        return True
+    
+    async def write(self):
+        """Send queued messages until the socket fails or the task is cancelled"""
+        while True:
+            text = await self.queue.get()
+            await self.websocket.send_text(text)
+
+
+class ConnectionManager:
+    """Tracks WebSocket clients and fans messages out to them.
+    
+    A broadcast serializes the message once and drops the text into every
+    client's bounded queue; a per-connection writer task does the actual
+    send, so one slow client never delays the others. Clients whose writer
+    fails are pruned automatically, and clients whose queue overflows are
+    handled according to ``WS_SLOW_CONSUMER_POLICY``.
+    
+    Clients subscribe to topics (``device:{id}``, ``location:{name}``,
+    ``alerts``, ``stats``). A topic -> connections index means an event only
+    touches the sockets subscribed to one of its topics, plus those still on
+    the ``*`` topic every connection starts with.
+    
+    The last ``replay_size`` events are kept so a client that reconnects can
+    resume from the last sequence number it saw instead of reloading
+    everything over REST. The missed events are queued before the client is
+    registered for live fan-out, so they always arrive ahead of newer ones.
+    """
+    
+    def __init__(self, queue_size: int = 100, policy: str = "resync", replay_size: int = 1000):
+        self.queue_size = queue_size
+        self.policy = policy
+        self.active_connections: Dict[WebSocket, Connection] = {}
+        self.subscriptions: Dict[str, Set[Connection]] = {}
+        self.history: Deque[SentEvent] = deque(maxlen=replay_size)
+    
+    async def connect(self, websocket: WebSocket, since: Optional[int] = None) -> Connection:
+        """Register a client, first queueing the events it missed after ``since``"""
+        await websocket.accept()
+        connection = Connection(websocket, self.queue_size, self.policy)
+        connection.connected_seq = counters.get("ws_seq")
+        if since is not None:
+            # Either the missed events are queued, or the client must reload
+            if self.resume(connection, since):
+                connection.offer(json.dumps({"type": "resumed"}))
+            else:
+                connection.offer(json.dumps({"type": "resync", "seq": connection.connected_seq}))
+        # No await from here on: nothing is fanned out between the replay and registering
+        connection.writer_task = asyncio.create_task(self._run_writer(connection))
+        self.active_connections[websocket] = connection
+        self.subscribe(connection, [ALL_TOPICS])
+        return connection
+    
+    def disconnect(self, websocket: WebSocket):
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        self.unsubscribe(connection, list(connection.topics))
+        if connection.writer_task is not asyncio.current_task():
+            connection.writer_task.cancel()
+    
+    def subscribe(self, connection: Connection, topics: Iterable[str]):
+        """Add topics to a connection; raises ValueError for unknown topics"""
+        topics = set(topics)
+        invalid = [topic for topic in topics if not isinstance(topic, str) or not TOPIC_PATTERN.match(topic)]
+        if invalid:
+            raise ValueError(f"Invalid topics: {invalid[:10]}")
+        if len(connection.topics | topics) > MAX_TOPICS_PER_CONNECTION:
+            raise ValueError(f"At most {MAX_TOPICS_PER_CONNECTION} topics per connection")
+        
+        for topic in topics - connection.topics:
+            self.subscriptions.setdefault(topic, set()).add(connection)
+        connection.topics |= topics
+    
+    def unsubscribe(self, connection: Connection, topics: Iterable[str]):
+        """Remove topics from a connection, ignoring ones it doesn't have"""
+        for topic in set(topics) & connection.topics:
+            subscribers = self.subscriptions[topic]
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.subscriptions[topic]
+            connection.topics.discard(topic)
+    
+    async def _run_writer(self, connection: Connection):
+        try:
+            await connection.write()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The client went away; stop tracking it
+            self.disconnect(connection.websocket)
+    
+    async def _close_slow(self, connection: Connection):
+        logger.warning("Dropped slow WebSocket client after %d queued messages", self.queue_size)
+        try:
+            await connection.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+    
+    def subscribers(self, topics: Iterable[str]) -> Set[Connection]:
+        """Connections interested in any of ``topics``"""
+        targets = set(self.subscriptions.get(ALL_TOPICS, ()))
+        for topic in topics:
+            subscribers = self.subscriptions.get(topic)
+            if subscribers:
+                targets |= subscribers
+        return targets
+    
+    def send_text(self, text: str, topics: Iterable[str] = (), seq: int = None):
+        """Queue already-encoded JSON for every client subscribed to ``topics``"""
+        topics = list(topics)
+        if seq is not None:
+            self.history.append(SentEvent(seq, text))
+        
+        for connection in self.subscribers(topics):
+            if not connection.offer(text):
+                self.disconnect(connection.websocket)
+                asyncio.create_task(self._close_slow(connection))
+    
+    async def broadcast(self, message: dict, topics: Iterable[str] = ()):
+        """Encode a message once and queue it for the clients of ``topics``"""
+        self.send_text(json.dumps(message, default=str), topics)
+    
+    def resume(self, connection: Connection, since: int) -> bool:
+        """Queue the events a reconnecting client missed after ``since``.
+        
+        Called before the connection is registered, so every event delivered
+        so far is in the replay buffer and none is queued yet; a new client is
+        on the ``*`` topic, so all of them are replayed. Returns False
+        when the gap can't be filled (the events fell out of the buffer, the
+        sequence is from another host or the missed events would overflow
+        the client's queue) and the client has to reload its state.
+        """
+        if since > connection.connected_seq:
+            return False
+        
+        if since < connection.connected_seq and (not self.history or min(event.seq for event in self.history) > since + 1):
+            return False
+        
+        missed = sorted(
+            (event for event in self.history if event.seq > since),
+            key=lambda event: event.seq
+        )
+        # Leave room for the resumed reply and the hello
+        if len(missed) > self.queue_size - 2:
+            return False
+        
+        for event in missed:
+            connection.offer(event.text)
+        return True
+    
+    def queue_depths(self) -> Dict[str, int]:
+        """Total and maximum pending messages across clients"""
+        depths = [connection.queue.qsize() for connection in self.active_connections.values()]
+        return {"total": sum(depths), "max": max(depths, default=0)}
+
+
+manager = ConnectionManager(
+    settings.WS_SEND_QUEUE_SIZE,
+    settings.WS_SLOW_CONSUMER_POLICY,
+    settings.WS_REPLAY_BUFFER
+)
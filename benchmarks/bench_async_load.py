@@ -0,0 +1,124 @@
+"""Concurrent load on the device list and history endpoints, sync vs async.
+
+Fills the database with ``--devices`` devices and ``--hours`` of minute
+readings, then starts uvicorn once with DB_ASYNC off (threadpool) and
+once with it on (async engine). Each server gets ``--requests`` GETs
+from ``--concurrency`` concurrent clients per endpoint. Reports
+requests/s and p50/p99 latency. The response cache is sized to 0 so every
+request reaches the database.
+
+    python benchmarks/bench_async_load.py --concurrency 200
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from common import ROOT, create_devices, login  # Configures the app before it is imported
+
+ENDPOINTS = {
+    "devices": "/api/devices/",
+    "history": "/api/power/history?hours=24&points=100",
+}
+
+
+def fill(devices: int, hours: int):
+    from app.database import SessionLocal
+    from app.readings import write_readings
+    device_ids = create_devices(devices)
+    now = datetime.now(timezone.utc)
+    db = SessionLocal()
+    try:
+        for minute in range(hours * 60, 0, -60):
+            recorded_at = [now - timedelta(minutes=minute - m) for m in range(60)]
+            write_readings(db, [
+                {"device_id": device_id, "voltage": 220.0, "current": 1.5, "power": 330.0 + m,
+                 "energy": 0.005, "power_factor": 0.95, "frequency": 50.0, "recorded_at": at}
+                for m, at in enumerate(recorded_at) for device_id in device_ids
+            ])
+    finally:
+        db.close()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(db_async: bool, port: int) -> subprocess.Popen:
+    env = dict(os.environ, DB_ASYNC=str(db_async), RESPONSE_CACHE_SIZE="0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    import httpx
+    for _ in range(100):
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/health")
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+async def load(base_url: str, path: str, headers: dict, requests: int, concurrency: int):
+    """Seconds taken and per-request latencies for ``requests`` GETs"""
+    import httpx
+    latencies = []
+    remaining = iter(range(requests))
+    
+    async def worker(client):
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+    
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        return time.perf_counter() - started, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--hours", type=int, default=24)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    
+    from fastapi.testclient import TestClient
+    import main as app_main
+    
+    fill(args.devices, args.hours)
+    with TestClient(app_main.app) as client:
+        headers = login(client)
+    
+    for db_async in (False, True):
+        port = free_port()
+        server = start_server(db_async, port)
+        try:
+            for name, path in ENDPOINTS.items():
+                elapsed, latencies = asyncio.run(
+                    load(f"http://127.0.0.1:{port}", path, headers, args.requests, args.concurrency)
+                )
+                cut = statistics.quantiles(latencies, n=100)
+                mode = "async" if db_async else "sync"
+                print(f"{mode:5} {name:8} {args.requests / elapsed:8.0f} req/s"
+                      f"  p50 {cut[49] * 1000:7.1f} ms  p99 {cut[98] * 1000:7.1f} ms")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Cost of resolving the current user from a bearer token.
+
+Times ``get_current_user`` per request for a token cache hit, a cold
+decode that trusts the token's signed uid/role claims, and a token
+without those claims, which needs a users query (the only path before
+the cache).
+
+    python benchmarks/bench_auth_cache.py
+"""
+import argparse
+import asyncio
+
+from common import create_schema, median_time  # Configures the app before it is imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+    
+    from app.auth import create_access_token, get_current_user, get_password_hash, token_cache
+    from app.database import SessionLocal
+    from app.models import User
+    
+    create_schema()
+    db = SessionLocal()
+    user = User(username="bench", password=get_password_hash("bench"), role="admin")
+    db.add(user)
+    db.commit()
+    with_claims = create_access_token({"sub": user.username, "uid": user.id, "role": "admin"})
+    without_claims = create_access_token({"sub": user.username})
+    
+    async def resolve(token: str, cold: bool):
+        for _ in range(args.requests):
+            if cold:
+                token_cache.clear()
+            await get_current_user(token, db)
+    
+    cases = {
+        "cache hit": (with_claims, False),
+        "decode, signed claims": (with_claims, True),
+        "decode, users query": (without_claims, True),
+    }
+    for name, (token, cold) in cases.items():
+        elapsed = median_time(lambda: asyncio.run(resolve(token, cold)))
+        print(f"{name:22} {elapsed / args.requests * 1e6:8.1f} us/request")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
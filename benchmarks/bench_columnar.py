@@ -0,0 +1,79 @@
+"""Ingest rate and 30-day aggregate latency, SQL rows vs the columnar store.
+
+Runs once per POWER_STORAGE engine, each in its own process and state
+directory:
+- writes ``--rows`` readings for ``--devices`` devices, spread over 30
+  days, through ``write_readings`` in ``--batch``-row transactions
+  (rollups included);
+- times ``raw_series`` over the whole 30 days in hourly buckets, the
+  raw-reading aggregate behind /api/power/history, for every device and
+  for one device.
+
+    python benchmarks/bench_columnar.py --rows 200000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ENGINES = ("sql", "columnar")
+
+
+def run(args):
+    os.environ["POWER_STORAGE"] = args.storage
+    from common import create_devices, median_time  # Configures the app before it is imported
+    from datetime import datetime, timedelta, timezone
+    import numpy as np
+    from app.database import SessionLocal
+    from app.readings import write_readings
+    from app.routers.power import raw_series
+    
+    device_ids = create_devices(args.devices)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    start = now - timedelta(days=30)
+    step = timedelta(days=30) / args.rows
+    rng = np.random.default_rng(0)
+    power = rng.uniform(0, 1000, args.rows).round(1)
+    
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        for offset in range(0, args.rows, args.batch):
+            write_readings(db, [
+                {"device_id": device_ids[i % len(device_ids)], "voltage": 220.0 + i % 7, "current": power[i] / 220,
+                 "power": float(power[i]), "energy": 0.001, "power_factor": 0.95, "frequency": 50.0,
+                 "recorded_at": start + step * i}
+                for i in range(offset, min(offset + args.batch, args.rows))
+            ])
+        ingest = time.perf_counter() - started
+        every = median_time(lambda: raw_series(db, 3600, start))
+        one = median_time(lambda: raw_series(db, 3600, start, device_ids[0]))
+    finally:
+        db.close()
+    print(f"{args.storage:8} ingest {args.rows / ingest:9.0f} readings/s"
+          f"  30-day hourly: all devices {every * 1000:8.1f} ms, one device {one * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--storage", choices=ENGINES, help="Run one engine in this process")
+    args = parser.parse_args()
+    
+    if args.storage:
+        run(args)
+        return
+    # Settings are read at import, so each engine gets a fresh process
+    for storage in ENGINES:
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--storage", storage, "--rows", str(args.rows),
+             "--batch", str(args.batch), "--devices", str(args.devices)],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
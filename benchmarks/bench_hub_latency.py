@@ -0,0 +1,124 @@
+"""Publish-to-client latency through the Unix socket broadcast hub.
+
+Starts ``--workers`` processes, each with a UnixSocketHubBackend on one
+shared directory (the first becomes the hub) feeding a ConnectionManager
+with ``--clients`` in-process fake sockets, as in a gunicorn deployment
+with WS_BROADCAST_BACKEND=unix. Once all are connected every worker
+publishes ``--events`` events at ``--rate`` per second. Each fake socket
+records how long after publishing, on whichever worker, every event
+reached its ``send_text``: hub relay, fan-out and the connection's writer
+task. Reports p50/p99/max latency and how many deliveries took longer than
+WS_HUB_LATENCY_WARN_MS.
+
+    python benchmarks/bench_hub_latency.py --workers 4 --rate 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from common import STATE_DIR  # Configures the app before it is imported
+
+
+class LatencySocket:
+    def __init__(self):
+        self.latencies = []
+    
+    async def accept(self):
+        pass
+    
+    async def send_text(self, text: str):
+        self.latencies.append(time.time() - json.loads(text)["sent_at"])
+    
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def run_worker(args):
+    from app.broadcast import UnixSocketHubBackend
+    from app.websocket import ConnectionManager
+    
+    expected = args.workers * args.events
+    manager = ConnectionManager(queue_size=expected + 10)
+    sockets = [LatencySocket() for _ in range(args.clients)]
+    for socket in sockets:
+        await manager.connect(socket)
+    # The benchmark reports slow deliveries itself
+    backend = UnixSocketHubBackend(args.state_dir, latency_warn_ms=float("inf"))
+    await backend.start(manager.send_text)
+    while not backend.stats()["connected"]:
+        await asyncio.sleep(0.01)
+    
+    # Publish once every worker is connected
+    loop = asyncio.get_running_loop()
+    print("ready", flush=True)
+    await loop.run_in_executor(None, sys.stdin.readline)
+    for seq in range(args.events):
+        await backend.publish(json.dumps({"type": "bench", "sent_at": time.time()}), ["stats"], seq)
+        await asyncio.sleep(1 / args.rate)
+    
+    deadline = time.time() + 30
+    while any(len(socket.latencies) < expected for socket in sockets) and time.time() < deadline:
+        await asyncio.sleep(0.01)
+    print(json.dumps([latency for socket in sockets for latency in socket.latencies]), flush=True)
+    
+    # Keep relaying (or serving as hub) until every worker has reported
+    await loop.run_in_executor(None, sys.stdin.read)
+    await backend.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=10, help="Fake WebSocket clients per worker")
+    parser.add_argument("--events", type=int, default=500, help="Events published by each worker")
+    parser.add_argument("--rate", type=float, default=200, help="Events per second from each worker")
+    parser.add_argument("--worker", action="store_true", help="Run one worker in this process")
+    parser.add_argument("--state-dir", default=STATE_DIR)
+    args = parser.parse_args()
+    
+    if args.worker:
+        asyncio.run(run_worker(args))
+        return
+    
+    from app.config import settings
+    
+    command = [
+        sys.executable, os.path.abspath(__file__), "--worker", "--state-dir", args.state_dir,
+        "--workers", str(args.workers), "--clients", str(args.clients),
+        "--events", str(args.events), "--rate", str(args.rate),
+    ]
+    workers = [
+        subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        for _ in range(args.workers)
+    ]
+    try:
+        for worker in workers:
+            assert worker.stdout.readline() == "ready\n"
+        # Give the hub a moment to register the last connection
+        time.sleep(0.2)
+        for worker in workers:
+            worker.stdin.write("go\n")
+            worker.stdin.flush()
+        latencies = [latency for worker in workers for latency in json.loads(worker.stdout.readline())]
+    finally:
+        for worker in workers:
+            worker.stdin.close()
+            worker.wait()
+    
+    expected = args.workers * args.clients * args.workers * args.events
+    cut = statistics.quantiles(latencies, n=100)
+    slow = sum(latency * 1000 > settings.WS_HUB_LATENCY_WARN_MS for latency in latencies)
+    print(f"{args.workers} workers x {args.clients} clients, {args.events} events per worker at {args.rate:.0f}/s:"
+          f" {len(latencies)}/{expected} deliveries")
+    print(f"publish to client  p50 {cut[49] * 1000:6.2f} ms  p99 {cut[98] * 1000:6.2f} ms"
+          f"  max {max(latencies) * 1000:6.2f} ms")
+    print(f"over WS_HUB_LATENCY_WARN_MS ({settings.WS_HUB_LATENCY_WARN_MS:.0f} ms): {slow}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Bulk ingest throughput through POST /api/power/ingest.
+
+Posts ``--rows`` readings for ``--devices`` devices in ``--batch``-row
+requests and reports readings stored per second, end to end (HTTP,
+validation, insert, rollups). Compares against one ORM object and commit
+per reading, the write path the endpoint replaced. ``--stages`` stores the
+readings again through ``store_readings``, the endpoint's body minus HTTP,
+under cProfile and splits the time across the ingest stages, to show
+where the per-reading cost goes.
+
+    python benchmarks/bench_ingest.py --rows 50000 --stages
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import random
+import time
+
+from common import create_devices, login  # Configures the app before it is imported
+
+# (label, module file, function) of each stage under POST /api/power/ingest
+STAGES = (
+    ("validation", "power.py", "validate_readings"),
+    ("device check, model_dump", "power.py", "check_readings"),
+    ("insert", "readings.py", "insert_readings"),
+    ("  of which latest rows", "readings.py", "get_latest_by_device"),
+    ("columnar encode", "tsdb.py", "encode"),
+    ("daily energy", "rollups.py", "record_daily_energy"),
+    ("power rollups", "rollups.py", "record_power_rollups"),
+    ("events", "events.py", "emit_readings"),
+    ("alert rules", "alert_rules.py", "evaluate"),
+)
+
+
+def print_stages(profile: cProfile.Profile, rows: int):
+    """Print each stage's cumulative time per reading and share of the total"""
+    stats = pstats.Stats(profile).stats
+    total = sum(timing[3] for (path, _, name), timing in stats.items() if name == "store_readings")
+    cumulative = {
+        label: sum(timing[3] for (path, _, name), timing in stats.items()
+                   if name == function and os.path.basename(path) == module)
+        for label, module, function in STAGES
+    }
+    # check_readings includes validation
+    cumulative["device check, model_dump"] -= cumulative["validation"]
+    for label, _, _ in STAGES:
+        print(f"  {label:24} {cumulative[label] / rows * 1e6:6.1f} us/reading  {cumulative[label] / total:5.1%}")
+    print(f"  {'store_readings total':24} {total / rows * 1e6:6.1f} us/reading (profiled)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--orm-rows", type=int, default=2000, help="Readings written one by one for comparison")
+    parser.add_argument("--stages", action="store_true", help="Profile a second pass and break it down by stage")
+    args = parser.parse_args()
+    
+    from fastapi.testclient import TestClient
+    import main as app_main
+    from app.database import SessionLocal
+    from app.models import PowerData
+    from app.routers.power import store_readings
+    
+    device_ids = create_devices(args.devices)
+    readings = [
+        {"device_id": random.choice(device_ids), "voltage": round(215 + random.random() * 10, 2),
+         "current": round(random.random() * 5, 3), "power": round(random.random() * 1000, 1), "energy": 0.01}
+        for _ in range(args.rows)
+    ]
+    
+    with TestClient(app_main.app) as client:
+        headers = login(client)
+        started = time.perf_counter()
+        for offset in range(0, args.rows, args.batch):
+            response = client.post("/api/power/ingest", headers=headers, json=readings[offset:offset + args.batch])
+            assert response.json()["rejected"] == 0
+        elapsed = time.perf_counter() - started
+    print(f"bulk ingest: {args.rows} readings in {elapsed:.2f} s ({args.rows / elapsed:,.0f} readings/s)")
+    
+    if args.stages:
+        # The endpoint runs it in a worker thread, which cProfile doesn't follow
+        db = SessionLocal()
+        profile = cProfile.Profile()
+        profile.enable()
+        for offset in range(0, args.rows, args.batch):
+            store_readings(db, readings[offset:offset + args.batch])
+        profile.disable()
+        db.close()
+        print_stages(profile, args.rows)
+    
+    db = SessionLocal()
+    started = time.perf_counter()
+    for reading in readings[:args.orm_rows]:
+        db.add(PowerData(**reading))
+        db.commit()
+    elapsed = time.perf_counter() - started
+    db.close()
+    print(f"ORM, commit per reading: {args.orm_rows} readings in {elapsed:.2f} s ({args.orm_rows / elapsed:,.0f} readings/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Per-request and per-statement cost of the /metrics instrumentation.
+
+Times MetricsMiddleware around a no-op ASGI app against the bare app,
+and ``SELECT 1`` on an in-memory SQLite engine with and without
+``instrument_engine``. The differences are what every request and every
+statement pays for being recorded.
+
+    python benchmarks/bench_metrics_overhead.py
+"""
+import argparse
+import asyncio
+
+from common import median_time  # Configures the app before it is imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--statements", type=int, default=20000)
+    args = parser.parse_args()
+    
+    from sqlalchemy import create_engine, text
+    import main as app_main
+    from app.metrics import MetricsMiddleware, RequestStats, current_request, instrument_engine
+    
+    async def bare(scope, receive, send):
+        scope["endpoint"] = app_main.health_check
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+    
+    async def receive():
+        return {}
+    
+    async def send(message):
+        pass
+    
+    async def serve(asgi_app):
+        # "app" lets the middleware resolve the route template
+        scope = {"type": "http", "method": "GET", "path": "/health", "app": app_main.app}
+        for _ in range(args.requests):
+            await asgi_app(dict(scope), receive, send)
+    
+    for name, asgi_app in (("bare app", bare), ("with middleware", MetricsMiddleware(bare))):
+        elapsed = median_time(lambda: asyncio.run(serve(asgi_app)))
+        print(f"{name:22} {elapsed / args.requests * 1e6:8.2f} us/request")
+    
+    def execute(engine):
+        with engine.connect() as connection:
+            for _ in range(args.statements):
+                connection.execute(text("SELECT 1"))
+    
+    plain = create_engine("sqlite://")
+    instrumented = create_engine("sqlite://")
+    instrument_engine(instrumented)
+    current_request.set(RequestStats())
+    for name, engine in (("plain engine", plain), ("instrumented engine", instrumented)):
+        elapsed = median_time(lambda: execute(engine))
+        print(f"{name:22} {elapsed / args.statements * 1e6:8.2f} us/statement")
+
+
+if __name__ == "__main__":
+    main()
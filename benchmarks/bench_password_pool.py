@@ -0,0 +1,59 @@
+"""Login storms against the bounded bcrypt pool.
+
+Fires ``--concurrency`` password verifications at once at a
+PasswordHasher with ``--workers`` threads and ``--queue`` waiting slots,
+and reports how many ran, how many were rejected with 503 at once and
+how long the burst took. While it runs, a sync endpoint stand-in keeps
+using FastAPI's shared threadpool to show it is not starved.
+
+    python benchmarks/bench_password_pool.py --concurrency 10 --workers 1 --queue 2
+"""
+import argparse
+import asyncio
+import time
+
+from common import median_time  # Configures the app before it is imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--queue", type=int, default=2)
+    args = parser.parse_args()
+    
+    from fastapi import HTTPException
+    from starlette.concurrency import run_in_threadpool
+    from app.auth import PasswordHasher, get_password_hash, verify_password
+    
+    hashed = get_password_hash("password")
+    print(f"one bcrypt verify: {median_time(lambda: verify_password('password', hashed), repeat=3) * 1000:.0f} ms")
+    hasher = PasswordHasher(args.workers, args.queue)
+    
+    async def login():
+        try:
+            return await hasher.verify("password", hashed)
+        except HTTPException as e:
+            return e.status_code
+    
+    async def storm():
+        started = time.perf_counter()
+        logins = asyncio.gather(*(login() for _ in range(args.concurrency)))
+        # A sync endpoint's worth of threadpool work during the storm
+        threadpool_started = time.perf_counter()
+        await run_in_threadpool(time.sleep, 0.001)
+        threadpool_latency = time.perf_counter() - threadpool_started
+        results = await logins
+        return results, time.perf_counter() - started, threadpool_latency
+    
+    results, elapsed, threadpool_latency = asyncio.run(storm())
+    print(
+        f"{args.concurrency} concurrent logins on a {args.workers}+{args.queue} pool: "
+        f"{results.count(True)} verified, {results.count(503)} rejected with 503, "
+        f"burst took {elapsed * 1000:.0f} ms"
+    )
+    print(f"threadpool call during the storm: {threadpool_latency * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
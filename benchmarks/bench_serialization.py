@@ -0,0 +1,75 @@
+"""CPU per list response: response_model validation vs direct orjson.
+
+Builds ``--rows`` device, alert and history rows shaped like the trusted
+query results, checks both paths produce the same bytes, then reports
+the median process time of FastAPI's ``response_model`` serialization
+(validate, jsonable_encoder, JSONResponse) and of ``serialization.dumps``.
+
+    python benchmarks/bench_serialization.py --rows 1000 10000 100000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from common import median_time  # Configures the app before it is imported
+
+NOW = datetime(2026, 10, 18, 12, 0, 0)
+
+
+def device(i: int) -> dict:
+    from app.models import DeviceStatus, DeviceType
+    return {
+        "device_name": f"dev {i}", "device_type": DeviceType.OTHER, "location": "L1", "power_rating": 100.0 + i,
+        "id": i, "status": DeviceStatus.ON, "is_active": True, "created_at": NOW, "updated_at": NOW,
+        "current_power": 95.25 + i, "current_voltage": 221.4, "current_current": 0.43
+    }
+
+
+def alert(i: int) -> dict:
+    from app.models import AlertSeverity, AlertType
+    return {
+        "alert_type": AlertType.GENERAL, "message": f"Điện áp vượt quá mức {i}", "severity": AlertSeverity.HIGH,
+        "id": i, "device_id": i % 50, "is_read": False, "created_at": NOW, "device_name": "dev"
+    }
+
+
+def point(i: int) -> dict:
+    at = NOW + timedelta(minutes=i)
+    return {
+        "time": at.strftime('%Y-%m-%d %H:%M'), "timestamp": int(at.timestamp()), "reading_count": 12,
+        "avg_voltage": 220.12, "avg_current": 0.452, "avg_power": 99.5, "total_energy": 0.017,
+        "min_voltage": 219.0, "max_voltage": 221.3, "min_power": 95.1, "max_power": 104.2
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+    
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    from app.schemas import Alert, ChartData, Device
+    from app.serialization import dumps
+    
+    def response_model(field, data) -> bytes:
+        content = asyncio.run(serialize_response(field=field, response_content=data, is_coroutine=True))
+        return JSONResponse(content).body
+    
+    for name, model, make in (("devices", List[Device], device), ("alerts", List[Alert], alert), ("history", List[ChartData], point)):
+        field = create_response_field(name=f"Response_{name}", type_=model, mode="serialization")
+        for rows in args.rows:
+            data = [make(i) for i in range(rows)]
+            assert response_model(field, data) == dumps(data)
+            repeat = 7 if rows < 100000 else 3
+            validated = median_time(lambda: response_model(field, data), repeat, time.process_time)
+            direct = median_time(lambda: dumps(data), repeat, time.process_time)
+            print(f"{name:8} {rows:>7} rows  response_model {validated * 1000:8.1f} ms"
+                  f"  orjson {direct * 1000:7.1f} ms  saved {(validated - direct) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Per-minute grouping of raw readings: epoch buckets vs formatted strings.
+
+Fills power_data with ``--rows`` readings (one per second) and times the
+history aggregate grouped by ``time_bucket`` (integer epoch arithmetic)
+against the same aggregate grouped by a formatted timestamp string, the
+way the endpoint grouped before (DATE_FORMAT on MySQL, strftime here).
+
+    python benchmarks/bench_timebucket.py --rows 1000000
+"""
+import argparse
+from datetime import datetime, timedelta
+
+from common import create_devices, median_time  # Configures the app before it is imported
+
+
+def fill(rows: int, device_ids):
+    from sqlalchemy import insert
+    from app.database import engine
+    from app.models import PowerData
+    start = datetime(2026, 1, 1)
+    batch = 50000
+    with engine.begin() as connection:
+        for offset in range(0, rows, batch):
+            connection.execute(insert(PowerData), [
+                {"device_id": device_ids[i % len(device_ids)], "voltage": 220 + i % 20, "current": 1 + i % 5,
+                 "power": 200 + i % 50, "energy": 0.01, "recorded_at": start + timedelta(seconds=i)}
+                for i in range(offset, min(offset + batch, rows))
+            ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args()
+    
+    from sqlalchemy import func, select
+    from app.database import engine
+    from app.models import PowerData
+    from app.timebucket import time_bucket
+    
+    fill(args.rows, create_devices(10))
+    
+    def aggregate(bucket):
+        return select(
+            bucket.label("bucket"),
+            func.count(PowerData.id),
+            func.avg(PowerData.voltage),
+            func.avg(PowerData.power),
+            func.sum(PowerData.energy)
+        ).group_by(bucket).order_by(bucket)
+    
+    if engine.dialect.name == "mysql":
+        formatted = func.date_format(PowerData.recorded_at, "%Y-%m-%d %H:%i")
+    else:
+        formatted = func.strftime("%Y-%m-%d %H:%M", PowerData.recorded_at)
+    queries = {
+        "epoch time_bucket": aggregate(time_bucket(PowerData.recorded_at, 60)),
+        "formatted string": aggregate(formatted),
+    }
+    
+    with engine.connect() as connection:
+        for name, query in queries.items():
+            buckets = len(connection.execute(query).all())
+            elapsed = median_time(lambda: connection.execute(query).all(), repeat=5)
+            print(f"{name:18} {args.rows} rows -> {buckets} buckets: {elapsed:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""WebSocket broadcast fan-out to many clients.
+
+Connects ``--clients`` in-process fake sockets to a ConnectionManager,
+then times how long one broadcast takes to encode and queue for every
+client (median of 5), and how long ``--broadcasts`` more broadcasts
+take until every client has received all of them. One socket fails on send, to check
+that it is pruned.
+
+    python benchmarks/bench_ws_fanout.py --clients 10000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import median_time  # Configures the app before it is imported
+
+
+class FakeSocket:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.received = 0
+    
+    async def accept(self):
+        pass
+    
+    async def send_text(self, text: str):
+        if self.fail:
+            raise ConnectionError("client went away")
+        self.received += 1
+    
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def run(clients: int, broadcasts: int):
+    from app.websocket import ConnectionManager
+    manager = ConnectionManager(queue_size=broadcasts + 10)
+    sockets = [FakeSocket(fail=i == 0) for i in range(clients)]
+    for socket in sockets:
+        await manager.connect(socket)
+    
+    # Queued without awaiting any socket, so the writers don't run in between
+    message = {"type": "stats", "changes": {"devices_on": 1}}
+    enqueue = median_time(lambda: manager.send_text(json.dumps(message), ["stats"]), repeat=5)
+    
+    started = time.perf_counter()
+    for i in range(broadcasts):
+        await manager.broadcast({"type": "stats", "changes": {"devices_on": i}})
+    while any(socket.received < broadcasts + 5 for socket in sockets[1:]):
+        await asyncio.sleep(0.001)
+    delivered = time.perf_counter() - started
+    
+    print(f"one broadcast queued for {clients} clients in {enqueue * 1000:.1f} ms")
+    print(f"{broadcasts} broadcasts delivered to every client in {delivered:.2f} s")
+    print(f"failing socket pruned: {sockets[0] not in manager.active_connections}")
+    for socket in list(manager.active_connections):
+        manager.disconnect(socket)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--broadcasts", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.clients, args.broadcasts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Shared setup for the benchmark scripts.
+
+Import this before anything from ``app``: settings are read at import
+time, so it first points the app at a throwaway SQLite database and
+state directory. Set BENCH_DATABASE_URL to benchmark another database
+instead (it must be one you can fill with test data).
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = tempfile.mkdtemp(prefix="energy-bench-")
+os.environ["DATABASE_URL"] = os.environ.get("BENCH_DATABASE_URL", f"sqlite:///{os.path.join(STATE_DIR, 'bench.db')}")
+os.environ["SHARED_STATE_DIR"] = STATE_DIR
+os.environ.setdefault("ARCHIVE_DIR", os.path.join(STATE_DIR, "archive"))
+os.environ.setdefault("TSDB_DIR", os.path.join(STATE_DIR, "tsdb"))
+os.environ.setdefault("INGEST_SPOOL_DIR", os.path.join(STATE_DIR, "spool"))
+os.environ["DEBUG"] = "False"
+sys.path.insert(0, ROOT)
+# main.py mounts static/ relative to the working directory
+os.chdir(ROOT)
+
+
+def median_time(fn: Callable[[], object], repeat: int = 7, clock: Callable[[], float] = time.perf_counter) -> float:
+    """Median seconds of ``repeat`` calls to ``fn``"""
+    samples = []
+    for _ in range(repeat):
+        started = clock()
+        fn()
+        samples.append(clock() - started)
+    return statistics.median(samples)
+
+
+def create_schema():
+    from app.database import Base, engine
+    Base.metadata.create_all(bind=engine)
+
+
+def create_devices(count: int) -> List[int]:
+    """Add ``count`` active devices and return their ids"""
+    from app.database import SessionLocal
+    from app.models import Device, DeviceStatus
+    create_schema()
+    db = SessionLocal()
+    try:
+        devices = [
+            Device(device_name=f"bench {i}", power_rating=100.0 + i, status=DeviceStatus.ON, location=f"L{i % 4}")
+            for i in range(count)
+        ]
+        db.add_all(devices)
+        db.commit()
+        return [device.id for device in devices]
+    finally:
+        db.close()
+
+
+def login(client) -> dict:
+    """Bearer headers for a freshly created admin user"""
+    from app.auth import get_password_hash
+    from app.database import SessionLocal
+    from app.models import User
+    db = SessionLocal()
+    db.add(User(username="bench", password=get_password_hash("bench"), role="admin"))
+    db.commit()
+    db.close()
+    token = client.post("/api/auth/login", data={"username": "bench", "password": "bench"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
@@ -41,6 +41,46 @@ CREATE TABLE IF NOT EXISTS power_data (
     INDEX idx_device_time (device_id, recorded_at)
 );
 
+-- Bảng tổng hợp năng lượng theo ngày (cập nhật khi ghi dữ liệu)
+CREATE TABLE IF NOT EXISTS energy_daily (
+    day DATE PRIMARY KEY,
+    energy DOUBLE DEFAULT 0, -- Năng lượng tiêu thụ (kWh)
+    reading_count INT DEFAULT 0
+);
+
+-- Bảng tổng hợp năng lượng theo thiết bị và ngày
+CREATE TABLE IF NOT EXISTS device_energy_daily (
+    device_id INT,
+    day DATE,
+    energy DOUBLE DEFAULT 0, -- Năng lượng tiêu thụ (kWh)
+    reading_count INT DEFAULT 0,
+    PRIMARY KEY (device_id, day),
+    FOREIGN KEY (device_id) REFERENCES devices(id) ON DELETE CASCADE
+);
+
+-- Bảng tổng hợp dữ liệu điện năng theo các mức 1 phút, 15 phút, 1 giờ, 1 ngày
+CREATE TABLE IF NOT EXISTS power_rollup (
+    device_id INT,
+    resolution INT, -- Độ dài mỗi bucket (giây)
+    bucket BIGINT, -- Thời điểm bắt đầu bucket (epoch giây)
+    reading_count INT DEFAULT 0,
+    voltage_sum DOUBLE DEFAULT 0,
+    voltage_min DOUBLE,
+    voltage_max DOUBLE,
+    current_sum DOUBLE DEFAULT 0,
+    current_min DOUBLE,
+    current_max DOUBLE,
+    power_sum DOUBLE DEFAULT 0,
+    power_min DOUBLE,
+    power_max DOUBLE,
+    energy_sum DOUBLE DEFAULT 0,
+    energy_min DOUBLE,
+    energy_max DOUBLE,
+    PRIMARY KEY (device_id, resolution, bucket),
+    INDEX idx_rollup_bucket (resolution, bucket),
+    FOREIGN KEY (device_id) REFERENCES devices(id) ON DELETE CASCADE
+);
+
 -- Bảng cảnh báo
 CREATE TABLE IF NOT EXISTS alerts (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -94,5 +134,7 @@ INSERT INTO system_config (config_key, config_value, description) VALUES
 ('max_voltage', '250', 'Điện áp tối đa cho phép (V)'),
 ('min_voltage', '200', 'Điện áp tối thiểu cho phép (V)'),
 ('max_current', '16', 'Dòng điện tối đa cho phép (A)'),
+('alert_hysteresis_percent', '2', 'Giá trị phải trở lại trong ngưỡng thêm bao nhiêu % thì cảnh báo mới được xóa'),
+('alert_cooldown_seconds', '300', 'Không tạo lại cùng loại cảnh báo cho một thiết bị trong khoảng thời gian này (giây)'),
 ('alert_email', 'alerts@example.com', 'Email nhận cảnh báo'),
 ('data_retention_days', '90', 'Số ngày lưu trữ dữ liệu');
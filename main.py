@@ -1,23 +1,67 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, HTTPException, WebSocket, WebSocketDisconnect, status
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
 import json
 from datetime import datetime
 
 from app.config import settings
-from app.database import engine, Base
+from app.database import engine, async_engine, Base, async_pool_stats, database_stats, pool_stats
 from app.routers import auth, devices, power, alerts
+from app.websocket import manager
+from app.broadcast import broadcaster
+from app.events import bus
+from app.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, metrics
+from app.profiling import ProfileMiddleware, profiler
+from app.auth import get_websocket_user, is_admin
+from app.response_cache import response_cache
+from app.tsdb import reading_store
+from app.ingest_buffer import ingest_buffer
+from app.alert_rules import alert_engine
+
+# Messages a WebSocket client can send besides ping
+CLIENT_ACTIONS = ("subscribe", "unsubscribe")
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop per-worker background services"""
+    # Events from every worker are delivered to this worker's WebSocket clients
+    await broadcaster.start(manager.send_text)
+    # Events committed by request handlers are published from this loop
+    await bus.start()
+    # Warns about connections held too long while they are still held
+    await pool_stats.start()
+    if async_pool_stats is not None:
+        await async_pool_stats.start()
+    # Replays readings spooled by crashed workers before accepting new ones
+    if ingest_buffer is not None:
+        await ingest_buffer.start()
+    yield
+    # Flush buffered readings while events can still be published
+    if ingest_buffer is not None:
+        await ingest_buffer.stop()
+    await bus.stop()
+    await broadcaster.stop()
+    await pool_stats.stop()
+    if async_pool_stats is not None:
+        await async_pool_stats.stop()
+    if profiler is not None:
+        profiler.shutdown()
+    if async_engine is not None:
+        await async_engine.dispose()
+
+
 # Create FastAPI app
 app = FastAPI(
     title="Energy Monitoring System",
     description="Real-time energy monitoring and control system",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware
@@ -29,6 +73,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-route latency and database metrics, served on /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Statement profiling, only when SQL_PROFILE is on
+if profiler is not None:
+    app.add_middleware(ProfileMiddleware, profiler=profiler)
+
 # Include routers
 app.include_router(auth.router)
 app.include_router(devices.router)
@@ -40,44 +91,67 @@ app.include_router(alerts.router)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-    
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-    
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+def handle_client_action(connection, request: dict) -> dict:
+    """Apply a subscribe/unsubscribe request and build the reply"""
+    action = request.get("action")
+    try:
+        topics = request.get("topics")
+        if not isinstance(topics, list):
+            raise ValueError("topics must be a list")
+        if action == "subscribe":
+            manager.subscribe(connection, topics)
+        else:
+            manager.unsubscribe(connection, topics)
+    except ValueError as e:
+        return {"type": "error", "detail": str(e)}
     
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except:
-                pass
-
-
-manager = ConnectionManager()
+    return {"type": "subscriptions", "topics": sorted(connection.topics)}
 
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket endpoint for real-time updates"""
-    await manager.connect(websocket)
+    """WebSocket endpoint for real-time updates.
+    
+    The handshake must carry an access token (``/ws?token=<token>`` or a
+    bearer header); without a valid one the socket is closed with 1008
+    before it receives anything. Clients start subscribed to every event
+    (topic ``*``) and can narrow that down with ``{"action": "subscribe" | "unsubscribe", "topics": [...]}``.
+    Every event carries a ``seq``; a client reconnecting with
+    ``/ws?since=<last seq>`` first gets the missed events and ``resumed``,
+    or a ``resync`` telling it to reload over REST. Any other message is
+    answered with a pong.
+    """
+    if await get_websocket_user(websocket) is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    try:
+        since = int(websocket.query_params["since"])
+    except KeyError:
+        since = None
+    except ValueError:
+        # Can't be resumed from
+        since = -1
+    connection = await manager.connect(websocket, since)
+    connection.offer(json.dumps({"type": "hello", "seq": connection.connected_seq}))
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_text()
+            try:
+                request = json.loads(data)
+            except ValueError:
+                request = None
             
-            # Echo back for now (can be extended for real-time data)
-            await websocket.send_json({
-                "type": "pong",
-                "timestamp": datetime.now().isoformat()
-            })
+            # Reply through the client's queue so it never races the writer task
+            if isinstance(request, dict) and request.get("action") in CLIENT_ACTIONS:
+                reply = handle_client_action(connection, request)
+            else:
+                reply = {"type": "pong", "timestamp": datetime.now().isoformat()}
+            connection.offer(json.dumps(reply))
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
 
 
@@ -97,40 +171,35 @@ async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now().isoformat(),
+        "websocket": {
+            "connections": len(manager.active_connections),
+            "topics": len(manager.subscriptions),
+            "broadcast": broadcaster.stats(),
+            "events": bus.stats()
+        },
+        "database": database_stats(),
+        "response_cache": response_cache.stats(),
+        "storage": reading_store.stats() if reading_store is not None else {"engine": "sql"},
+        "ingest_buffer": ingest_buffer.stats() if ingest_buffer is not None else None,
+        "alerts": alert_engine.stats()
     }
 
 
-# Broadcast device status updates (can be called from routers)
-async def broadcast_device_update(device_id: int, status: str):
-    """Broadcast device status update to all connected clients"""
-    await manager.broadcast({
-        "type": "device_update",
-        "device_id": device_id,
-        "status": status,
-        "timestamp": datetime.now().isoformat()
-    })
-
-
-# Broadcast new power data (can be called when new data arrives)
-async def broadcast_power_data(device_id: int, data: dict):
-    """Broadcast new power data to all connected clients"""
-    await manager.broadcast({
-        "type": "power_data",
-        "device_id": device_id,
-        "data": data,
-        "timestamp": datetime.now().isoformat()
-    })
-
-
-# Broadcast new alert
-async def broadcast_alert(alert: dict):
-    """Broadcast new alert to all connected clients"""
-    await manager.broadcast({
-        "type": "alert",
-        "alert": alert,
-        "timestamp": datetime.now().isoformat()
-    })
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Prometheus metrics of this worker"""
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/metrics/sql", include_in_schema=False)
+async def sql_profile(admin: bool = Depends(is_admin)):
+    """Top SQL statements by total time over the profiling window (admin only)"""
+    if profiler is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="SQL profiling is disabled")
+    if not admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return profiler.report()
 
 
 if __name__ == "__main__":
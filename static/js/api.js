@@ -6,6 +6,13 @@ const WS_URL = `ws://${window.location.host}/ws`;
 let ws = null;
 let reconnectInterval = null;
 
+// Topics this page is subscribed to; re-sent after every reconnect
+const wsTopics = new Set();
+
+// Sequence number of the last event received, used to resume after a reconnect
+let lastSeq = null;
+let wsConnectedBefore = false;
+
 // Authentication token
 let authToken = localStorage.getItem('token');
 
@@ -15,7 +22,14 @@ function connectWebSocket() {
         return;
     }
     
-    ws = new WebSocket(WS_URL);
+    // Browsers can't send headers on a WebSocket, so the token goes in the URL.
+    // Resuming from the last event: the server replays what was missed
+    // before any newer event, or answers 'resync'
+    const params = new URLSearchParams({ token: authToken });
+    if (lastSeq !== null) {
+        params.set('since', lastSeq);
+    }
+    ws = new WebSocket(`${WS_URL}?${params}`);
     
     ws.onopen = () => {
         console.log('WebSocket connected');
@@ -23,15 +37,31 @@ function connectWebSocket() {
             clearInterval(reconnectInterval);
             reconnectInterval = null;
         }
+        if (wsTopics.size > 0) {
+            sendWebSocketAction('subscribe', [...wsTopics]);
+        }
+        if (lastSeq === null && wsConnectedBefore && typeof onResync === 'function') {
+            onResync();
+        }
+        wsConnectedBefore = true;
     };
     
     ws.onmessage = (event) => {
         const data = JSON.parse(event.data);
+        // 'hello' only starts the count; a resumed connection catches up event by event
+        if (data.type === 'hello') {
+            if (lastSeq === null) lastSeq = data.seq;
+        } else if (typeof data.seq === 'number' && (lastSeq === null || data.seq > lastSeq)) {
+            lastSeq = data.seq;
+        }
         handleWebSocketMessage(data);
     };
     
     ws.onclose = () => {
         console.log('WebSocket disconnected');
+        if (typeof onWebSocketClosed === 'function') {
+            onWebSocketClosed();
+        }
         // Reconnect after 5 seconds
         if (!reconnectInterval) {
             reconnectInterval = setInterval(() => {
@@ -45,9 +75,44 @@ function connectWebSocket() {
     };
 }
 
+// Send a subscribe/unsubscribe request if the socket is open
+function sendWebSocketAction(action, topics) {
+    if (ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ action, topics }));
+    }
+}
+
+// Subscribe to topics: 'device:{id}', 'location:{name}', 'alerts', 'stats'.
+// New connections receive every event ('*') until it is unsubscribed.
+function subscribeTopics(topics) {
+    topics.forEach(topic => wsTopics.add(topic));
+    sendWebSocketAction('subscribe', topics);
+}
+
+function unsubscribeTopics(topics) {
+    topics.forEach(topic => wsTopics.delete(topic));
+    sendWebSocketAction('unsubscribe', topics);
+}
+
 // Handle WebSocket messages
 function handleWebSocketMessage(data) {
     switch (data.type) {
+        case 'resumed':
+            if (typeof onWebSocketResumed === 'function') {
+                onWebSocketResumed();
+            }
+            break;
+        case 'resync':
+            // Missed events are gone; reload the page state over REST
+            if (typeof onResync === 'function') {
+                onResync();
+            }
+            break;
+        case 'stats':
+            if (typeof onStats === 'function') {
+                onStats(data);
+            }
+            break;
         case 'device_update':
             if (typeof onDeviceUpdate === 'function') {
                 onDeviceUpdate(data);
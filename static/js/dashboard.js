@@ -1,5 +1,14 @@
 let powerChart, voltageChart;
 
+// Page state kept up to date by WebSocket deltas
+let devicesById = new Map();
+let alertsList = [];
+let chartPoints = [];
+let renderPending = false;
+
+// REST polling, only used while the WebSocket is down
+let pollTimers = [];
+
 // Load dashboard data
 async function loadDashboard() {
     await Promise.all([
@@ -15,10 +24,23 @@ async function loadStats() {
     const data = await apiCall('/api/devices/stats');
     
     if (data) {
-        document.getElementById('totalDevices').textContent = data.total_devices;
-        document.getElementById('devicesOn').textContent = data.devices_on;
-        document.getElementById('currentPower').textContent = formatNumber(data.current_power, 0) + ' W';
-        document.getElementById('todayEnergy').textContent = formatNumber(data.today_energy, 2) + ' kWh';
+        applyStats(data);
+    }
+}
+
+// Show stats counters; only the keys present are updated
+function applyStats(stats) {
+    if ('total_devices' in stats) {
+        document.getElementById('totalDevices').textContent = stats.total_devices;
+    }
+    if ('devices_on' in stats) {
+        document.getElementById('devicesOn').textContent = stats.devices_on;
+    }
+    if ('current_power' in stats) {
+        document.getElementById('currentPower').textContent = formatNumber(stats.current_power, 0) + ' W';
+    }
+    if ('today_energy' in stats) {
+        document.getElementById('todayEnergy').textContent = formatNumber(stats.today_energy, 2) + ' kWh';
     }
 }
 
@@ -27,69 +49,82 @@ async function loadDevices() {
     const devices = await apiCall('/api/devices/');
     
     if (devices) {
-        const grid = document.getElementById('devicesGrid');
-        
-        if (devices.length === 0) {
-            grid.innerHTML = '<p class="text-muted">Chưa có thiết bị nào</p>';
-            return;
-        }
-        
-        // Show first 6 devices
-        const displayDevices = devices.slice(0, 6);
-        
-        grid.innerHTML = displayDevices.map(device => `
-            <div class="device-card ${device.status === 'on' ? 'device-on' : 'device-off'}">
-                <div class="device-icon">${getDeviceIcon(device.device_type)}</div>
-                <div class="device-info">
-                    <h4>${device.device_name}</h4>
-                    <p class="device-location">${device.location || ''}</p>
-                    <p class="device-power">${formatNumber(device.current_power, 0)} W</p>
-                </div>
-                <div class="device-actions">
-                    <button class="btn-toggle ${device.status === 'on' ? 'btn-on' : 'btn-off'}" 
-                            onclick="toggleDevice(${device.id})">
-                        ${device.status === 'on' ? 'BẬT' : 'TẮT'}
-                    </button>
-                </div>
-            </div>
-        `).join('');
+        devicesById = new Map(devices.map(device => [device.id, device]));
+        renderDevices();
     }
 }
 
+// Render the device grid from page state
+function renderDevices() {
+    const grid = document.getElementById('devicesGrid');
+    
+    if (devicesById.size === 0) {
+        grid.innerHTML = '<p class="text-muted">Chưa có thiết bị nào</p>';
+        return;
+    }
+    
+    // Show first 6 devices
+    const displayDevices = [...devicesById.values()].slice(0, 6);
+    
+    grid.innerHTML = displayDevices.map(device => `
+        <div class="device-card ${device.status === 'on' ? 'device-on' : 'device-off'}">
+            <div class="device-icon">${getDeviceIcon(device.device_type)}</div>
+            <div class="device-info">
+                <h4>${device.device_name}</h4>
+                <p class="device-location">${device.location || ''}</p>
+                <p class="device-power">${formatNumber(device.current_power, 0)} W</p>
+            </div>
+            <div class="device-actions">
+                <button class="btn-toggle ${device.status === 'on' ? 'btn-on' : 'btn-off'}" 
+                        onclick="toggleDevice(${device.id})">
+                    ${device.status === 'on' ? 'BẬT' : 'TẮT'}
+                </button>
+            </div>
+        </div>
+    `).join('');
+}
+
 // Load alerts
 async function loadAlerts() {
     const alerts = await apiCall('/api/alerts/?limit=5');
     
     if (alerts) {
-        const list = document.getElementById('alertsList');
-        const badge = document.getElementById('alertBadge');
-        
-        const unreadCount = alerts.filter(a => !a.is_read).length;
-        badge.textContent = unreadCount;
-        badge.style.display = unreadCount > 0 ? 'inline-block' : 'none';
-        
-        if (alerts.length === 0) {
-            list.innerHTML = '<p class="text-muted">Không có cảnh báo</p>';
-            return;
-        }
-        
-        list.innerHTML = alerts.map(alert => `
-            <div class="alert-item ${getSeverityClass(alert.severity)} ${alert.is_read ? 'alert-read' : ''}">
-                <div class="alert-header">
-                    <span class="alert-device">${alert.device_name || 'Hệ thống'}</span>
-                    <span class="alert-time">${formatTime(alert.created_at)}</span>
-                </div>
-                <div class="alert-message">${alert.message}</div>
-            </div>
-        `).join('');
+        alertsList = alerts;
+        renderAlerts();
     }
 }
 
+// Render the alert list from page state
+function renderAlerts() {
+    const list = document.getElementById('alertsList');
+    const badge = document.getElementById('alertBadge');
+    
+    const unreadCount = alertsList.filter(a => !a.is_read).length;
+    badge.textContent = unreadCount;
+    badge.style.display = unreadCount > 0 ? 'inline-block' : 'none';
+    
+    if (alertsList.length === 0) {
+        list.innerHTML = '<p class="text-muted">Không có cảnh báo</p>';
+        return;
+    }
+    
+    list.innerHTML = alertsList.map(alert => `
+        <div class="alert-item ${getSeverityClass(alert.severity)} ${alert.is_read ? 'alert-read' : ''}">
+            <div class="alert-header">
+                <span class="alert-device">${alert.device_name || 'Hệ thống'}</span>
+                <span class="alert-time">${formatTime(alert.created_at)}</span>
+            </div>
+            <div class="alert-message">${alert.message}</div>
+        </div>
+    `).join('');
+}
+
 // Load chart data
 async function loadChartData() {
     const data = await apiCall('/api/power/history?hours=24');
     
     if (data && data.length > 0) {
+        chartPoints = data;
         const labels = data.map(d => d.time);
         const powerData = data.map(d => d.avg_power);
         const voltageData = data.map(d => d.avg_voltage);
@@ -158,6 +193,61 @@ async function loadChartData() {
     }
 }
 
+// Fold a pushed reading into the newest chart point, or start a new one
+function addChartReading(reading) {
+    if (chartPoints.length < 2 || !powerChart || !voltageChart) {
+        return;
+    }
+    
+    const width = chartPoints[1].timestamp - chartPoints[0].timestamp;
+    const timestamp = reading.timestamp || Math.floor(Date.now() / 1000);
+    const last = chartPoints[chartPoints.length - 1];
+    
+    if (timestamp < last.timestamp) {
+        return;
+    }
+    
+    if (timestamp < last.timestamp + width) {
+        // Running average over the bucket's readings
+        const count = last.reading_count || 1;
+        last.avg_power = (last.avg_power * count + reading.power) / (count + 1);
+        last.avg_voltage = (last.avg_voltage * count + reading.voltage) / (count + 1);
+        last.reading_count = count + 1;
+    } else {
+        const bucket = timestamp - (timestamp - last.timestamp) % width;
+        const date = new Date(bucket * 1000);
+        const pad = n => String(n).padStart(2, '0');
+        chartPoints.push({
+            timestamp: bucket,
+            time: `${date.getFullYear()}-${pad(date.getMonth() + 1)}-${pad(date.getDate())} ${pad(date.getHours())}:${pad(date.getMinutes())}`,
+            avg_power: reading.power,
+            avg_voltage: reading.voltage,
+            reading_count: 1
+        });
+        chartPoints.shift();
+    }
+    
+    const labels = chartPoints.map(d => d.time);
+    powerChart.data.labels = labels;
+    powerChart.data.datasets[0].data = chartPoints.map(d => d.avg_power);
+    voltageChart.data.labels = labels;
+    voltageChart.data.datasets[0].data = chartPoints.map(d => d.avg_voltage);
+}
+
+// Redraw at most once per frame however many deltas arrive
+function scheduleRender() {
+    if (renderPending) {
+        return;
+    }
+    renderPending = true;
+    requestAnimationFrame(() => {
+        renderPending = false;
+        renderDevices();
+        if (powerChart) powerChart.update('none');
+        if (voltageChart) voltageChart.update('none');
+    });
+}
+
 // Toggle device
 async function toggleDevice(deviceId) {
     const data = await apiCall(`/api/devices/${deviceId}/toggle`, {
@@ -166,7 +256,12 @@ async function toggleDevice(deviceId) {
     
     if (data && data.success) {
         showNotification(data.message, 'success');
-        await loadDashboard();
+        // Other counters arrive as WebSocket deltas
+        const device = devicesById.get(deviceId);
+        if (device) {
+            device.status = data.new_status;
+            scheduleRender();
+        }
     }
 }
 
@@ -176,30 +271,78 @@ async function refreshData() {
     await loadDashboard();
 }
 
+// Fall back to polling while the WebSocket is down
+function startPolling() {
+    if (pollTimers.length > 0) {
+        return;
+    }
+    pollTimers = [
+        setInterval(() => {
+            loadStats();
+            loadDevices();
+        }, 10000),
+        setInterval(loadChartData, 30000)
+    ];
+}
+
+function stopPolling() {
+    pollTimers.forEach(timer => clearInterval(timer));
+    pollTimers = [];
+}
+
 // WebSocket handlers
+function onWebSocketClosed() {
+    startPolling();
+}
+
+function onWebSocketResumed() {
+    stopPolling();
+}
+
+function onResync() {
+    stopPolling();
+    loadDashboard();
+}
+
 function onDeviceUpdate(data) {
-    loadDevices();
-    loadStats();
+    const device = devicesById.get(data.device_id);
+    if (!device) {
+        // A device this page hasn't seen yet
+        loadDevices();
+        return;
+    }
+    
+    if (data.changes.is_active === false) {
+        devicesById.delete(data.device_id);
+    } else {
+        Object.assign(device, data.changes);
+    }
+    scheduleRender();
 }
 
 function onPowerData(data) {
-    loadChartData();
+    const device = devicesById.get(data.device_id);
+    if (device) {
+        device.current_power = data.data.power;
+        device.current_voltage = data.data.voltage;
+        device.current_current = data.data.current;
+    }
+    addChartReading(data.data);
+    scheduleRender();
+}
+
+function onStats(data) {
+    applyStats(data.changes);
 }
 
 function onAlert(data) {
-    loadAlerts();
+    alertsList = [data.alert, ...alertsList].slice(0, 5);
+    renderAlerts();
     showNotification('Có cảnh báo mới!', 'warning');
 }
 
 // Initialize
 document.addEventListener('DOMContentLoaded', () => {
+    // Later changes arrive over the WebSocket
     loadDashboard();
-    
-    // Auto refresh
-    setInterval(() => {
-        loadStats();
-        loadDevices();
-    }, 10000);
-    
-    setInterval(loadChartData, 30000);
 });
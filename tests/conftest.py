@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+
+# Settings are read when the app is imported, so point it at a throwaway
+# SQLite database and state directories first
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = tempfile.mkdtemp(prefix="energy-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(STATE_DIR, 'test.db')}"
+os.environ["SHARED_STATE_DIR"] = STATE_DIR
+os.environ["ARCHIVE_DIR"] = os.path.join(STATE_DIR, "archive")
+os.environ["TSDB_DIR"] = os.path.join(STATE_DIR, "tsdb")
+os.environ["INGEST_SPOOL_DIR"] = os.path.join(STATE_DIR, "spool")
+os.environ["DEBUG"] = "False"
+sys.path.insert(0, ROOT)
+# main.py mounts static/ relative to the working directory
+os.chdir(ROOT)
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from app.auth import get_password_hash
+from app.database import SessionLocal
+from app.models import User
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    db = SessionLocal()
+    db.add(User(username="admin", password=get_password_hash("password"), role="admin"))
+    db.commit()
+    db.close()
+    response = client.post("/api/auth/login", data={"username": "admin", "password": "password"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
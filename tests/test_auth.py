@@ -0,0 +1,40 @@
+from app import auth
+from app.auth import FailedLoginTracker
+
+
+def test_failed_logins_slow_down_only_the_failing_client(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(auth.time, "monotonic", lambda: now[0])
+    tracker = FailedLoginTracker(max_failures=3, window=60)
+    
+    for _ in range(3):
+        assert tracker.retry_after("admin", "10.0.0.1") == 0
+        tracker.record_failure("admin", "10.0.0.1")
+    assert tracker.retry_after("admin", "10.0.0.1") == 1
+    # The same username from another address is not held back
+    assert tracker.retry_after("admin", "10.0.0.2") == 0
+    
+    # Every further failure doubles the wait, up to the window
+    now[0] += 1
+    assert tracker.retry_after("admin", "10.0.0.1") == 0
+    tracker.record_failure("admin", "10.0.0.1")
+    assert tracker.retry_after("admin", "10.0.0.1") == 2
+    for _ in range(10):
+        tracker.record_failure("admin", "10.0.0.1")
+    assert tracker.retry_after("admin", "10.0.0.1") == 60
+    
+    # Failures are forgotten a window after the last one
+    now[0] += 60
+    assert tracker.retry_after("admin", "10.0.0.1") == 0
+    tracker.record_failure("admin", "10.0.0.1")
+    assert tracker.retry_after("admin", "10.0.0.1") == 0
+
+
+def test_login_answers_429_while_throttled(client):
+    for _ in range(auth.settings.LOGIN_MAX_FAILURES):
+        response = client.post("/api/auth/login", data={"username": "nobody", "password": "wrong"})
+        assert response.status_code == 401
+    
+    response = client.post("/api/auth/login", data={"username": "nobody", "password": "wrong"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
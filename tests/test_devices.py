@@ -0,0 +1,70 @@
+from app.metrics import metrics
+from app.readings import latest_cache
+
+
+def create_device(client, auth_headers, name: str) -> int:
+    response = client.post("/api/devices/", headers=auth_headers, json={"device_name": name, "power_rating": 100})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def add_reading(client, auth_headers, device_id: int):
+    response = client.post("/api/power/ingest", headers=auth_headers, json=[
+        {"device_id": device_id, "voltage": 230, "current": 1, "power": 230, "energy": 0.1}
+    ])
+    assert response.json()["accepted"] == 1
+
+
+def list_statements(client, auth_headers):
+    """SQL statements run by one uncached GET /api/devices/, and the devices listed"""
+    # Make the latest readings come from the database, not the in-process cache
+    latest_cache._version = None
+    route = metrics.routes.get(("GET", "/api/devices/"))
+    before = route.statements.total if route else 0
+    
+    response = client.get("/api/devices/", headers=auth_headers)
+    assert response.status_code == 200
+    return int(metrics.routes[("GET", "/api/devices/")].statements.total - before), len(response.json())
+
+
+def test_device_list_query_count_is_constant(client, auth_headers):
+    add_reading(client, auth_headers, create_device(client, auth_headers, "first"))
+    one, listed = list_statements(client, auth_headers)
+    assert listed == 1
+    
+    for i in range(20):
+        add_reading(client, auth_headers, create_device(client, auth_headers, f"device {i}"))
+    many, listed = list_statements(client, auth_headers)
+    assert listed == 21
+    
+    assert one > 0
+    assert many == one
+
+
+def ingest_statements(client, auth_headers, readings) -> int:
+    """SQL statements run by one POST /api/power/ingest"""
+    route = metrics.routes.get(("POST", "/api/power/ingest"))
+    before = route.statements.total if route else 0
+    
+    response = client.post("/api/power/ingest", headers=auth_headers, json=readings)
+    assert response.json()["accepted"] == len(readings)
+    return int(metrics.routes[("POST", "/api/power/ingest")].statements.total - before)
+
+
+def test_ingest_query_count_is_constant(client, auth_headers):
+    device_ids = [create_device(client, auth_headers, f"ingest {i}") for i in range(10)]
+    
+    def batch(devices, size):
+        return [
+            {"device_id": devices[i % len(devices)], "voltage": 230, "current": 1, "power": 200 + i % 50, "energy": 0.01}
+            for i in range(size)
+        ]
+    
+    # The alert rules and device types are loaded on first use
+    ingest_statements(client, auth_headers, batch(device_ids, 10))
+    one = ingest_statements(client, auth_headers, batch(device_ids[:1], 10))
+    many = ingest_statements(client, auth_headers, batch(device_ids, 500))
+    
+    # One executemany INSERT and one latest-row lookup, however many devices and readings
+    assert many == one
+    assert one < 20
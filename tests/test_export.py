@@ -0,0 +1,121 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from app.database import Base
+from conftest import ROOT, STATE_DIR
+
+# Streams an export in a fresh process and reports bytes sent and peak RSS (KiB)
+EXPORT_SCRIPT = """
+import resource
+from app.export import EXPORT_FORMATS, iter_reading_chunks
+size = 0
+for part in EXPORT_FORMATS["{format}"].stream(iter_reading_chunks(None, None, None, 1000)):
+    size += len(part)
+print(size, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+# Ingests readings at 10:00-15:00 local time and exports ranges given
+# with a UTC offset or as bare dates, printing the rows of each export
+RANGE_SCRIPT = """
+import json
+from fastapi.testclient import TestClient
+import main
+from app.auth import get_password_hash
+from app.database import SessionLocal
+from app.models import Device, User
+db = SessionLocal()
+db.add(User(username="admin", password=get_password_hash("password"), role="admin"))
+db.add(Device(device_name="meter", power_rating=100))
+db.commit()
+db.close()
+with TestClient(main.app) as client:
+    token = client.post("/api/auth/login", data={{"username": "admin", "password": "password"}}).json()["access_token"]
+    headers = {{"Authorization": f"Bearer {{token}}"}}
+    client.post("/api/power/ingest", headers=headers, json=[
+        {{"device_id": 1, "voltage": 230, "current": 1, "power": 230, "energy": 0.1,
+         "recorded_at": f"2026-01-01T{{hour}}:00:00"}}
+        for hour in range(10, 16)
+    ])
+    result = {{}}
+    for query in ("from=2026-01-01T05:00:00Z&to=2026-01-01T07:00:00Z", "from=2020-01-01T00:00:00Z&to=2030-01-01"):
+        response = client.get(f"/api/power/export?format=ndjson&{{query}}", headers=headers)
+        result[query] = [response.status_code] + [json.loads(line)["recorded_at"] for line in response.text.splitlines()]
+print(json.dumps(result))
+"""
+
+
+def reading_database(name: str, rows: int) -> str:
+    """A SQLite database holding ``rows`` readings, one per second"""
+    path = os.path.join(STATE_DIR, name)
+    url = f"sqlite:///{path}"
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    
+    start = datetime(2026, 1, 1)
+    with sqlite3.connect(path) as connection:
+        connection.executemany(
+            "INSERT INTO power_data (device_id, voltage, current, power, energy, power_factor, frequency, recorded_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (1 + i % 10, 220 + i % 20 / 3, 1 + i % 7 / 3, 200 + i % 50 / 3, 0.01, 0.95, 50.0,
+                 (start + timedelta(seconds=i)).isoformat(sep=" "))
+                for i in range(rows)
+            )
+        )
+    return url
+
+
+def export_peak(url: str, format: str):
+    env = dict(os.environ, DATABASE_URL=url)
+    output = subprocess.run(
+        [sys.executable, "-c", EXPORT_SCRIPT.format(format=format)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout.split()
+    return int(output[0]), int(output[1])
+
+
+def test_export_memory_does_not_grow_with_range():
+    small = reading_database("export_small.db", 10000)
+    large = reading_database("export_large.db", 300000)
+    
+    for format in ("csv", "ndjson"):
+        small_size, small_peak = export_peak(small, format)
+        large_size, large_peak = export_peak(large, format)
+        assert large_size > 25 * small_size
+        # Buffering the large export would add well over 100 MB
+        assert large_peak - small_peak < 25 * 1024, (format, small_peak, large_peak)
+
+
+def test_export_range_with_utc_offset_and_dates():
+    for storage in ("sql", "columnar"):
+        state = os.path.join(STATE_DIR, f"export_range_{storage}")
+        env = dict(
+            os.environ,
+            # 05:00Z is 12:00 in UTC+7
+            TZ="Asia/Ho_Chi_Minh",
+            POWER_STORAGE=storage,
+            DATABASE_URL=f"sqlite:///{state}.db",
+            SHARED_STATE_DIR=state,
+            TSDB_DIR=os.path.join(state, "tsdb"),
+            ARCHIVE_DIR=os.path.join(state, "archive"),
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", RANGE_SCRIPT.format()],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        
+        status, *times = result["from=2026-01-01T05:00:00Z&to=2026-01-01T07:00:00Z"]
+        assert status == 200
+        assert [moment[11:16] for moment in times] == ["12:00", "13:00"], storage
+        status, *times = result["from=2020-01-01T00:00:00Z&to=2030-01-01"]
+        assert status == 200
+        assert len(times) == 6, storage